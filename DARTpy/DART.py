@@ -4,19 +4,39 @@
 
 import numpy as np
 from netCDF4 import Dataset
+from netCDF4 import chartostring
 import datetime as datetime
 import dayconv 
 import os.path
 import pandas as pd
 import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 import experiment_settings as es
 
+# decoded metadata tables of DART output files, keyed by file path and modification time -- see file_metadata_index 
+file_metadata_cache = dict()
+
+# pool of open (read-only) netcdf files shared by all the loaders, in least-recently-used order -- see open_netcdf_file
+netcdf_pool = OrderedDict()
+netcdf_pool_lock = threading.RLock()
+netcdf_pool_pid = os.getpid()
+netcdf_max_open_files = 32
+
+# Basemap instances and the grids projected onto them, keyed by projection, extent, and resolution -- see cached_basemap
+basemap_cache = dict()
+
 def load_covariance_file(E,date,hostname='taurus',debug=False):
 
 	"""
 	this subroutine loads in a pre-computed file of state-to-observation covariances and correlations.
 	the state variable is given by E['variable']
 	the observation is given by E['obs_name']
+
+	The covariances are taken from the file that collects all the dates for the experiment 
+	(see DART_state_space.make_state_to_obs_covariance_series) if it has them, 
+	and otherwise from the older files that hold a single date, obs, and variable. 
 	"""
 
 	# find the directory for this run   
@@ -24,6 +44,15 @@ def load_covariance_file(E,date,hostname='taurus',debug=False):
 	# but written my each user -- it should take an experiment dictionary and the hostname 
 	# as input, and return as output 
 	# the filepath that corresponds to the desired field, diagnostic, etc. 
+	filename = es.find_paths(E,date,file_type='covariance_series',hostname=hostname)
+	if (filename is not None) and os.path.exists(filename):
+		with netcdf_file(filename) as f:
+			Cout = load_covariance_series_date(f,E,date)
+		if Cout is not None:
+			return Cout
+		if debug:
+			print('+++cannot find '+E['variable']+' vs '+E['obs_name']+' on '+date.strftime('%Y-%m-%d')+' in '+filename)
+
 	filename = es.find_paths(E,date,file_type='covariance',hostname=hostname)
 	if not os.path.exists(filename):
 		if debug:
@@ -36,67 +65,169 @@ def load_covariance_file(E,date,hostname='taurus',debug=False):
 	lon = f.variables['lon'][:]
 	if E['variable']!='PS':
 		lev = f.variables['lev'][:]
-	time = f.variables['time'][:]
-	Correlation = f.variables['Correlation'][:]
-	Covariance = f.variables['Covariance'][:]
-	f.close()
+	else:
+		lev = None
+	k1,k2,j1,j2,i1,i2 = covariance_file_ranges(E,lev,lat,lon)
 
 	# squeeze out the time dimension -- for now. Might make this longer than 1 later
-	# also select the right level, lat, and lon ranges
+	if E['variable']=='PS':
+		R = np.squeeze(f.variables['Correlation'][j1:j2+1,i1:i2+1,0])
+		C = np.squeeze(f.variables['Covariance'][j1:j2+1,i1:i2+1,0])
+		lev2 = None
+	else:
+		R = np.squeeze(f.variables['Correlation'][j1:j2+1,i1:i2+1,k1:k2+1,0])
+		C = np.squeeze(f.variables['Covariance'][j1:j2+1,i1:i2+1,k1:k2+1,0])
+		lev2 = lev[k1:k2+1]
+	f.close()
+
+	# return covariance and correlation grids 
+	return  lev2, lat[j1:j2+1], lon[i1:i2+1], C, R
+
+def covariance_file_ranges(E,lev,lat,lon):
+
+	# select the right level, lat, and lon ranges from the grid of a covariance file 
 	# figure out which vertical level range we want
-	if E['variable'] !='PS':
+	if lev is not None:
 		levrange=E['levrange']
 		k1 = (np.abs(lev-levrange[1])).argmin()
 		k2 = (np.abs(lev-levrange[0])).argmin()
-		lev2 = lev[k1:k2+1]
+	else:
+		k1 = None
+		k2 = None
 
 	# figure out which latitude range we want
 	latrange=E['latrange']
 	j2 = (np.abs(lat-latrange[1])).argmin()
 	j1 = (np.abs(lat-latrange[0])).argmin()
-	lat2 = lat[j1:j2+1]
 
 	# figure out which longitude range we want
 	lonrange=E['lonrange']
 	i2 = (np.abs(lon-lonrange[1])).argmin()
 	i1 = (np.abs(lon-lonrange[0])).argmin()
-	lon2 = lon[i1:i2+1]
 
-	if E['variable']=='PS':
-		R = np.squeeze(Correlation[j1:j2+1,i1:i2+1,0])
-		C = np.squeeze(Covariance[j1:j2+1,i1:i2+1,0])
+	return k1,k2,j1,j2,i1,i2
+
+def load_covariance_series_date(f,E,date):
+
+	"""
+	read the covariances and correlations between the state variable E['variable'] and the 
+	observation E['obs_name'] for one date out of an open file written by 
+	DART_state_space.make_state_to_obs_covariance_series -- only the requested 
+	lat, lon, and level ranges are read from the file. 
+
+	Returns lev, lat, lon, Covariance, Correlation like load_covariance_file, or None if the 
+	file doesn't have this date, observation, or variable. 
+	"""
+
+	if E['variable'] not in f.groups:
+		return None
+	obs_names = list(f.variables['obs_name'][:])
+	if E['obs_name'] not in obs_names:
+		return None
+	io = obs_names.index(E['obs_name'])
+
+	# find the time index for this date 
+	time = f.variables['time'][:]
+	G = f.groups[E['variable']]
+	it = np.flatnonzero(np.abs(np.ma.filled(time,np.nan)-covariance_series_time(date)) < 1E-3)
+	if len(it) == 0:
+		return None
+	it = it[0]
+	if np.ma.filled(G.variables['written'][it],0) == 0:
+		return None
+
+	lat = G.variables['lat'][:]
+	lon = G.variables['lon'][:]
+	if 'lev' in G.variables:
+		lev = G.variables['lev'][:]
+	else:
+		lev = None
+	k1,k2,j1,j2,i1,i2 = covariance_file_ranges(E,lev,lat,lon)
+
+	if lev is None:
+		C = np.squeeze(G.variables['Covariance'][it,io,j1:j2+1,i1:i2+1])
+		R = np.squeeze(G.variables['Correlation'][it,io,j1:j2+1,i1:i2+1])
 		lev2 = None
 	else:
-		R = np.squeeze(Correlation[j1:j2+1,i1:i2+1,k1:k2+1,0])
-		C = np.squeeze(Covariance[j1:j2+1,i1:i2+1,k1:k2+1,0])
+		C = np.squeeze(G.variables['Covariance'][it,io,j1:j2+1,i1:i2+1,k1:k2+1])
+		R = np.squeeze(G.variables['Correlation'][it,io,j1:j2+1,i1:i2+1,k1:k2+1])
+		lev2 = lev[k1:k2+1]
 
-	# return covariance and correlation grids 
-	return  lev2, lat2, lon2, C, R
+	return lev2, lat[j1:j2+1], lon[i1:i2+1], C, R
+
+def covariance_series_time(date):
 
-def load_DART_obs_epoch_series_as_dataframe(E,obs_type_list=['ERP_PM1','ERP_LOD'],ens_status_list=['ensemble member'], hostname='taurus'):
+	# the time axis of covariance files counts days since 1 Jan 1600 
+	dt = date - datetime.datetime(1600,1,1,0,0,0)
+	return dt.days + dt.seconds/86400.0
+
+def load_DART_obs_epoch_series_as_dataframe(E,obs_type_list=['ERP_PM1','ERP_LOD'],ens_status_list=['ensemble member'], hostname='taurus',nprocs=1,cache=False,debug=False):
 
 	"""
 	this function scoots through a set of dates and returns a (sometimes very huge) dataframe of information
+
+	INPUTS:
+	E: experiment dictionary -- the dates are given by E['daterange'] 
+	obs_type_list: list of the DART obs types to load 
+	ens_status_list: list of the ensemble statuses (e.g. 'ensemble member', 'ensemble mean') of the copies to load 
+	hostname: computer name - default is Taurus 
+	nprocs: number of processes over which the dates are distributed. Default is 1, i.e. load 
+		one date after the other. 
+	cache: if True, the obs from each obs_epoch file are stored in (and retrieved from) a cache, 
+		partitioned by experiment, date, and obs type -- see load_DART_obs_epoch_file_as_dataframe 
+	debug: debugging flag; default is False. 
 	"""
 	daterange = E['daterange']
-	for date in daterange:
+	arglist = [(E,date,obs_type_list,ens_status_list,hostname,debug,cache) for date in daterange]
+
+	if nprocs > 1:
+		import multiprocessing
+		pool = multiprocessing.Pool(processes=nprocs)
+		DFlist = pool.map(load_DART_obs_epoch_file_as_dataframe_worker,arglist)
+		pool.close()
+		pool.join()
+	else:
+		DFlist = [load_DART_obs_epoch_file_as_dataframe_worker(args) for args in arglist]
 
-		if date == daterange[0]:
-			DF =  load_DART_obs_epoch_file_as_dataframe(E,date,obs_type_list,ens_status_list,hostname)
-		else:
-			DF2 = load_DART_obs_epoch_file_as_dataframe(E,date,obs_type_list,ens_status_list,hostname)
-			DF = pd.merge(DF,DF2,how='outer')
+	# the dates are all different, so the frames don't share any rows -- just stack them up  
+	DFlist = [DF for DF in DFlist if DF is not None]
+	if len(DFlist) == 0:
+		return None
+	DF = pd.concat(DFlist,ignore_index=True)
+
+	# the categories differ from file to file, so turn these columns back into categories here 
+	for col in ['CopyName','ObsType','QualityControl','DARTQualityControl']:
+		DF[col] = DF[col].astype('category')
 
 	return DF
 
+def load_DART_obs_epoch_file_as_dataframe_worker(args):
 
-def load_DART_obs_epoch_file_as_dataframe(E,date=datetime.datetime(2009,1,1,0,0,0),obs_type_list=['ERP_PM1','ERP_LOD'],ens_status_list=['ensemble member'], hostname='taurus',debug=False):
+	"""
+	unpacks a tuple of arguments and passes them to load_DART_obs_epoch_file_as_dataframe -- 
+	this is needed to distribute the dates of load_DART_obs_epoch_series_as_dataframe 
+	over a pool of processes. 
+	"""
+	E,date,obs_type_list,ens_status_list,hostname,debug,cache = args
+	return load_DART_obs_epoch_file_as_dataframe(E,date,obs_type_list,ens_status_list,hostname,debug,cache)
+
+
+def load_DART_obs_epoch_file_as_dataframe(E,date=datetime.datetime(2009,1,1,0,0,0),obs_type_list=['ERP_PM1','ERP_LOD'],ens_status_list=['ensemble member'], hostname='taurus',debug=False,cache=False):
 
 	"""
 	 read in a DART obs epoch file, defined by its date and the Experiment E, and return as a Pandas data frame, in which al the observations 
 	 that have ensemble status and obs types given in ens_status_list and obs_type_list, respectively, 
 	 are ordered according to ObsIndex.  
 	 this should eventually replace the SR load_DART_obs_epoch_file  
+
+	 The frame is in long format (one row per observation and copy). The columns CopyName, ObsType, 
+	 QualityControl, and DARTQualityControl are returned as pandas categoricals, which 
+	 keeps the memory footprint down for files with many observations and ensemble members. 
+
+	 If ens_status_list is 'all', every copy in the file is returned, regardless of E['diagn']. 
+
+	 If cache is True, the observations are taken from a cache of per-obs-type dataframes 
+	 for this experiment and date (see obs_epoch_cache_query) rather than from the netcdf file. 
 	"""
 
 	# find the directory for this run   
@@ -104,24 +235,20 @@ def load_DART_obs_epoch_file_as_dataframe(E,date=datetime.datetime(2009,1,1,0,0,
 	# but written my each user -- it should take an experiment dictionary and the hostname 
 	# as input, and return as output 
 	# the filepath that corresponds to the desired field, diagnostic, etc. 
-	filename = es.find_paths(E,date,hostname=hostname)
+	filename = es.find_paths(E,date,file_type='obs_epoch',hostname=hostname)
 	if not os.path.exists(filename):
 		if debug:
 			print("+++cannot find files that look like  "+filename+' -- returning None')
 		return None
 
+	if cache:
+		return obs_epoch_cache_query(E,date,filename,obs_type_list,ens_status_list,hostname,debug)
+
 	# load the file and select the observation we want
 	else:
 		f = Dataset(filename,'r')
-		CopyMetaData = f.variables['CopyMetaData'][:]
-		ObsTypesMetaData = f.variables['ObsTypesMetaData'][:]
-		observations = f.variables['observations'][:]
-		time = f.variables['time'][:]
-		copy = f.variables['copy'][:]
+		MI = file_metadata_index(f)
 		obs_type = f.variables['obs_type'][:]
-		location = f.variables['location'][:]
-		ObsIndex = f.variables['ObsIndex'][:]
-		qc = f.variables['qc'][:]
 
 		# find the obs_type number corresponding to the desired observations
 		obs_type_no_list = []
@@ -129,135 +256,96 @@ def load_DART_obs_epoch_file_as_dataframe(E,date=datetime.datetime(2009,1,1,0,0,
 			obs_type_no_list.append(get_obs_type_number(f,obs_type_string))
 		
 		# expand "CopyMetaData" into lists that hold ensemble status and diagnostic
-		diagn = []
-		ens_status = []
-		CMD = []
-		# loop over the copy meta data and record the ensemble status and diagnostic for reach copy
-		for icopy in copy:
-			temp = CopyMetaData[icopy-1,].tostring()
-			CMD.append(temp.rstrip())
-
-			if 'prior' in temp:
-				diagn.append('Prior')
-			if 'posterior' in temp:
-				diagn.append('Posterior')
-			if 'truth' in temp:
-				diagn.append('Truth')
-				ens_status.append('Truth')
-			if 'observations' in temp:
-				diagn.append('Observation')
-				ens_status.append('Observation')
-			if 'ensemble member' in temp:
-				ens_status.append('ensemble member')
-			if 'ensemble mean' in temp:
-				ens_status.append('ensemble mean')
-			if 'ensemble spread' in temp:
-				ens_status.append('ensemble spread')
-			if 'observation error variance' in temp:
-				ens_status.append(None)
-				diagn.append(None)
-			
-		f.close()
-
-	# return the desired observations and copys, and the copy meta data
-	#for obs_type_no in obs_type_no_list:
-	iobs=[]
-	iensstatus=[]
-	if debug:
-		print('selecting the following obs type numbers')
-		print(obs_type_no_list)
-	for OTN in obs_type_no_list:
-		itemp = np.where(obs_type == OTN)
-		if itemp is not None:
-			# itemp is a tuple - the first entry is the list of indices (I know - this is fucked)
-			itemp2 = itemp[0]
-			# now scoot through itemp2 (which is an ndarray...wtf?) and store the entires in a list
-			for i in itemp2:
-				iobs.append(i)
-
+		# (this is a loop over copies only, so it's cheap)  
+		CMD = MI['CopyMetaData']
+		copy_status = [obs_epoch_copy_status(cn) for cn in CMD]
+
+		# select the copys correposnind go the right ensemble status (or just copystring if the list isn;t give) and diagnostic
+		if ens_status_list is None:
+			ens_status_list = []
+			ens_status_list.append(E['copystring'])
+			if debug:
+				print(ens_status_list)
 
-	# select the copys correposnind go the right ensemble status (or just copystring if the list isn;t give) and diagnostic
-	if ens_status_list is None:
-		ens_status_list = []
-		ens_status_list.append(E['copystring'])
+		# one mask over the copies: right ensemble status AND right diagnostic  
+		if ens_status_list == 'all':
+			copy_mask = np.ones(len(CMD),dtype=bool)
+		else:
+			copy_mask = np.array([(ES in ens_status_list) and (DG == E['diagn']) for DG,ES in copy_status],dtype=bool)
+		cc = np.nonzero(copy_mask)[0]
 		if debug:
-			print(ens_status_list)
+			print('these are the copies that suit both the requested ensemble status and the requested diagnostic:')
+			print(cc)
 
-	for ES in ens_status_list:
-		indices = [i for i, x in enumerate(ens_status) if x == ES]
-		iensstatus.extend(indices)
-	iensstatus.sort()	# this is the list of copies with the right ensemble status
-	idiagn = [i for i,x in enumerate(diagn) if x == E['diagn']]	# this is the list of copies with the right diagnostic
+		# one mask over the observations: right obs type. 
+		# the observations come out grouped by obs type, in the order given in obs_type_list  
+		if debug:
+			print('selecting the following obs type numbers')
+			print(obs_type_no_list)
+		obs_type = np.asarray(obs_type)
+		type_wanted = np.zeros(len(MI['ObsTypesMetaData'])+1,dtype=bool)
+		type_wanted[obs_type_no_list] = True
+		iobs = np.nonzero(type_wanted[obs_type])[0]
+		type_rank = np.zeros(len(MI['ObsTypesMetaData'])+1,dtype=int)
+		for rank,OTN in reversed(list(enumerate(obs_type_no_list))):
+			type_rank[OTN] = rank
+		iobs = iobs[np.argsort(type_rank[obs_type[iobs]],kind='mergesort')]
+
+		# now read only the block of the file that holds the selected obs and copies, 
+		# rather than the whole thing  
+		if len(iobs) > 0 and len(cc) > 0:
+			o1 = iobs.min()
+			o2 = iobs.max()
+			c1 = cc.min()
+			c2 = cc.max()
+			observations = f.variables['observations'][o1:o2+1,c1:c2+1]
+			location = f.variables['location'][o1:o2+1,:]
+			ObsIndex = f.variables['ObsIndex'][o1:o2+1]
+			qc = f.variables['qc'][o1:o2+1,:]
+			obs_select = observations[iobs-o1,:][:,cc-c1]
+			location_select = location[iobs-o1,:]
+			ObsIndex_select = ObsIndex[iobs-o1]
+			qc1_select = qc[iobs-o1,0]
+			qc2_select = qc[iobs-o1,1]
+		else:
+			obs_select = np.zeros(shape=(len(iobs),len(cc)))
+			location_select = np.zeros(shape=(len(iobs),3))
+			ObsIndex_select = np.zeros(len(iobs),dtype=int)
+			qc1_select = np.zeros(len(iobs))
+			qc2_select = np.zeros(len(iobs))
+		obs_type_select = obs_type[iobs]
 
-	# we are interested in the indices that appear in both iensstatus and idiagn
-	sdiagn = set(idiagn)
-	cc = [val for val in iensstatus if val in sdiagn]
-	if debug:
-		print('these are the copies that suit both the requested ensemble status and the requested diagnostic:')
-		print(cc)
+		# obs type names, one per obs type code 
+		OT = MI['ObsTypesMetaData']
 
-	# given the above copy numbers, find the names that suit them
-	copynames = [CMD[ii] for ii in cc]
+		f.close()
 
-	# turn the array obs_type from numbers to words
-	OT = []
-	for ii in obs_type:
-		temp = ObsTypesMetaData[ii-1,].tostring()
-		OT.append(temp)
-	# these are the obs types for the observations we select out
-	OT_select = [OT[ii] for ii in iobs]
-
-
-	# now select the observations corresponding to the selected copies and obs types
-	i1 = np.array(iobs)
-	i2 = np.array(cc)
-	obs_select = observations[i1[:,None],i2]
-	location_select = location[i1,]
-	obs_type_select = obs_type[i1,]
-	qc1_select = qc[i1,0]
-	qc2_select = qc[i1,1]
-	time_select = time[i1]
-	ObsIndex_select = ObsIndex[i1]
-	
+	# build the long-format columns (observation x copy, copies varying fastest) by broadcasting 
+	# the per-observation arrays against the copy axis
+	nobs = len(iobs)
+	nc = len(cc)
+	L = nobs*nc		# length of the data vector
+	def per_copy(x):
+		return np.broadcast_to(np.asarray(x)[:,None],(nobs,nc)).ravel()
 
-	# for the arrays that are only defined by obs index, replicate for each copy
-	loc1 = location_select[:,0]
-	loc2 = location_select[:,1]
-	loc3 = location_select[:,2]
-	loc1_copies= np.repeat(loc1[:,np.newaxis],len(i2),1)
-	loc2_copies= np.repeat(loc2[:,np.newaxis],len(i2),1)
-	loc3_copies= np.repeat(loc3[:,np.newaxis],len(i2),1)
-	qc1_copies =  np.repeat(qc1_select[:,np.newaxis],len(i2),1)
-	qc2_copies =  np.repeat(qc2_select[:,np.newaxis],len(i2),1)
-	obs_type_copies=  np.repeat(obs_type_select[:,np.newaxis],len(i2),1)
-	ObsIndex_copies =  np.repeat(ObsIndex_select[:,np.newaxis],len(i2),1)
-
-	# reshape the output from arrays to vectors
-	# also have to squeeze out the empty dimension -- this seems really inelegant, but I don't know a better way to do it!
-	L = len(iobs)*len(cc)		# length of the data vector
 	date_out = np.repeat(date,L)
-	obs_out = np.squeeze(np.reshape(obs_select,(L,1)))
-	lon_out = np.squeeze(np.reshape(loc1_copies,(L,1)))
-	lat_out = np.squeeze(np.reshape(loc2_copies,(L,1)))
-	lev_out = np.squeeze(np.reshape(loc3_copies,(L,1)))
-	qc1_out = np.squeeze(np.reshape(qc1_copies,(L,1)))
-	qc2_out = np.squeeze(np.reshape(qc2_copies,(L,1)))
-	obs_type_out = np.squeeze(np.reshape(obs_type_copies,(L,1)))
-	ObsIndex_out = np.squeeze(np.reshape(ObsIndex_copies,(L,1)))
-
-
-
-	# for each of the selected obs, report its copystring, ensemble status, and obs type
-	copynames_out = []
-	for ii in range(len(iobs)):
-		for cn in copynames:
-			copynames_out.append(cn)
-
+	obs_out = np.ravel(obs_select)
+	ObsIndex_out = per_copy(ObsIndex_select)
 
 	# round the location values because otherwise pandas fucks up the categorial variable aspect of them
-	lat_out = np.round(lat_out,1)
-	lon_out = np.round(lon_out,1)
-	lev_out = np.round(lev_out)
+	lon_out = per_copy(np.round(location_select[:,0],1))
+	lat_out = per_copy(np.round(location_select[:,1],1))
+	lev_out = per_copy(np.round(location_select[:,2]))
+
+	# copy names, obs types, and quality control flags have only a few distinct values, so 
+	# store them as categories  
+	copynames = [CMD[ii] for ii in cc]
+	copynames_out = pd.Categorical.from_codes(np.tile(np.arange(nc),nobs),categories=copynames)
+	obs_types_present = sorted(set(obs_type_select))
+	obs_type_codes = np.searchsorted(obs_types_present,obs_type_select)
+	obs_type_out = pd.Categorical.from_codes(per_copy(obs_type_codes),categories=[OT[ii-1] for ii in obs_types_present])
+	qc1_out = pd.Categorical(per_copy(qc1_select))
+	qc2_out = pd.Categorical(per_copy(qc2_select))
 
 	# return data frame
 	data = {'QualityControl':qc1_out,
@@ -267,19 +355,136 @@ def load_DART_obs_epoch_file_as_dataframe(E,date=datetime.datetime(2009,1,1,0,0,
 		'Longitude':lon_out,
 		'Level':lev_out,
 		'Date':date_out,
-		'CopyName':copynames_out	
+		'CopyName':copynames_out,
+		'ObsType':obs_type_out
 		}
 
 	DF = pd.DataFrame(data,index=ObsIndex_out)
 
-	# turn categorical data into categories
-	#DF['QualityControl'] = DF['QualityControl'].astype('category')
-	#DF['Latitude'] = DF['Latitude'].astype('category')
-	#DF['Longitude'] = DF['Longitude'].astype('category')
-	#DF['Level'] = DF['Level'].astype('category')
-	#DF['CopyName'] = DF['CopyName'].astype('category')
+	return DF
+
+def obs_epoch_copy_status(copyname):
+
+	"""
+	given a copy name from the CopyMetaData of a DART obs_epoch file (e.g. 'prior ensemble member      3'), 
+	return its diagnostic ('Prior', 'Posterior', 'Truth', 'Observation', or None) 
+	and its ensemble status ('ensemble member', 'ensemble mean', 'ensemble spread', 'Truth', 'Observation', or None) 
+	"""
+	diagn = None
+	ens_status = None
+	if 'prior' in copyname:
+		diagn = 'Prior'
+	if 'posterior' in copyname:
+		diagn = 'Posterior'
+	if 'truth' in copyname:
+		diagn = 'Truth'
+		ens_status = 'Truth'
+	if 'observations' in copyname:
+		diagn = 'Observation'
+		ens_status = 'Observation'
+	if 'ensemble member' in copyname:
+		ens_status = 'ensemble member'
+	if 'ensemble mean' in copyname:
+		ens_status = 'ensemble mean'
+	if 'ensemble spread' in copyname:
+		ens_status = 'ensemble spread'
+	if 'observation error variance' in copyname:
+		diagn = None
+		ens_status = None
+
+	return diagn, ens_status
+
+def obs_epoch_cache_query(E,date,filename,obs_type_list=['ERP_PM1','ERP_LOD'],ens_status_list=['ensemble member'],hostname='taurus',debug=False):
+
+	"""
+	Return the same dataframe as load_DART_obs_epoch_file_as_dataframe, but from a cache. 
+
+	The cache is partitioned by experiment, date, and obs type: for each obs type there is 
+	one file holding all the copies of that obs type on that date. 
+	Obs types that aren't in the cache yet are read from the obs_epoch file (given by filename) and 
+	added to it. 
+	Each date also has a small text file that records the modification time of the obs_epoch file and its copy names -- 
+	if the obs_epoch file has changed since the cache was written, the cache for that date is thrown out. 
+
+	The cache is stored as Parquet if pyarrow is available, and as pickled dataframes otherwise. 
+	With Parquet, only the requested copies are read from disk. 
+	"""
+
+	# the cache directory for this experiment and date 
+	datestr = date.strftime("%Y-%m-%d")+'-'+str(date.hour*60*60).zfill(5)
+	cache_dir = os.path.join(es.cache_paths(hostname,'obs_epoch'),E['exp_name'],datestr)
+	source_file = os.path.join(cache_dir,'source.txt')
+	mtime = repr(os.path.getmtime(filename))
+
+	# check whether the cache for this date was made from the current obs_epoch file 
+	CMD = None
+	if os.path.exists(source_file):
+		with open(source_file,'r') as fs:
+			lines = fs.read().split('\n')
+		if (lines[0] == filename) and (lines[1] == mtime):
+			CMD = lines[2:]
+		else:
+			if debug:
+				print('obs_epoch file '+filename+' has changed -- clearing the cache in '+cache_dir)
+			for cf in os.listdir(cache_dir):
+				os.remove(os.path.join(cache_dir,cf))
+
+	# choose the storage format 
+	try:
+		import pyarrow
+		ext = '.parquet'
+	except ImportError:
+		ext = '.pkl'
+	def cache_file(obs_type):
+		return os.path.join(cache_dir,obs_type+ext)
+
+	# read the obs types that aren't cached yet from the obs_epoch file, with all of their copies  
+	missing = [OT for OT in obs_type_list if (CMD is None) or not os.path.exists(cache_file(OT))]
+	if len(missing) > 0:
+		if debug:
+			print('adding the following obs types to the cache in '+cache_dir)
+			print(missing)
+		if not os.path.exists(cache_dir):
+			try:
+				os.makedirs(cache_dir)
+			except OSError:
+				pass
+		DFall = load_DART_obs_epoch_file_as_dataframe(E,date,missing,'all',hostname,debug)
+		for OT in missing:
+			DFOT = DFall[DFall['ObsType'] == OT].copy()
+			for col in ['ObsType','CopyName']:
+				DFOT[col] = DFOT[col].cat.remove_unused_categories()
+			if ext == '.parquet':
+				DFOT.to_parquet(cache_file(OT))
+			else:
+				DFOT.to_pickle(cache_file(OT))
+		if CMD is None:
+			CMD = list(DFall['CopyName'].cat.categories)
+			with open(source_file,'w') as fs:
+				fs.write('\n'.join([filename,mtime]+CMD))
+
+	# the copies that fit the requested ensemble status and diagnostic 
+	if ens_status_list is None:
+		ens_status_list = [E['copystring']]
+	if ens_status_list == 'all':
+		copynames = CMD
+	else:
+		copynames = [cn for cn in CMD if (obs_epoch_copy_status(cn)[1] in ens_status_list) and (obs_epoch_copy_status(cn)[0] == E['diagn'])]
+
+	# now read only the partitions (obs types) and rows (copies) that were asked for 
+	DFlist = []
+	for OT in obs_type_list:
+		if (ext == '.parquet') and (len(copynames) > 0):
+			DFOT = pd.read_parquet(cache_file(OT),filters=[('CopyName','in',copynames)])
+		elif ext == '.parquet':
+			DFOT = pd.read_parquet(cache_file(OT))
+		else:
+			DFOT = pd.read_pickle(cache_file(OT))
+		DFlist.append(DFOT[DFOT['CopyName'].isin(copynames)])
+	DF = pd.concat(DFlist)
+	for col in ['CopyName','ObsType','QualityControl','DARTQualityControl']:
+		DF[col] = DF[col].astype('category').cat.remove_unused_categories()
 
-	#return ObsIndex_out, loc1_out, loc2_out, loc3_out, qc_out, obs_out, copynames
 	return DF
 
 def load_DART_obs_epoch_file(E,date_in=None, hostname='taurus',debug=False):
@@ -323,10 +528,8 @@ def load_DART_obs_epoch_file(E,date_in=None, hostname='taurus',debug=False):
 		time = f.variables['time'][:]
 		copy = f.variables['copy'][:]
 		location = f.variables['location'][:]
-		CopyMetaData = f.variables['CopyMetaData'][:]
-		ObsTypesMetaData = f.variables['ObsTypesMetaData'][:]
+		MI = file_metadata_index(f)
 		obs_type = f.variables['obs_type'][:]
-		QCMetaData_array = f.variables['QCMetaData'][:]
 		qc = f.variables['qc'][:]
 		qc_copy = f.variables['qc_copy'][:]
 		
@@ -345,10 +548,10 @@ def load_DART_obs_epoch_file(E,date_in=None, hostname='taurus',debug=False):
 			# we only have one copy number to get -- cc tells us the number of it 
 			# note also the prior and posterio diagnostics are not available for everything, i.e observations themselves
 			if 'observation' in E['copystring']:
-				cc = get_copy(f,E['copystring'])
+				cc = get_copy(f,None,E['copystring'])
 			else:
 				diagn = E['diagn']
-				cc = get_copy(f,diagn.lower()+' '+E['copystring'])
+				cc = get_copy(f,None,diagn.lower()+' '+E['copystring'])
 
 		else:
 			# if we have to retrieve more than one copy, 
@@ -356,9 +559,8 @@ def load_DART_obs_epoch_file(E,date_in=None, hostname='taurus',debug=False):
 			diagn = []
 			ens_status = []
 			CMD = []
-			for icopy in copy:
-				temp = CopyMetaData[icopy-1,].tostring()
-				CMD.append(temp.rstrip())
+			for temp in MI['CopyMetaData']:
+				CMD.append(temp)
 
 				if 'prior' in temp:
 					diagn.append('Prior')
@@ -393,7 +595,7 @@ def load_DART_obs_epoch_file(E,date_in=None, hostname='taurus',debug=False):
 	levs = []
 
 	# create a dictionary to hold all available Quality Control flags
-	QCMetaData = [QCMD.tostring() for QCMD in QCMetaData_array]
+	QCMetaData = MI['QCMetaData']
 	QCdict = {k:[] for k in QCMetaData}
 
 
@@ -405,8 +607,7 @@ def load_DART_obs_epoch_file(E,date_in=None, hostname='taurus',debug=False):
 		itemp = np.where(obs_type == OTN)	# observation numbers of all obs that fit this obs type 
 		if itemp is not None:
 			if debug:
-				temp = ObsTypesMetaData[OTN-1,:].tostring()
-				print('these obs indices match obs of type '+temp.decode('UTF-8'))
+				print('these obs indices match obs of type '+MI['ObsTypesMetaData'][OTN-1])
 				print(np.squeeze(itemp))
 			iobs.append(list(np.squeeze(itemp)))
 			obs_codes.append(np.squeeze(obs_type[itemp]))
@@ -435,7 +636,9 @@ def load_DART_obs_epoch_file(E,date_in=None, hostname='taurus',debug=False):
 		print('retrieving '+str(len(iobs2))+' observations')
 
 	# instead of obs number codes, return strings that identify the obs
-	obs_names_out = [ObsTypesMetaData[obs_code-1].tostring() for obs_code in obs_codes_list]
+	# (the obs type names were decoded once for this file by file_metadata_index)  
+	OT = MI['ObsTypesMetaData']
+	obs_names_out = [OT[obs_code-1] for obs_code in obs_codes_list]
 
 	#------observation values for requested copies of the requested observations
 
@@ -458,7 +661,7 @@ def load_DART_obs_epoch_file(E,date_in=None, hostname='taurus',debug=False):
 				CS = "ensemble member"+spacing+str(ensindex)		
 			if debug:
 				print('looking for copy '+CS)
-			if CS is 'ensemble':
+			if CS == 'ensemble':
 				# in this case look for all the copies that have ensemble status = "ensemble member"	
 				indices = [i for i, x in enumerate(ens_status) if x == 'ensemble member']
 			else:
@@ -552,158 +755,164 @@ def load_DART_diagnostic_file(E,date=datetime.datetime(2009,1,1,1,0,0),hostname=
 	else:
 		if debug:
 			print('opening file  '+filename)
-		f = Dataset(filename,'r')
-		if variable in variables_2d:
-			# don't need info about hybrid model levels if the variable is 2d
-			lev=None
-			P0=None
-			hybm=None
-			hyam=None
-		else:
-			# TODO: add a check so that hybrid model level info is only loaded 
-			# for models with hybrid vertical levels 
-			lev = f.variables['lev'][:]
-			P0 = f.variables['P0'][:]
-			hybm = f.variables['hybm'][:]
-			hyam = f.variables['hyam'][:]
-
-		# load CopyMetaData if availabe
-		if 'CopyMetaData' in f.variables:
-			CMD = f.variables['CopyMetaData'][:]
-			CopyMetaData = []
-			for ii in range(0,len(CMD)):
-				temp = CMD[ii,].tostring().decode("utf-8")
-				CopyMetaData.append(temp.rstrip())
-		else:
-			# if it's not available, look it up for that experiment 
-			CopyMetaData = es.get_expt_CopyMetaData_state_space(E)
+		with netcdf_file(filename) as f:
+			if variable in variables_2d:
+				# don't need info about hybrid model levels if the variable is 2d
+				lev=None
+				P0=None
+				hybm=None
+				hyam=None
+			else:
+				# TODO: add a check so that hybrid model level info is only loaded 
+				# for models with hybrid vertical levels 
+				lev = f.variables['lev'][:]
+				P0 = f.variables['P0'][:]
+				hybm = f.variables['hybm'][:]
+				hyam = f.variables['hyam'][:]
+
+			# load CopyMetaData if availabe
+			MI = file_metadata_index(f)
+			if 'CopyMetaData' in f.variables:
+				CopyMetaData = MI['CopyMetaData']
+			else:
+				# if it's not available, look it up for that experiment 
+				CopyMetaData = es.get_expt_CopyMetaData_state_space(E)
 
-		# load the requested dynamical variable  - these can have different names, so 
-		# first check if the requested variable, and if it's not found, try alternatives 
-		if E['variable'] in f.variables:
-			varname_load=E['variable']
-		else:
-			# here is a dictionary that holds alternative variable names to try
-			possible_varnames_dict={'T':['t','var130'],
-						'TS':['t','var130'],
-						'U':['u','var131'],
-						'US':['u','var131'],
-						'V':['v','var132'],
-						'VS':['v','var132'],
-						'Z':['z','var129'],
-						'geopotential':['z','var129'],
-						'GPH':['Z','z','var129'],
-						'var129':['Z','z','var129'],
-						'msl':['var151'],
-						'mslp':['var151'],
-						'ztrop':['ptrop'],
-						'Nsq':['brunt']}
-
-			possible_varnames_list=possible_varnames_dict[E['variable']]
-			for varname in possible_varnames_list:
-				if varname in f.variables:
-					varname_load = varname
+			# load the requested dynamical variable  - these can have different names, so 
+			# first check if the requested variable, and if it's not found, try alternatives 
+			if E['variable'] in f.variables:
+				varname_load=E['variable']
+			else:
+				# here is a dictionary that holds alternative variable names to try
+				possible_varnames_dict={'T':['t','var130'],
+							'TS':['t','var130'],
+							'U':['u','var131'],
+							'US':['u','var131'],
+							'V':['v','var132'],
+							'VS':['v','var132'],
+							'Z':['z','var129'],
+							'geopotential':['z','var129'],
+							'GPH':['Z','z','var129'],
+							'var129':['Z','z','var129'],
+							'msl':['var151'],
+							'mslp':['var151'],
+							'ztrop':['ptrop'],
+							'Nsq':['brunt']}
+
+				possible_varnames_list=possible_varnames_dict[E['variable']]
+				for varname in possible_varnames_list:
+					if varname in f.variables:
+						varname_load = varname
 			
-			# if the desired variable is still not found, throw an error and abort 
-			if 'varname_load' not in locals():
-				print('Unable to find variable '+E['variable']+' in file '+filename)
-
-		# now actually load the variable, and replace its bad 
-		# values with NaNs
-		V = f.variables[varname_load]
-
-		if (variable=='US'):
-			lat = f.variables['slat'][:]
-		else:
-			lat = f.variables['lat'][:]
-		if (variable=='VS'):
-			lon = f.variables['slon'][:]
-		else:
-			lon = f.variables['lon'][:]
+				# if the desired variable is still not found, throw an error and abort 
+				if 'varname_load' not in locals():
+					print('Unable to find variable '+E['variable']+' in file '+filename)
 
-		#------finding which copies to retrieve  
-		if type(E['copystring']) is not list:
-			copies = None
-
-			# if the diagnostic is the Truth, then the copy string can only be one thing
-			if (E['diagn'] == 'Truth'):
-				copies = get_copy(f,CopyMetaData,'true state')
-			# if we want the ensemble variance or std, copystring has to be the ensemble spread
-			if (E['extras'] == 'ensemble variance') or (E['extras'] == 'ensemble variance scaled') or (E['extras'] == 'ensemble std'):
-				copies = get_copy(f,CopyMetaData,'ensemble spread')
-			# if requesting the entire ensemble, find the copies that contain the string 'ensemble member'  
-			if E['copystring'] is 'ensemble':
-				copies = [get_copy(f,CopyMetaData,cs) for cs in CopyMetaData if 'ensemble member' in cs]
-
-			# we can also request a sample of the total ensemble 
-			if 'ensemble sample' in E['copystring']:
-				copies2 = [get_copy(f,CopyMetaData,cs) for cs in CopyMetaData if 'ensemble member' in cs]
-				try:
-					n = int(E['copystring'].split(' ')[2])
-				except ValueError:
-					print('Warning: the copystring '+E['copystring']+' isnt valid. Returning 2 ensemble members instead.')
-					n = 2
-					pass
-				copies = np.random.choice(copies2,size=n,replace=False)	
-
-			# if none of the above apply, just choose whatever is in copystring 
-			if copies is None:
-				copies = [get_copy(f,CopyMetaData,E['copystring'],debug=debug)]
-		else:
-			copies = [get_copy(f,CopyMetaData,cstring) for cstring in E['copystring']]
-
-		#------done finding which copies to retrieve  
-
-		# initialize output directory and record the variable's metadata. 
-		try:
-			Dout['units']=V.units
-		except AttributeError:
-			Dout['units']=''
-		try:
-			Dout['long_name']=V.long_name
-		except AttributeError:
-			Dout['long_name']=''
-
-		# figure out which vertical level range we want
-		if variable in variables_2d:
-			lev2 = None
-		else:
-			levrange=E['levrange']
-			k1 = (np.abs(lev-levrange[1])).argmin()
-			k2 = (np.abs(lev-levrange[0])).argmin()
-			lev2 = lev[k1:k2+1]
-
-		# figure out which latitude range we want
-		latrange=E['latrange']
-		j2 = (np.abs(lat-latrange[1])).argmin()
-		j1 = (np.abs(lat-latrange[0])).argmin()
-		lat2 = lat[j1:j2+1]
-
-		# figure out which longitude range we want
-		lonrange=E['lonrange']
-		i2 = (np.abs(lon-lonrange[1])).argmin()
-		i1 = (np.abs(lon-lonrange[0])).argmin()
-		lon2 = lon[i1:i2+1]
-
-
-		# now read in only the part of the variable within the lat, lon, and lev bounds 
-		# note that this assumes output shaped like time x copy x lat x lon x lev 
-		# TODO: is there away to make this more agnostic?  
-		# note also that we only choose the first time -- this works well with DART output 
-		# that have one time instance in each file, only. Again, another TODO woul dbe to make
-		# this more grid-agnostic. 
-		if variable in variables_2d:
-			VV = V[0,copies,j1:j2+1,i1:i2+1]
-		else:
-			VV = V[0,copies,j1:j2+1,i1:i2+1,k1:k2+1]
+			# now actually load the variable, and replace its bad 
+			# values with NaNs
+			V = f.variables[varname_load]
 
-		# also record the netcdf fill value in the array  
-		if hasattr(V, '_FillValue'):
-			VV = np.ma.masked_values(VV, V._FillValue)
-			Dout['FillValue'] = V._FillValue
+			if (variable=='US'):
+				lat = f.variables['slat'][:]
+			else:
+				lat = f.variables['lat'][:]
+			if (variable=='VS'):
+				lon = f.variables['slon'][:]
+			else:
+				lon = f.variables['lon'][:]
+
+			#------finding which copies to retrieve  
+			if type(E['copystring']) is not list:
+				copies = None
+
+				# if the diagnostic is the Truth, then the copy string can only be one thing
+				if (E['diagn'] == 'Truth'):
+					copies = get_copy(f,CopyMetaData,'true state')
+				# if we want the ensemble variance or std, copystring has to be the ensemble spread
+				if (E['extras'] == 'ensemble variance') or (E['extras'] == 'ensemble variance scaled') or (E['extras'] == 'ensemble std'):
+					copies = get_copy(f,CopyMetaData,'ensemble spread')
+				# if requesting the entire ensemble, find the copies that contain the string 'ensemble member'  
+				if E['copystring'] == 'ensemble':
+					copies = [get_copy(f,CopyMetaData,cs) for cs in CopyMetaData if 'ensemble member' in cs]
+
+				# we can also request a sample of the total ensemble 
+				if 'ensemble sample' in E['copystring']:
+					copies2 = [get_copy(f,CopyMetaData,cs) for cs in CopyMetaData if 'ensemble member' in cs]
+					try:
+						n = int(E['copystring'].split(' ')[2])
+					except ValueError:
+						print('Warning: the copystring '+E['copystring']+' isnt valid. Returning 2 ensemble members instead.')
+						n = 2
+						pass
+					copies = np.random.choice(copies2,size=n,replace=False)	
+
+				# if none of the above apply, just choose whatever is in copystring 
+				if copies is None:
+					copies = [get_copy(f,CopyMetaData,E['copystring'],debug=debug)]
+			else:
+				copies = [get_copy(f,CopyMetaData,cstring) for cstring in E['copystring']]
+
+			#------done finding which copies to retrieve  
+
+			# initialize output directory and record the variable's metadata. 
+			try:
+				Dout['units']=V.units
+			except AttributeError:
+				Dout['units']=''
+			try:
+				Dout['long_name']=V.long_name
+			except AttributeError:
+				Dout['long_name']=''
+
+			# figure out which vertical level range we want
+			if variable in variables_2d:
+				lev2 = None
+			else:
+				levrange=E['levrange']
+				k1 = (np.abs(lev-levrange[1])).argmin()
+				k2 = (np.abs(lev-levrange[0])).argmin()
+				lev2 = lev[k1:k2+1]
+
+			# figure out which latitude range we want
+			latrange=E['latrange']
+			j2 = (np.abs(lat-latrange[1])).argmin()
+			j1 = (np.abs(lat-latrange[0])).argmin()
+			lat2 = lat[j1:j2+1]
+
+			# figure out which longitude range we want
+			lonrange=E['lonrange']
+			i2 = (np.abs(lon-lonrange[1])).argmin()
+			i1 = (np.abs(lon-lonrange[0])).argmin()
+			lon2 = lon[i1:i2+1]
+
+
+			# now read in only the part of the variable within the lat, lon, and lev bounds 
+			# note that this assumes output shaped like time x copy x lat x lon x lev 
+			# TODO: is there away to make this more agnostic?  
+			# note also that we only choose the first time -- this works well with DART output 
+			# that have one time instance in each file, only. Again, another TODO woul dbe to make
+			# this more grid-agnostic. 
+			# if several copies are requested (e.g. the whole ensemble), it's much faster to read the 
+			# contiguous block of copies that holds them in one go and pick out the ones we want in memory, 
+			# than to have netcdf read each copy separately -- as long as the block isn't mostly unwanted copies. 
+			if (not np.isscalar(copies)) and (len(copies) > 1) and (max(copies)-min(copies)+1 <= 2*len(copies)):
+				c1 = min(copies)
+				c2 = max(copies)
+				if variable in variables_2d:
+					VV = V[0,c1:c2+1,j1:j2+1,i1:i2+1]
+				else:
+					VV = V[0,c1:c2+1,j1:j2+1,i1:i2+1,k1:k2+1]
+				VV = VV[np.asarray(copies)-c1,...]
+			else:
+				if variable in variables_2d:
+					VV = V[0,copies,j1:j2+1,i1:i2+1]
+				else:
+					VV = V[0,copies,j1:j2+1,i1:i2+1,k1:k2+1]
 
-		# close the primary file  
-		f.close()
+			# also record the netcdf fill value in the array  
+			if hasattr(V, '_FillValue'):
+				VV = np.ma.masked_values(VV, V._FillValue)
+				Dout['FillValue'] = V._FillValue
 
 		#------------extra computations  
 
@@ -727,7 +936,7 @@ def load_DART_diagnostic_file(E,date=datetime.datetime(2009,1,1,1,0,0),hostname=
 		if (E['extras'] == 'ensemble variance scaled'):
 			if debug:
 				print('squaring and scaling ensemble spread to get scaled variance')
-			N = get_ensemble_size(f)
+			N = MI['ensemble size']
 			fac = (N+1)/N
 			VVout = fac*np.square(VV)
 		else:
@@ -747,18 +956,15 @@ def load_DART_diagnostic_file(E,date=datetime.datetime(2009,1,1,1,0,0),hostname=
 					print('opening file  '+filename_truth)
 
 			# open the truth file and load the field
-			ft = Dataset(filename_truth,'r')
-			VT = ft.variables[variable]
+			with netcdf_file(filename_truth) as ft:
+				VT = ft.variables[variable]
 
-			# select the true state as the right copy
-			copyt = get_copy(ft,'true state',debug)
-			if (variable=='PS'):
-				VT2 = VT[0,copy,j1:j2+1,i1:i2+1]
-			else:
-				VT2 = VT[0,copy,j1:j2+1,i1:i2+1,k1:k2+1]
-
-			# close the truth file
-			ft.close()
+				# select the true state as the right copy
+				copyt = get_copy(ft,None,'true state',debug)
+				if (variable=='PS'):
+					VT2 = VT[0,copy,j1:j2+1,i1:i2+1]
+				else:
+					VT2 = VT[0,copy,j1:j2+1,i1:i2+1,k1:k2+1]
 
 			# compute the square error
 			SE = np.square(VV2-VT2)
@@ -777,6 +983,220 @@ def load_DART_diagnostic_file(E,date=datetime.datetime(2009,1,1,1,0,0),hostname=
 		Dout['hyam']=hyam
 		return(Dout)
 
+def open_netcdf_file(filename):
+
+	"""
+	Check out a read-only netCDF4 Dataset for the file filename from a pool of open files 
+	that is shared by all the loaders in this package (and in WACCM.py, ERA.py, TEM.py). 
+	This saves us from re-opening files (and re-parsing their headers) when the same file is read 
+	over and over, e.g. once for each ensemble member. 
+
+	The pool keeps at most netcdf_max_open_files files open, and closes the least recently used 
+	file that isn't checked out when it needs room. If all the open files are checked out, 
+	the limit is exceeded for a while. 
+	A file is re-opened if it has been modified since it was put in the pool. 
+
+	Every file checked out here has to be given back with release_netcdf_file, rather than closed, 
+	also if reading it fails -- so use the context manager netcdf_file where possible. 
+	While a file is checked out, other threads that ask for the same file wait until it's released. 
+	"""
+	global netcdf_pool_pid
+
+	with netcdf_pool_lock:
+
+		# if we're in a process that was forked off (e.g. by multiprocessing), the open 
+		# files belong to the parent -- start a new pool without touching them 
+		if os.getpid() != netcdf_pool_pid:
+			netcdf_pool.clear()
+			netcdf_pool_pid = os.getpid()
+
+		mtime = os.path.getmtime(filename)
+		entry = netcdf_pool.pop(filename,None)
+		if (entry is not None) and (entry['mtime'] != mtime) and (entry['users'] == 0):
+			entry['f'].close()
+			entry = None
+
+		if entry is None:
+			# make room by closing the least recently used files that nobody is using 
+			for key in list(netcdf_pool.keys()):
+				if len(netcdf_pool) < netcdf_max_open_files:
+					break
+				if netcdf_pool[key]['users'] == 0:
+					netcdf_pool.pop(key)['f'].close()
+			entry = {'f':Dataset(filename,'r'),'mtime':mtime,'users':0,'lock':threading.RLock()}
+
+		entry['users'] += 1
+		netcdf_pool[filename] = entry
+
+	entry['lock'].acquire()
+	return entry['f']
+
+@contextmanager
+def netcdf_file(filename):
+
+	"""
+	Check out the file filename from the pool of open netcdf files (see open_netcdf_file) for the 
+	duration of a with-block: 
+
+		with netcdf_file(filename) as f:
+			...
+
+	The file is given back to the pool when the block ends, also if an error is raised inside it, 
+	so that other threads that need the same file don't wait for it forever. 
+	"""
+	f = open_netcdf_file(filename)
+	try:
+		yield f
+	finally:
+		release_netcdf_file(f)
+
+def release_netcdf_file(f):
+
+	"""
+	Give back a netCDF4 Dataset that was checked out with open_netcdf_file. 
+	The file stays open in the pool. Datasets that don't come from the pool are simply closed. 
+	"""
+
+	with netcdf_pool_lock:
+		for entry in netcdf_pool.values():
+			if entry['f'] is f:
+				entry['users'] -= 1
+				entry['lock'].release()
+				return
+	f.close()
+
+def flush_netcdf_files():
+
+	"""
+	Synchronize all the files in the netcdf pool with the disk, so that any 
+	records that other programs have written in the meantime become visible. 
+	"""
+
+	with netcdf_pool_lock:
+		for entry in netcdf_pool.values():
+			with entry['lock']:
+				entry['f'].sync()
+
+def close_netcdf_files(filename=None):
+
+	"""
+	Close the files in the netcdf pool that aren't checked out -- either all of them, 
+	or only the file given by filename. 
+	"""
+
+	with netcdf_pool_lock:
+		for key in list(netcdf_pool.keys()):
+			if (filename is not None) and (key != filename):
+				continue
+			if netcdf_pool[key]['users'] == 0:
+				netcdf_pool.pop(key)['f'].close()
+
+def cached_basemap(resolution='l',**kwargs):
+
+	"""
+	Return a Basemap instance for the given resolution and Basemap arguments (e.g. projection='mill', 
+	llcrnrlat=-90, urcrnrlat=90, llcrnrlon=0, urcrnrlon=360), creating it only the first time 
+	these are asked for. 
+	Setting up a Basemap (in particular reading and clipping the coastline and land geometry) 
+	takes seconds, but the same instance can draw on any number of axes, so all map plots of 
+	the same projection, extent, and resolution share one instance here. 
+	Use projected_grid to get the map coordinates of a lat-lon grid on the returned map. 
+	"""
+	from mpl_toolkits.basemap import Basemap
+
+	key = (kwargs.get('projection','cyl'),tuple(sorted((k,repr(v)) for k,v in kwargs.items() if k != 'projection')),resolution)
+	if key not in basemap_cache:
+		basemap_cache[key] = {'map':Basemap(resolution=resolution,**kwargs),'grids':OrderedDict()}
+	return basemap_cache[key]['map']
+
+def projected_grid(map,lon,lat,max_grids=16):
+
+	"""
+	Return the map coordinates x,y (2d arrays, shaped lat x lon) of the grid given by the 1d 
+	arrays lon and lat on the Basemap instance map. 
+	If map came from cached_basemap, the projected grid is kept along with it (up to max_grids 
+	grids per map), so that plotting the same model grid again skips the projection. 
+	lon and lat can also be 2d arrays that already give the coordinates of every grid point. 
+	"""
+	lon = np.asarray(lon)
+	lat = np.asarray(lat)
+
+	grids = None
+	for entry in basemap_cache.values():
+		if entry['map'] is map:
+			grids = entry['grids']
+			break
+
+	key = (lon.shape,lat.shape,lon.dtype.str,lat.dtype.str,lon.tobytes(),lat.tobytes())
+	if (grids is not None) and (key in grids):
+		return grids[key]
+
+	if (lon.ndim == 1) and (lat.ndim == 1):
+		X,Y = np.meshgrid(lon,lat)
+	else:
+		X,Y = lon,lat
+	x,y = map(X,Y)
+
+	if grids is not None:
+		while len(grids) >= max_grids:
+			grids.popitem(last=False)
+		grids[key] = (x,y)
+	return x,y
+
+def file_metadata_index(f):
+
+	"""
+	given a DART output netcdf file that is already open, decode its metadata tables 
+	(CopyMetaData, ObsTypesMetaData, QCMetaData) and return them in a dictionary of lists and lookup dictionaries: 
+	'CopyMetaData': list of the copy names  
+	'copy': dictionary that gives the (python, i.e. starting at 0) copy index for each copy name
+	'ensemble member': dictionary that gives the copy index for each ensemble member number 
+	'ensemble size': the number of copies that are ensemble members 
+	'ObsTypesMetaData': list of the obs type names  
+	'obs_type': dictionary that gives the DART obs_type number (starting at 1) for each obs type name 
+	'QCMetaData': list of the quality control names 
+	'qc': dictionary that gives the (python) index of each quality control copy 
+	Tables that don't exist in the file come out empty. 
+
+	The decoded tables are kept for each file path and modification time, so that 
+	each file is only decoded once, no matter how many loaders look at it. 
+	"""
+
+	try:
+		path = f.filepath()
+		key = (path,os.path.getmtime(path))
+	except (AttributeError,ValueError,OSError):
+		key = None
+	if (key is not None) and (key in file_metadata_cache):
+		return file_metadata_cache[key]
+
+	# decode the character arrays all at once 
+	def decode_table(name):
+		if name not in f.variables:
+			return []
+		return [str(x).rstrip() for x in chartostring(f.variables[name][:])]
+
+	MI = dict()
+	MI['CopyMetaData'] = decode_table('CopyMetaData')
+	MI['ObsTypesMetaData'] = decode_table('ObsTypesMetaData')
+	MI['QCMetaData'] = decode_table('QCMetaData')
+	MI['copy'] = {cs:ii for ii,cs in reversed(list(enumerate(MI['CopyMetaData'])))}
+	MI['obs_type'] = {ot:ii+1 for ii,ot in reversed(list(enumerate(MI['ObsTypesMetaData'])))}
+	MI['qc'] = {qc:ii for ii,qc in reversed(list(enumerate(MI['QCMetaData'])))}
+	MI['ensemble member'] = dict()
+	for ii,cs in enumerate(MI['CopyMetaData']):
+		if cs.startswith('ensemble member'):
+			MI['ensemble member'][int(cs.replace('ensemble member',''))] = ii
+	MI['ensemble size'] = len([cs for cs in MI['CopyMetaData'] if 'ensemble member' in cs])
+
+	# store -- but don't let the cache grow forever  
+	if key is not None:
+		if len(file_metadata_cache) > 1000:
+			file_metadata_cache.clear()
+		file_metadata_cache[key] = MI
+
+	return MI
+
 def get_ensemble_size(f):
 
 	"""
@@ -784,13 +1204,7 @@ def get_ensemble_size(f):
 	find the number of ensemble members in the output  
 	"""
 
-	CMD = f.variables['CopyMetaData'][:]
-	CopyMetaData = []
-	for ii in range(0,len(CMD)):
-		temp = CMD[ii,].tostring()
-		CopyMetaData.append(temp.rstrip())
-	ens_members = [x for x in CopyMetaData if 'ensemble member' in x]
-	return len(ens_members)
+	return file_metadata_index(f)['ensemble size']
 
 
 def get_obs_type_number(f,obs_type_string):
@@ -800,24 +1214,30 @@ def get_obs_type_number(f,obs_type_string):
 	that corresponds to a given obs_typestring
 	"""
 
-        # figure out which obs_type to load
-	OTMD = f.variables['ObsTypesMetaData'][:]
-	ObsTypesMetaData = []
-	for ii in range(0,len(OTMD)):
-		temp = OTMD[ii,].tostring()
-		temp2 = temp.decode('UTF-8')
-		ObsTypesMetaData.append(temp2.rstrip())
-
-	obs_type = ObsTypesMetaData.index(obs_type_string)+1
+	OT = file_metadata_index(f)['obs_type']
+	if obs_type_string not in OT:
+		raise ValueError(obs_type_string+' is not an obs type in this file')
 
-	return obs_type
+	return OT[obs_type_string]
 
 def get_copy(f,CopyMetaData,copystring,debug=False):
 
 	"""
 	having opened a DART output diagnostic netcdf file, find the copy number that corresponds to a given copystring
+	If CopyMetaData is None, the copy names stored in the file are used. 
 	"""
 	
+	# if the copy names are the ones in the file, we can use the lookup tables of the file 
+	MI = file_metadata_index(f)
+	if (CopyMetaData is None) or (CopyMetaData is MI['CopyMetaData']):
+		if copystring.startswith('ensemble member'):
+			ensindex = int(copystring.replace('ensemble member',''))
+			if ensindex in MI['ensemble member']:
+				return MI['ensemble member'][ensindex]
+		if copystring not in MI['copy']:
+			raise ValueError(copystring+' is not a copy in this file')
+		return MI['copy'][copystring]
+
 	# DART copy strings for individual ensemble members have extra spaces in them -- account for that here:
 	if 'ensemble member' in copystring:
 		ensindex = re.sub(r'ensemble member*','',copystring).strip()
@@ -896,104 +1316,570 @@ def daterange(date_start=datetime.datetime(2009,1,1), periods=5, DT='1D'):
 def rank_hist(VE,VT):
 
 	"""
-	given a 1-D ensemble time series and a verification (usually the truth), compute the
-	rank histogram over the desired block of time  
+	given an ensemble and a verification (usually the truth), compute the
+	rank histogram over the desired block of time and/or space  
+
+	VE: ensemble array of any shape, where the first dimension is the ensemble member  
+	VT: the verification, with as many entries as a single ensemble member 
 	"""
 
 	# query the ensemble size
 	N = VE.shape[0]
 
-	# turn the ensemble and truth into vectors (in case they are 3D fields)
-	if len(VE.shape)== 6:
-		nentries = VE.shape[1]*VE.shape[2]*VE.shape[3]*VE.shape[4]*VE.shape[5]
-		ens = np.zeros((N,nentries))
-		for iens in range(N):
-			ens[iens,:] = np.ravel(VE[iens,:,:,:,:,:])	
-	if len(VE.shape)== 5:
-		nentries = VE.shape[1]*VE.shape[2]*VE.shape[3]*VE.shape[4]
-		ens = np.zeros((N,nentries))
-		for iens in range(N):
-			ens[iens,:] = np.ravel(VE[iens,:,:,:,:])	
-	if len(VE.shape)== 4:
-		nentries = VE.shape[1]*VE.shape[2]*VE.shape[3]
-		ens = np.zeros((N,nentries))
-		for iens in range(N):
-			ens[iens,:] = np.ravel(VE[iens,:,:,:])	
-	if len(VE.shape)== 3:
-		nentries = VE.shape[1]*VE.shape[2]
-		ens = np.zeros((N,nentries))
-		for iens in range(N):
-			ens[iens,:] = np.ravel(VE[iens,:,:])	
-
-	# determine the length of the ensemble series
-	nT = ens.shape[1]
-
-	# the verification series is the true state, raveleed over all spatial or time directions
+	# turn the ensemble and truth into ensemble x samples (in case they are 3D fields)
+	ens = np.reshape(VE,(N,-1))
 	verif = np.ravel(VT)
 
 	# given an N-member ensemble and a verification, there are N+1 possible ranks
 	# the number of bins is the ensemble size plus 1
 	bins = range(1,N+2)
-	hist = [0]*len(bins)
+	RH = rank_hist_accumulator(N)
+	rank_hist_update(RH,ens,verif)
+	hist = RH['hist'][0].tolist()
 
-	# loop through the times, and get a count for each bin
-	for i in range(nT):
+	return bins,hist
 
-		# for each time, reset the counter to zero
-		count = 0
+def ensemble_ranks(VE,VT,axis=0):
 
-		for j in range(N):
-			# count every ensemble member that is less than the true value
-			if (verif[i] > ens[j,i]):
-				count += 1
-		# after checking all ensemble members, add the resulting 
-		# count to the appropriate bin:
-		hist[count] += 1 
+	"""
+	compute the rank of a verification (usually the truth) within an ensemble, i.e. 
+	the number of ensemble members that are smaller than the verification, at every point 
 
-	return bins,hist
+	VE: ensemble array of any shape, where the ensemble members run along the dimension given by axis (default 0) 
+	VT: the verification, shaped like VE without the ensemble dimension 
 
-def kurtosis(ens):  
+	returns an integer array shaped like VT, with values between 0 and N  
+	"""
+
+	ens = np.rollaxis(np.ma.getdata(VE),axis,0)
+	verif = np.ma.getdata(VT)
+	return np.sum(ens < verif[np.newaxis,...],axis=0)
+
+def rank_hist_accumulator(N,regions=None):
 
 	"""
-	given a 1D ensemble of numbers (obs space, state space, whatever) return the kurtosis of the PDF represented by the ensemble
+	set up a dictionary that collects the rank histogram of an N-member ensemble bit by bit, 
+	e.g. one date at a time, so that we never have to hold the whole ensemble time series in memory. 
+	Add data to it with rank_hist_update. 
+
+	regions: optional integer array that assigns each point of a single ensemble member to a region 
+		(0, 1, 2, ...) -- a separate histogram is collected for each region. 
+		It only has to broadcast to the shape of a single member, so to get one histogram per vertical level of 
+		a lat x lon x lev field, just give np.arange(nlev). Points with negative region numbers are left out. 
+		Default is None, i.e. one histogram for all points. 
+
+	The dictionary holds:
+	'bins': the ranks 1 to N+1  
+	'hist': the counts, shaped nregions x (N+1)
+	'nsamples': the number of times rank_hist_update was called 
 	"""
 
-	# compute the standard deviation and mean
-	sigma = np.std(ens)
-	mu = np.mean(ens)
-	N = len(ens)
+	if regions is None:
+		nregions = 1
+	else:
+		regions = np.asarray(regions,dtype=int)
+		nregions = regions.max()+1
+
+	RH = {'N':N,
+		'bins':range(1,N+2),
+		'regions':regions,
+		'hist':np.zeros((nregions,N+1),dtype=np.int64),
+		'nsamples':0
+		}
+
+	return RH
 
-	# this is the factor that multiplies the summation in the kurtosis:
-	fac = 1/((N-1)*sigma**4)
+def rank_hist_update(RH,VE,VT,axis=0):
 
-	kurtosis = 0
-	for iens in range(N):
-		dev = (ens[iens]-mu)**4
-		kurtosis += fac*dev
+	"""
+	add an ensemble VE and its verification VT to the rank histogram(s) collected in RH 
+	(see rank_hist_accumulator). Points where the verification or any ensemble member are masked or NaN are left out. 
+
+	VE: ensemble array of any shape, where the ensemble members run along the dimension given by axis (default 0) 
+	VT: the verification, shaped like VE without the ensemble dimension 
+	"""
+
+	N = RH['N']
+	ranks = np.atleast_1d(ensemble_ranks(VE,VT,axis))
+
+	# points that don't count: masked or NaN anywhere 
+	bad = np.atleast_1d(np.isnan(np.ma.getdata(VT)) | np.ma.getmaskarray(VT))
+	bad = bad | np.atleast_1d(np.any(np.isnan(np.ma.getdata(VE)) | np.ma.getmaskarray(VE),axis=axis))
+
+	if RH['regions'] is None:
+		RH['hist'][0,:] += np.bincount(ranks[~bad],minlength=N+1)
+	else:
+		regions = np.broadcast_to(RH['regions'],ranks.shape)
+		good = ~bad & (regions >= 0)
+		nregions = RH['hist'].shape[0]
+		index = regions[good]*(N+1)+ranks[good]
+		RH['hist'] += np.bincount(index,minlength=nregions*(N+1)).reshape(nregions,N+1)
+	RH['nsamples'] += 1
 
-	return kurtosis
+	return RH
+
+def kurtosis(ens):  
+
+	"""
+	given a 1D ensemble of numbers (obs space, state space, whatever) return the kurtosis of the PDF represented by the ensemble
+	(for whole fields of ensembles, see ensemble_moments) 
+	"""
+
+	return float(ensemble_moments(np.asarray(ens,dtype=float))['kurtosis'])
 
 def skewness(ens):  
 
 	"""
 	given a 1D ensemble of numbers (obs space, state space, whatever) return the skewness of the PDF represented by the ensemble
+	(for whole fields of ensembles, see ensemble_moments) 
+	"""
+
+	return float(ensemble_moments(np.asarray(ens,dtype=float))['skewness'])
+
+def ensemble_moments(VE,axis=0,M=None):
+
+	"""
+	compute the ensemble mean, variance, skewness, and kurtosis at every point of an ensemble of fields, in one pass. 
+
+	INPUTS:
+	VE: ensemble array of any shape (can be a masked array -- masked members are left out at that point), 
+		where the ensemble members run along the dimension given by axis (default 0)
+	M: optional dictionary of moments returned by an earlier call -- if given, the members in VE 
+		are added to the ones that went into M. This way the ensemble can be fed in chunk by chunk, 
+		e.g. a few members at a time. 
+
+	The moments are merged with the pairwise formulas of Chan et al. (1979), which are numerically 
+	stable, and the same formulas are used within each chunk (Welford-style updates would 
+	need a Python loop over members). 
+
+	Returns a dictionary with the sums that are needed to keep going ('n','mean','M2','M3','M4'), 
+	and the fields 
+	'mean'
+	'variance' (with N-1 in the denominator)
+	'skewness' and 'kurtosis' (with the same definitions as the skewness and kurtosis functions above, 
+		i.e. sum of the 3rd/4th power deviations over (N-1)*sigma**3 or (N-1)*sigma**4, where 
+		sigma is the standard deviation with N in the denominator) 
+	"""
+
+	# moments of this chunk of members, computed relative to its own mean  
+	ens = np.rollaxis(np.ma.asarray(VE,dtype=np.float64),axis,0)
+	valid = ~np.ma.getmaskarray(ens)
+	x = np.ma.getdata(ens)*valid
+	nb = np.sum(valid,axis=0).astype(np.float64)
+	meanb = np.sum(x,axis=0)/np.maximum(nb,1)
+	d = (x-meanb[np.newaxis,...])*valid
+	d2 = d*d
+	B = {'n':nb,
+		'mean':meanb,
+		'M2':np.sum(d2,axis=0),
+		'M3':np.sum(d2*d,axis=0),
+		'M4':np.sum(d2*d2,axis=0)}
+	del x,d,d2
+
+	# merge with what we had before  
+	if M is None:
+		MM = B
+	else:
+		na = M['n']
+		n = na+nb
+		ns = np.maximum(n,1)
+		delta = B['mean']-M['mean']
+		MM = dict()
+		MM['n'] = n
+		MM['mean'] = M['mean']+delta*nb/ns
+		MM['M2'] = M['M2']+B['M2']+delta**2*na*nb/ns
+		MM['M3'] = (M['M3']+B['M3']+delta**3*na*nb*(na-nb)/ns**2 
+				+3.0*delta*(na*B['M2']-nb*M['M2'])/ns)
+		MM['M4'] = (M['M4']+B['M4']+delta**4*na*nb*(na*na-na*nb+nb*nb)/ns**3
+				+6.0*delta**2*(na*na*B['M2']+nb*nb*M['M2'])/ns**2
+				+4.0*delta*(na*B['M3']-nb*M['M3'])/ns)
+
+	# turn the sums into the moments -- points with too few members come out as NaN  
+	with np.errstate(divide='ignore',invalid='ignore'):
+		N = MM['n']
+		sigma2 = MM['M2']/N
+		MM['variance'] = np.where(N > 1,MM['M2']/(N-1),np.nan)
+		MM['skewness'] = np.where(N > 1,MM['M3']/((N-1)*sigma2**1.5),np.nan)
+		MM['kurtosis'] = np.where(N > 1,MM['M4']/((N-1)*sigma2**2),np.nan)
+
+	return MM
+
+def ensemble_covariance(VE,Y,axis=0,chunk_size=None):
+
+	"""
+	compute the ensemble covariance and correlation between every point of an ensemble of fields 
+	and one or more ensembles of scalars (e.g. the ensemble estimates of some observations) 
+
+	INPUTS:
+	VE: ensemble array of any shape, where the ensemble members run along the dimension given by axis (default 0). 
+		This can also be a numpy memmap.  
+	Y: ensemble of the scalars, shaped N (one scalar) or N x nobs (several) 
+	chunk_size: if given, the points of the field are processed this many at a time, so that only 
+		one chunk of the field is ever converted to floating point in memory. Default is None (all at once). 
+
+	The field is reshaped into a matrix of N members by npoints, and the covariances with all the 
+	scalars come out of a single matrix product. Covariances have N-1 in the denominator, and 
+	correlations are the covariances divided by both standard deviations. 
+
+	Returns the covariance and correlation, shaped like a single ensemble member, plus an 
+	extra last dimension of length nobs if Y is 2D 
+	"""
+
+	# masked fields stay masked here -- the masked points are set to NaN one chunk at a time below 
+	ens = np.rollaxis(VE,axis,0)
+	N = ens.shape[0]
+	field_shape = ens.shape[1:]
+	X = np.reshape(ens,(N,-1))
+	npoints = X.shape[1]
+
+	# anomalies and standard deviations of the scalars  
+	Y2 = np.reshape(np.ma.filled(np.ma.asarray(Y,dtype=np.float64),np.nan),(N,-1))
+	Ya = Y2-np.mean(Y2,axis=0)[np.newaxis,:]
+	sy = np.sqrt(np.sum(Ya*Ya,axis=0)/(N-1))
+	nobs = Y2.shape[1]
+
+	C = np.empty((npoints,nobs))
+	R = np.empty((npoints,nobs))
+	if chunk_size is None:
+		chunk_size = npoints
+	for i1 in range(0,npoints,chunk_size):
+		i2 = min(i1+chunk_size,npoints)
+		if np.ma.isMaskedArray(X):
+			Xa = np.ma.filled(X[:,i1:i2].astype(np.float64),np.nan)
+		else:
+			Xa = np.asarray(X[:,i1:i2],dtype=np.float64)
+		Xa = Xa-np.mean(Xa,axis=0)[np.newaxis,:]
+		sx = np.sqrt(np.sum(Xa*Xa,axis=0)/(N-1))
+		C[i1:i2,:] = np.dot(Xa.T,Ya)/(N-1)
+		with np.errstate(divide='ignore',invalid='ignore'):
+			R[i1:i2,:] = C[i1:i2,:]/(sx[:,np.newaxis]*sy[np.newaxis,:])
+
+	if np.ndim(Y) == 1:
+		return np.reshape(C,field_shape),np.reshape(R,field_shape)
+	else:
+		return np.reshape(C,field_shape+(nobs,)),np.reshape(R,field_shape+(nobs,))
+
+def bootstrap_mean_ci(X,nsamples=1000,P=95,axis=0,seed=None,nprocs=1,sample_chunk=100,point_chunk=2000):
+
+	"""
+	bootstrap confidence intervals for the ensemble mean at every point of an ensemble of fields. 
+
+	INPUTS:
+	X: ensemble array of any shape (masked or NaN values are left out of the means), with the ensemble 
+		members along the dimension given by axis (default 0) 
+	nsamples: the number of bootstrap samples -- default is 1000 
+	P: the percentage of the confidence interval -- default is 95 
+	seed: integer seed for the random resampling. The same seed always gives the same result, 
+		regardless of nprocs. If None, a seed is drawn at random (and returned, so the result can be repeated). 
+	nprocs: number of processes that the points of the field are spread over. Default is 1. 
+	sample_chunk: the resamples are drawn this many at a time, each chunk from its own random stream 
+		seeded by (seed, chunk number) -- see bootstrap_resample_counts 
+	point_chunk: the number of points of the field handled at a time 
+
+	All the resamples are drawn up front as a matrix of how many times each member goes into each 
+	sample, so the resampled means for a block of points are one matrix product. 
+	The confidence interval is given by the percentiles of the resampled means. 
+
+	Returns a dictionary with the fields 'mean', 'lower', and 'upper' (shaped like one ensemble member), 
+	'sig' (True where the confidence interval doesn't include zero), and the 'seed', 'nsamples', and 'P' used. 
+	"""
+
+	ens = np.rollaxis(np.ma.filled(np.ma.asarray(X,dtype=np.float64),np.nan),axis,0)
+	N = ens.shape[0]
+	field_shape = ens.shape[1:]
+	X2 = np.reshape(ens,(N,-1))
+	npoints = X2.shape[1]
+
+	if seed is None:
+		seed = np.random.randint(0,2**31-1)
+	counts = bootstrap_resample_counts(N,nsamples,seed,sample_chunk)
+
+	arglist = [(X2[:,i1:i1+point_chunk],counts,P) for i1 in range(0,npoints,point_chunk)]
+	if nprocs > 1:
+		import multiprocessing
+		pool = multiprocessing.Pool(processes=nprocs)
+		results = pool.map(bootstrap_mean_ci_worker,arglist)
+		pool.close()
+		pool.join()
+	else:
+		results = [bootstrap_mean_ci_worker(args) for args in arglist]
+
+	CI = dict()
+	for ii,name in enumerate(['mean','lower','upper']):
+		CI[name] = np.reshape(np.concatenate([R[ii] for R in results]),field_shape)
+	CI['sig'] = (CI['lower']*CI['upper']) > 0
+	CI['seed'] = seed
+	CI['nsamples'] = nsamples
+	CI['P'] = P
+
+	return CI
+
+def bootstrap_resample_counts(N,nsamples,seed,chunk_size=100):
+
+	"""
+	draw nsamples bootstrap resamples of N ensemble members, and return them as an nsamples x N 
+	matrix that counts how often each member was drawn for each sample. 
+	The samples are drawn chunk_size at a time, and each chunk gets its own random stream, 
+	seeded with (seed, chunk number), so the result only depends on the seed. 
+	"""
+
+	counts = np.zeros((nsamples,N))
+	for ichunk,i1 in enumerate(range(0,nsamples,chunk_size)):
+		i2 = min(i1+chunk_size,nsamples)
+		rs = np.random.RandomState([seed,ichunk])
+		idx = rs.randint(0,N,size=(i2-i1,N))
+		# count the draws of each member, sample by sample 
+		idx = idx+N*np.arange(i2-i1)[:,np.newaxis]
+		counts[i1:i2,:] = np.reshape(np.bincount(idx.ravel(),minlength=(i2-i1)*N),(i2-i1,N))
+	return counts
+
+def bootstrap_mean_ci_worker(args):
+
+	# ensemble mean and bootstrap confidence interval for a block of points -- see bootstrap_mean_ci 
+	Xb,counts,P = args
+	valid = ~np.isnan(Xb)
+	Xf = np.where(valid,Xb,0.0)
+	with np.errstate(divide='ignore',invalid='ignore'):
+		mean = np.sum(Xf,axis=0)/np.sum(valid,axis=0)
+		means = np.dot(counts,Xf)/np.dot(counts,valid.astype(np.float64))
+	lower,upper = np.percentile(means,[50.0-P/2.0,50.0+P/2.0],axis=0)
+	return mean,lower,upper
+
+def interpolate_columns(V,Z,znew,axis=0,kind='linear',chunk_axis=None,chunk_size=1):
+
+	"""
+	interpolate every column of a multi-dimensional array onto a new vertical coordinate, all columns at once. 
+
+	INPUTS:
+	V: the array to interpolate (masked values are treated as missing)  
+	Z: the vertical coordinate of each point in V -- either the same shape as V or something that 
+		broadcasts to it (e.g. a 1D array of levels expanded along the other dimensions). Each column 
+		has to be monotonic, but can be increasing or decreasing. 
+	znew: 1D array of the coordinate values to interpolate to 
+	axis: the dimension of V that holds the vertical levels. Default is 0. 
+	kind: 'linear', or 'cubic' for a monotone (shape-preserving, PCHIP) cubic. Default is 'linear'. 
+	chunk_axis: if given, V is processed chunk_size slices at a time along this dimension 
+		(e.g. ensemble copies or time), which keeps the temporary arrays small. Default is None. 
+	chunk_size: the number of slices per chunk (default 1) 
+
+	Points of znew that are outside the range of a column, or that fall between levels 
+	with missing values, come out masked. 
+	Returns a masked array shaped like V, but with len(znew) points along axis. 
+	"""
+
+	V = np.ma.filled(np.ma.asarray(V,dtype=np.float64),np.nan)
+	Z = np.broadcast_to(np.ma.filled(np.ma.asarray(Z,dtype=np.float64),np.nan),V.shape)
+	znew = np.asarray(znew,dtype=np.float64)
+	if axis < 0:
+		axis = axis+V.ndim
+
+	Snew = list(V.shape)
+	Snew[axis] = len(znew)
+	Vnew = np.empty(Snew)
+
+	if chunk_axis is None:
+		Vnew[...] = interpolate_columns_block(V,Z,znew,axis,kind)
+	else:
+		if chunk_axis < 0:
+			chunk_axis = chunk_axis+V.ndim
+		if chunk_axis == axis:
+			raise ValueError('interpolate_columns: cannot chunk along the vertical dimension')
+		for i1 in range(0,V.shape[chunk_axis],chunk_size):
+			sl = [slice(None)]*V.ndim
+			sl[chunk_axis] = slice(i1,i1+chunk_size)
+			sl = tuple(sl)
+			Vnew[sl] = interpolate_columns_block(V[sl],Z[sl],znew,axis,kind)
+
+	return np.ma.masked_invalid(Vnew,copy=False)
+
+def interpolate_columns_block(V,Z,znew,axis,kind):
+
+	# the engine behind interpolate_columns: move the vertical dimension to the end, 
+	# flatten everything else into one long list of columns, and interpolate them all at once 
+	Vc = np.rollaxis(V,axis,V.ndim)
+	S = Vc.shape
+	nlev = S[-1]
+	Vc = np.reshape(Vc,(-1,nlev))
+	Zc = np.reshape(np.rollaxis(Z,axis,Z.ndim),(-1,nlev))
+	ncol = Vc.shape[0]
+
+	# flip the columns where the coordinate decreases, so that all of them increase 
+	flip = Zc[:,-1] < Zc[:,0]
+	Zc = np.where(flip[:,np.newaxis],Zc[:,::-1],Zc)
+	Vc = np.where(flip[:,np.newaxis],Vc[:,::-1],Vc)
+
+	# for each new level, find the layer of each column that it falls in 
+	k = np.sum(Zc[:,:,np.newaxis] <= znew[np.newaxis,np.newaxis,:],axis=1)-1
+	outside = (k < 0) | (znew[np.newaxis,:] > Zc[:,-1:]) | np.isnan(Zc).any(axis=1)[:,np.newaxis]
+	k = np.clip(k,0,nlev-2)
+	icol = np.arange(ncol)[:,np.newaxis]
+	z0 = Zc[icol,k]
+	z1 = Zc[icol,k+1]
+	v0 = Vc[icol,k]
+	v1 = Vc[icol,k+1]
+	h = z1-z0
+	with np.errstate(divide='ignore',invalid='ignore'):
+		t = (znew[np.newaxis,:]-z0)/h
+
+		if kind == 'linear':
+			Vnew = v0+t*(v1-v0)
+		elif kind == 'cubic':
+			# monotone cubic Hermite interpolation (Fritsch and Carlson 1980), with the derivatives at the 
+			# levels computed the same way as scipy.interpolate.PchipInterpolator
+			hk = np.diff(Zc,axis=1)
+			dk = np.diff(Vc,axis=1)/hk
+			d = np.zeros(Vc.shape)
+			w1 = 2*hk[:,1:]+hk[:,:-1]
+			w2 = hk[:,1:]+2*hk[:,:-1]
+			same_sign = (np.sign(dk[:,:-1])*np.sign(dk[:,1:])) > 0
+			d[:,1:-1] = np.where(same_sign,(w1+w2)/(w1/dk[:,:-1]+w2/dk[:,1:]),0.0)
+			if nlev > 2:
+				d[:,0] = pchip_end_slope(hk[:,0],hk[:,1],dk[:,0],dk[:,1])
+				d[:,-1] = pchip_end_slope(hk[:,-1],hk[:,-2],dk[:,-1],dk[:,-2])
+			else:
+				d[:,0] = dk[:,0]
+				d[:,-1] = dk[:,0]
+			d0 = d[icol,k]
+			d1 = d[icol,k+1]
+			Vnew = (v0*(1+2*t)*(1-t)**2 + h*d0*t*(1-t)**2 +
+				v1*t**2*(3-2*t) + h*d1*t**2*(t-1))
+		else:
+			raise ValueError('interpolate_columns: kind has to be linear or cubic, not '+str(kind))
+
+	Vnew[outside] = np.nan
+
+	return np.rollaxis(np.reshape(Vnew,S[:-1]+(len(znew),)),len(S)-1,axis)
+
+def pchip_end_slope(h0,h1,d0,d1):
+
+	# one-sided, shape-preserving derivative at the end of a column for monotone cubic interpolation 
+	with np.errstate(divide='ignore',invalid='ignore'):
+		d = ((2*h0+h1)*d0-h0*d1)/(h0+h1)
+	d = np.where(np.sign(d) != np.sign(d0),0.0,d)
+	return np.where((np.sign(d0) != np.sign(d1)) & (np.abs(d) > np.abs(3*d0)),3*d0,d)
+
+def level_axis(axis,ndim,dims=None):
+
 	"""
+	turn a dimension given by position (int, possibly negative) or by name (e.g. 'lev', looked up 
+	in the list of dimension names dims) into a non-negative position in an array with ndim dimensions 
+	"""
+	if isinstance(axis,str):
+		if (dims is None) or (axis not in dims):
+			raise ValueError('level_axis: cannot find a dimension called '+axis+' in '+str(dims))
+		axis = list(dims).index(axis)
+	if axis < 0:
+		axis = axis+ndim
+	return axis
 
-	# compute the standard deviation and mean
-	sigma = np.std(ens)
-	mu = np.mean(ens)
-	N = len(ens)
+def hybrid_pressure(hyam,hybm,PS,P0=1.0E5,axis=-1,dims=None):
 
-	# this is the factor that multiplies the summation in the kurtosis:
-	fac = 1/((N-1)*sigma**3)
+	"""
+	compute the pressure on hybrid sigma-pressure model levels, p = hyam*P0 + hybm*PS, 
+	for a surface pressure field of any shape (e.g. copy x lat x lon x time) at once. 
 
-	kurtosis = 0
-	for iens in range(N):
-		dev = (ens[iens]-mu)**3
-		kurtosis += fac*dev
+	INPUTS:
+	hyam, hybm: 1D arrays of the hybrid coefficients at the model levels 
+	PS: surface pressure array (in the same units as P0), without a level dimension 
+	P0: reference pressure (default 1.0E5 Pa). Arrays of length 1, like the P0 variable in CAM and DART files, are fine. 
+	axis: where the level dimension goes in the output, either as a position or as a name in dims. 
+		Default is -1, i.e. the levels are the last dimension, as in DART diagnostic files. 
+	dims: list of the names of the dimensions of the output (e.g. ['copy','lat','lon','lev']), 
+		only needed if axis is a name 
+
+	Returns the pressure array, shaped like PS with the levels inserted at axis. 
+	"""
+	PS = np.ma.asarray(PS)
+	P0 = float(np.squeeze(P0))
+	axis = level_axis(axis,PS.ndim+1,dims)
+	shape = [1]*(PS.ndim+1)
+	shape[axis] = len(hyam)
+	A = np.reshape(np.asarray(hyam,dtype=np.float64),shape)
+	B = np.reshape(np.asarray(hybm,dtype=np.float64),shape)
+	return A*P0 + B*np.ma.expand_dims(PS,axis)
 
-	return kurtosis
+def reference_pressure(P):
 
+	"""
+	guess the reference pressure (1000 hPa) in the units of the pressure array P: 
+	1.0E5 if P looks like it is in Pa, 1000.0 if it looks like hPa 
+	"""
+	if np.nanmax(np.ma.filled(P,np.nan)) > 2000.0:
+		return 100000.0
+	else:
+		return 1000.0
+
+def altitude(P=None,Z=None,P0=None,H=7.0):
+
+	"""
+	compute altitude in km, either as log-pressure (scale height) altitude z = H*log(P0/P) 
+	from a pressure array P, or as geometric altitude from an array Z of geopotential height (in m). 
+	If Z is given it is used, otherwise P. 
+	P0 is the reference pressure in the units of P (default: 1000 hPa, in whatever units P seems to be in). 
+	H is the scale height in km (default 7.0). 
+	Works on arrays of any shape. 
+	"""
+	if Z is not None:
+		a = 6.37122E6			# radius of the Earth (m)
+		return 1.0E-3*a*Z/(a-Z)
+	if P0 is None:
+		P0 = reference_pressure(P)
+	return H*np.log(P0/P)
+
+def potential_temperature(T,P,P0=None):
+
+	"""
+	potential temperature theta = T*(P0/P)^(R/cp) for temperature T (in K) and pressure P, which 
+	only have to broadcast against each other (e.g. T shaped copy x lat x lon x lev and P lat x lon x lev) 
+	P0 is the reference pressure in the units of P (default: 1000 hPa, in whatever units P seems to be in). 
+	"""
+	Rd = 286.9968933                # Gas constant for dry air        J/degree/kg
+	cp = 1005.0                     # heat capacity at constant pressure    m^2/s^2*K
+	if P0 is None:
+		P0 = reference_pressure(P)
+	return T*(P0/P)**(Rd/cp)
+
+def buoyancy_frequency(T,P=None,z=None,axis=-1,dims=None,P0=None,H=7.0):
+
+	"""
+	compute the squared buoyancy frequency N2 = (g/theta)*dtheta/dz (in s^-2) for every column 
+	of a temperature array of any shape (e.g. copy x lat x lon x lev x time) at once. 
+
+	INPUTS:
+	T: temperature array in K 
+	P: pressure array that broadcasts against T (e.g. from hybrid_pressure). Default is None. 
+	z: altitude array in km that broadcasts against T. Default is None. 
+		At least one of P and z have to be given: if z is missing it is computed from P as 
+		log-pressure altitude with scale height H (in km, default 7.0), and if P is missing it is 
+		computed from z the same way. 
+	axis: the vertical dimension of T, either as a position or as a name in dims. Default is -1. 
+	dims: list of the dimension names of T (e.g. ['copy','lat','lon','lev']), only needed if axis is a name  
+	P0: reference pressure in the units of P (default: 1000 hPa, in whatever units P seems to be in). 
+
+	The vertical derivative is computed along the level index (centered differences, one-sided at the ends) 
+	and divided by the derivative of z, so the levels don't have to be evenly spaced. 
+	Returns N2 shaped like T (broadcast against P and z). 
+	"""
+	g = 9.80616                     # Acceleration due to gravity       m/s^2
+	if (P is None) and (z is None):
+		raise ValueError('buoyancy_frequency: need either pressure or altitude')
+	if P is None:
+		if P0 is None:
+			P0 = 1000.0
+		P = P0*np.exp(-np.asarray(z)/H)
+	if z is None:
+		z = altitude(P=P,P0=P0,H=H)
+
+	theta = potential_temperature(T,P,P0)
+	axis = level_axis(axis,np.ndim(theta),dims)
+	zz = np.broadcast_to(np.ma.filled(np.ma.asarray(z,dtype=np.float64),np.nan),np.shape(theta))
+
+	# dtheta/dz = (dtheta/dk)/(dz/dk), with z converted from km to m 
+	with np.errstate(divide='ignore',invalid='ignore'):
+		dthetadZ = np.gradient(np.ma.filled(theta,np.nan),axis=axis)/np.gradient(zz*1.0E3,axis=axis)
+		N2 = (g/theta)*dthetadZ
+
+	return np.ma.masked_invalid(N2)
 
 def point_check_dictionaries(return_as_list=True):
 
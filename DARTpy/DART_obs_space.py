@@ -51,16 +51,16 @@ def plot_DARTobs_scatter_globe(E,projection='miller',coastline_width=0,water_col
 		E['latrange'] = [-90,90]
 		E['lonrange'] = [0,361]
 
- 	# set up a map projection
+ 	# set up a map projection -- or reuse the one made by an earlier plot of the same region
 	if projection == 'miller':
 		maxlat = np.min([E['latrange'][1],90.0])
 		minlat = np.max([E['latrange'][0],-90.0])
-		map = Basemap(projection='mill',llcrnrlat=minlat,urcrnrlat=maxlat,\
+		map = dart.cached_basemap(projection='mill',llcrnrlat=minlat,urcrnrlat=maxlat,\
 			    llcrnrlon=E['lonrange'][0],urcrnrlon=E['lonrange'][1],resolution='l')
 	if 'stere' in projection:
-		map = Basemap(projection=projection,boundinglat=boundinglat,lon_0=0,resolution='l')
+		map = dart.cached_basemap(projection=projection,boundinglat=boundinglat,lon_0=0,resolution='l')
 	if projection == None:
-		map = Basemap(projection='ortho',lat_0=54,lon_0=10,resolution='l')
+		map = dart.cached_basemap(projection='ortho',lat_0=54,lon_0=10,resolution='l')
 
         # draw coastlines, country boundaries, fill continents.
         map.drawcoastlines(linewidth=coastline_width)
@@ -9,6 +9,7 @@ import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 from mpl_toolkits.basemap import Basemap
 import datetime
+import os
 import pandas as pd
 import DART as dart
 from netCDF4 import Dataset
@@ -30,6 +31,12 @@ var1d = ['hyam','hybm','hyai','hybi']
 # constants
 H = 7.0    # 7.0km scale height 
 
+# maximum size (in bytes) of the on-disk cache of DART_diagn_to_array results -- see diagn_cache_store 
+diagn_cache_max_bytes = 20.0E9
+
+# hybrid level coefficients of each model grid, keyed by experiment and file type -- see hybrid_level_coefficients 
+hybrid_coefficient_cache = dict()
+
 
 def retrieve_diagn_and_process(E,Ediff=None,averaging_dimensions=['lat']):
 
@@ -96,13 +103,30 @@ def plot_diagnostic_globe(E,Ediff=None,projection='miller',clim=None,cbar='verti
 		Entries in this dict are: 
 			P: the probability level at which we estimate the confidence intervals
 			nsamples: the number of bootstrap samples 
+			seed (optional): integer seed for the resampling, which makes the result reproducible 
+			nprocs (optional): the number of processes for the bootstrap 
 		If these things are set, we add shading to denote fields that are statistically significantly 
 			different from zero -- so this actually only makes sense for anomaies. 
 		if stat_sig is set to "None" (which is the default), just load the data and plot. 
+
+	This is compute_diagnostic_globe followed by render_diagnostic_globe.
+	"""
+
+	P = compute_diagnostic_globe(E,Ediff,projection,stat_sig,hostname,debug)
+	return render_diagnostic_globe(P,E,Ediff,projection,clim,cbar,log_levels,ncolors,colorbar_label,reverse_colors,debug)
+
+def compute_diagnostic_globe(E,Ediff=None,projection='miller',stat_sig=None,hostname='taurus',debug=False):
+
+	"""
+	load the data for plot_diagnostic_globe (see there for the inputs), average them over time and 
+	vertical levels, and return a dictionary holding the lat x lon field to plot ('data'), 
+	'lat', 'lon', the statistical significance mask ('sig', None if stat_sig is None), and the 
+	bounding latitude for polar stereographic maps ('boundinglat'). 
 	"""
 
 	# if plotting a polar stereographic projection, it's better to return all lats and lons, and then 
 	# cut off the unwanted regions with map limits -- otherwise we get artifical circles on a square map
+	boundinglat = None
 	if (projection == 'npstere'): 
 		if E['latrange'][0] < 0:
 			boundinglat = 0
@@ -120,7 +144,7 @@ def plot_diagnostic_globe(E,Ediff=None,projection='miller',clim=None,cbar='verti
 	##-----load data------------------
 	if stat_sig is None:
 		# turn the requested diagnostic into an array 
-		Vmatrix,lat,lon,lev,DRnew = DART_diagn_to_array(E,hostname=hostname,debug=debug)
+		Vmatrix,lat,lon,lev,DRnew = DART_diagn_to_array(E,hostname=hostname,debug=debug,return_single_variables=True)
 
 		# average over the last dimension, which is time
 		if len(DRnew) > 1:
@@ -142,7 +166,7 @@ def plot_diagnostic_globe(E,Ediff=None,projection='miller',clim=None,cbar='verti
 
 		# if computing a difference to another field, load that here  
 		if (Ediff != None):
-			Vmatrix,lat,lon,lev,DRnew = DART_diagn_to_array(Ediff,hostname=hostname,debug=debug)
+			Vmatrix,lat,lon,lev,DRnew = DART_diagn_to_array(Ediff,hostname=hostname,debug=debug,return_single_variables=True)
 			if len(DRnew) > 1:
 				VV = np.nanmean(Vmatrix,axis=len(Vmatrix.shape)-1)	
 			else:
@@ -156,6 +180,7 @@ def plot_diagnostic_globe(E,Ediff=None,projection='miller',clim=None,cbar='verti
 			M = M1-M2
 		else:
 			M = M1
+		sig = None
 	else:
 		# if statistical significance stuff was defined, loop over entire ensemble 
 		# and use bootstrap to compute confidence intervals
@@ -168,11 +193,9 @@ def plot_diagnostic_globe(E,Ediff=None,projection='miller',clim=None,cbar='verti
 
 		# loop over the ensemble  
 		for iens in range(N):
-			import bootstrap as bs
-
 			E['copystring'] = 'ensemble member '+str(iens+1)
 			# retrieve data for this ensemble member
-			Vmatrix,lat,lon,lev,DRnew = DART_diagn_to_array(E,hostname=hostname,debug=debug)
+			Vmatrix,lat,lon,lev,DRnew = DART_diagn_to_array(E,hostname=hostname,debug=debug,return_single_variables=True)
 			# if there is more than one time, average over this dimension (it's always the last one)
 			if len(DRnew) > 1:
 				VV = np.nanmean(Vmatrix,axis=len(Vmatrix.shape)-1)	
@@ -182,7 +205,7 @@ def plot_diagnostic_globe(E,Ediff=None,projection='miller',clim=None,cbar='verti
 			if E['variable'] in var3d and type(lev) != np.float64:
 				# find the level dimension
 				nlev = len(lev)
-				for dimlength,idim in zip(VV.shape,len(VV.shape)):
+				for dimlength,idim in zip(VV.shape,range(len(VV.shape))):
 					if dimlength == nlev:
 						levdim = idim
 				M1 = np.mean(VV,axis=levdim)
@@ -191,7 +214,7 @@ def plot_diagnostic_globe(E,Ediff=None,projection='miller',clim=None,cbar='verti
 			# if computing a difference to another field, load that here  
 			if (Ediff != None):
 				Ediff['copystring'] = 'ensemble member '+str(iens+1)
-				Vmatrix,lat,lon,lev,DRnew = DART_diagn_to_array(Ediff,hostname=hostname,debug=debug)
+				Vmatrix,lat,lon,lev,DRnew = DART_diagn_to_array(Ediff,hostname=hostname,debug=debug,return_single_variables=True)
 				if len(DRnew) > 1:
 					VV = np.nanmean(Vmatrix,axis=len(Vmatrix.shape)-1)	
 				else:
@@ -213,28 +236,45 @@ def plot_diagnostic_globe(E,Ediff=None,projection='miller',clim=None,cbar='verti
 		Mmatrix = np.concatenate([M[np.newaxis,...] for M in Mlist], axis=0)
 
 		# now apply bootstrap over the first dimension, which by construction is the ensemble  
-		CI = bs.bootstrap(Mmatrix,stat_sig['nsamples'],np.mean,stat_sig['P'])
+		CI = dart.bootstrap_mean_ci(Mmatrix,stat_sig['nsamples'],stat_sig['P'],axis=0,
+				seed=stat_sig.get('seed'),nprocs=stat_sig.get('nprocs',1))
 
 		# anomalies are significantly different from 0 if the confidence interval does not cross zero
-		# we can estimate this by checking if there is a sign change
-		LU = CI.lower*CI.upper
-		sig = LU > 0		# this mask is True when CI.lower and CI.upper have the same sign  
+		# -- this mask is True when the lower and upper bounds have the same sign  
+		sig = CI['sig']
 		
 		# also compute the ensemble average for plotting
-		M = np.mean(Mmatrix,axis=0)
+		M = CI['mean']
+
+	P = dict()
+	P['data'] = M
+	P['lat'] = lat
+	P['lon'] = lon
+	P['sig'] = sig
+	P['boundinglat'] = boundinglat
+	return P
+
+def render_diagnostic_globe(P,E,Ediff=None,projection='miller',clim=None,cbar='vertical',log_levels=None,ncolors=19,colorbar_label=None,reverse_colors=False,debug=False):
 
-	##-----done loading data------------------
+	"""
+	draw the output of compute_diagnostic_globe on a map in the current axes -- see plot_diagnostic_globe for the inputs.
+	"""
+	M = P['data']
+	lat = P['lat']
+	lon = P['lon']
+	sig = P['sig']
+	boundinglat = P['boundinglat']
 
- 	# set up a map projection
+ 	# set up a map projection -- or reuse the one made by an earlier plot of the same region 
 	if projection == 'miller':
 		maxlat = np.min([E['latrange'][1],90.0])
 		minlat = np.max([E['latrange'][0],-90.0])
-		map = Basemap(projection='mill',llcrnrlat=minlat,urcrnrlat=maxlat,\
+		map = dart.cached_basemap(projection='mill',llcrnrlat=minlat,urcrnrlat=maxlat,\
 			    llcrnrlon=E['lonrange'][0],urcrnrlon=E['lonrange'][1],resolution='l')
 	if 'stere' in projection:
-		map = Basemap(projection=projection,boundinglat=boundinglat,lon_0=0,resolution='l')
+		map = dart.cached_basemap(projection=projection,boundinglat=boundinglat,lon_0=0,resolution='l')
 	if projection == None:
-		map = Basemap(projection='ortho',lat_0=54,lon_0=10,resolution='l')
+		map = dart.cached_basemap(projection='ortho',lat_0=54,lon_0=10,resolution='l')
 
         # draw coastlines, country boundaries, fill continents.
 	coastline_width = 0.25
@@ -247,9 +287,8 @@ def plot_diagnostic_globe(E,Ediff=None,projection='miller',clim=None,cbar='verti
 	map.drawmeridians(np.arange(0,360,30),linewidth=0.25)
 	map.drawparallels(np.arange(-90,90,30),linewidth=0.25)
 
-        # compute native map projection coordinates of lat/lon grid.
-	X,Y = np.meshgrid(lon,lat)
-	x, y = map(X, Y)
+        # compute native map projection coordinates of lat/lon grid (kept with the map for the next plot of this grid)
+	x, y = dart.projected_grid(map,lon,lat)
 
         # choose color map based on the variable in question
 	colors,cmap,cmap_type = state_space_HCL_colormap(E,Ediff,reverse=reverse_colors)
@@ -274,7 +313,7 @@ def plot_diagnostic_globe(E,Ediff=None,projection='miller',clim=None,cbar='verti
 			cs = map.contourf(x,y,M, norm=mpl.colors.LogNorm(vmin=log_levels[0],vmax=log_levels[len(log_levels)-1]),levels=log_levels,cmap=cmap)
 		else:
 			cs = map.contourf(x,y,M,levels=L,cmap=cmap,extend="both")
-	if projection is 'miller':
+	if projection == 'miller':
 		cs = map.contourf(x,y,M,L,cmap=cmap,extend="both")
 
 	if (cbar is not None):
@@ -284,16 +323,14 @@ def plot_diagnostic_globe(E,Ediff=None,projection='miller',clim=None,cbar='verti
 			CB = plt.colorbar(cs, shrink=0.6, extend='both', orientation=cbar)
 		if colorbar_label is not None:
 			CB.set_label(colorbar_label)
-		else:
-			CB = None
+	else:
+		CB = None
 
 	# if desired, add shading for statistical significance - this only works for when we plot anomalies
-	if stat_sig is not None:
+	if sig is not None:
 		colors = ["#ffffff","#636363"]
 		cmap = mpl.colors.ListedColormap(colors, name='my_cmap')
 		map.contourf(x,y,sig,cmap=cmap,alpha=0.3)
-	else:
-		sig = None
 
 	# return the colorbar handle if available, the map handle, and the data
 	return CB,map,M,sig
@@ -312,6 +349,17 @@ def plot_diagnostic_hovmoeller(E,Ediff=None,clim=None,cbar='vertical',log_levels
 	INPUTS:  
 	log_levels: a list of the (logarithmic) levels to draw the contours on. If set to none, just draw regular linear levels. 
 
+	This is compute_diagnostic_hovmoeller followed by render_diagnostic_hovmoeller.
+	"""
+
+	P = compute_diagnostic_hovmoeller(E,Ediff,scaling_factor,hostname,debug)
+	return render_diagnostic_hovmoeller(P,E,Ediff,clim,cbar,log_levels,reverse_colors,cmap_type,debug)
+
+def compute_diagnostic_hovmoeller(E,Ediff=None,scaling_factor=1.0,hostname='taurus',debug=False):
+
+	"""
+	load the data for plot_diagnostic_hovmoeller, average over latitude and level, and return 
+	a dictionary holding the longitude x time array ('data'), 'lon', 'time', and 'units' (if available). 
 	"""
 
 	# generate an array from the requested diagnostic  
@@ -335,11 +383,21 @@ def plot_diagnostic_hovmoeller(E,Ediff=None,clim=None,cbar='vertical',log_levels
 		V2=V1
 
 	# multiply by a scaling factor if needed 
-	M = scaling_factor*np.squeeze(V2)
+	P = dict()
+	P['data'] = scaling_factor*np.squeeze(V2)
+	P['time'] = D['daterange']
+	P['lon'] = D['lon']
+	P['units'] = D.get('units')
+	return P
+
+def render_diagnostic_hovmoeller(P,E,Ediff=None,clim=None,cbar='vertical',log_levels=None,reverse_colors=False,cmap_type='sequential',debug=False):
 
-	#---plot setup----------------
-	time = D['daterange']
-	lon = D['lon']
+	"""
+	draw the output of compute_diagnostic_hovmoeller into the current axes -- see plot_diagnostic_hovmoeller for the inputs.
+	"""
+	M = P['data']
+	time = P['time']
+	lon = P['lon']
 
         # choose color map 
 	cc = nice_colormaps(cmap_type,reverse_colors)
@@ -362,22 +420,17 @@ def plot_diagnostic_hovmoeller(E,Ediff=None,clim=None,cbar='vertical',log_levels
 	cs = plt.contourf(lon,time,MT,L,cmap=cmap,extend="both")
 
 	# date axis formatting 
-	if len(time)>30:
-		fmt = mdates.DateFormatter('%b-%d')
-		plt.gca().yaxis.set_major_locator(mdates.AutoDateLocator())
-		plt.gca().yaxis.set_major_formatter(fmt)
-	else:
-		fmt = mdates.DateFormatter('%b-%d')
-		plt.gca().yaxis.set_major_locator(mdates.AutoDateLocator())
-		plt.gca().yaxis.set_major_formatter(fmt)
+	fmt = mdates.DateFormatter('%b-%d')
+	plt.gca().yaxis.set_major_locator(mdates.AutoDateLocator())
+	plt.gca().yaxis.set_major_formatter(fmt)
 
 	if cbar is not None:
 		if (clim > 1000) or (clim < 0.001):
 			CB = plt.colorbar(cs, shrink=0.8, extend='both',orientation=cbar,format='%.3f')
 		else:
 			CB = plt.colorbar(cs, shrink=0.8, extend='both',orientation=cbar)
-		if 'units' in D:
-			CB.set_label(D['units'])
+		if P['units'] is not None:
+			CB.set_label(P['units'])
 	else: 
 		CB = None
 
@@ -419,6 +472,22 @@ def plot_diagnostic_lev_time(E=dart.basic_experiment_dict(),Ediff=None,vertical_
 		'z' -- convert lev (assumed to be pressure) into log-pressure height coordinates uzing z=H*exp(p/p0) where p0 = 1000 hPa and H=7km  
 		'TPbased': in this case, compute the height of each gridbox relative to the local tropopause and 
 			plot everything on a "tropopause-based" grid, i.e. zt = z-ztrop-ztropmean 
+
+	This is compute_diagnostic_lev_time followed by render_diagnostic_lev_time.
+	"""
+
+	P = compute_diagnostic_lev_time(E,Ediff,vertical_coord,scaling_factor,hostname,debug)
+	if P is None:
+		return
+	return render_diagnostic_lev_time(P,E,Ediff,vertical_coord,L,clim,cbar,colorbar_label,reverse_colors,cmap_type,debug)
+
+def compute_diagnostic_lev_time(E=dart.basic_experiment_dict(),Ediff=None,vertical_coord='log_levels',scaling_factor=1.0,hostname='taurus',debug=False):
+
+	"""
+	load the data for plot_diagnostic_lev_time, average over latitude and longitude, and return 
+	a dictionary holding the level x time array ('data'), the vertical coordinate ('y') and its 
+	label ('ylabel'), and the dates ('x'). 
+	Returns None if the requested variable is two dimensional. 
 	"""
 
 	# throw an error if the desired variable is 2 dimensional 
@@ -431,17 +500,13 @@ def plot_diagnostic_lev_time(E=dart.basic_experiment_dict(),Ediff=None,vertical_
 
 	# convert to TP-based coordinates if requested 	
 	if vertical_coord=='TPbased': 
-		Vmain,lev=to_TPbased(E,D,hostname=hostname,debug=debug)
-		D['data']=Vmain
-		D['lev']=lev
+		D = to_TPbased(E,D,hostname=hostname,debug=debug)
 
 	if Ediff is not None:
 		D2 = DART_diagn_to_array(Ediff,hostname=hostname,debug=debug)
 		# convert to TP-based coordinates if requested 	
 		if vertical_coord=='TPbased': 
-			Vdiff,lev=to_TPbased(E,D2,hostname=hostname,debug=debug)
-			D2['data']=Vmain
-			D2['lev']=lev
+			D2 = to_TPbased(E,D2,hostname=hostname,debug=debug)
 		# subtract the main datarray 
 		Vmatrix=D['data']-D2['data']
 	else:
@@ -463,8 +528,36 @@ def plot_diagnostic_lev_time(E=dart.basic_experiment_dict(),Ediff=None,vertical_
 	else:
 		V1 = V0
 
+	# compute vertical coordinate depending on choice of pressure or altitude 
+	if 'levels' in vertical_coord:
+		y=D['lev']
+		ylabel = 'Level (hPa)'
+	if vertical_coord=='z':
+		H=7.0
+		p0=1000.0 
+		y = H*np.log(p0/D['lev'])
+		ylabel = 'log-p height (km)'
+	if vertical_coord=='TPbased':
+		y=D['lev']
+		ylabel='z (TP-based) (km)'
+
 	# squeeze out any remaining length-1 dimensions and scale 
-	M = scaling_factor*np.squeeze(V1)
+	P = dict()
+	P['data'] = scaling_factor*np.squeeze(V1)
+	P['x'] = D['daterange']
+	P['y'] = y
+	P['ylabel'] = ylabel
+	return P
+
+def render_diagnostic_lev_time(P,E,Ediff=None,vertical_coord='log_levels',L=None,clim=None,cbar='vertical',colorbar_label=None,reverse_colors=False,cmap_type='sequential',debug=False):
+
+	"""
+	draw the output of compute_diagnostic_lev_time into the current axes -- see plot_diagnostic_lev_time for the inputs.
+	"""
+	M = P['data']
+	x = P['x']
+	y = P['y']
+	ylabel = P['ylabel']
 
         # choose color map 
 	cc = nice_colormaps(cmap_type,reverse_colors)
@@ -486,22 +579,8 @@ def plot_diagnostic_lev_time(E=dart.basic_experiment_dict(),Ediff=None,vertical_
 			L  = np.linspace(start=-clim0,stop=clim0,num=ncolors)
 		else:
 			L  = np.linspace(start=clim1,stop=clim2,num=ncolors)
-
-	# compute vertical coordinate depending on choice of pressure or altitude 
-	if 'levels' in vertical_coord:
-		y=D['lev']
-		ylabel = 'Level (hPa)'
-	if vertical_coord=='z':
-		H=7.0
-		p0=1000.0 
-		y = H*np.log(p0/D['lev'])
-		ylabel = 'log-p height (km)'
-	if vertical_coord=='TPbased':
-		#from matplotlib import rcParams
-		#rcParams['text.usetex'] = True
-		y=lev
-		ylabel='z (TP-based) (km)'
-	x = D['daterange']
+	else:
+		clim0 = np.max(np.absolute(L))
 
         # contour data 
 	if debug:
@@ -510,15 +589,9 @@ def plot_diagnostic_lev_time(E=dart.basic_experiment_dict(),Ediff=None,vertical_
 	cs = plt.contourf(x,y,M,L,cmap=cmap,extend="both")
 
 	# fix the date exis
-	if len(x)>30:
-		fmt = mdates.DateFormatter('%b-%d')
-		plt.gca().xaxis.set_major_locator(mdates.AutoDateLocator())
-		plt.gca().xaxis.set_major_formatter(fmt)
-	else:
-		fmt = mdates.DateFormatter('%b-%d')
-		plt.gca().xaxis.set_major_locator(mdates.AutoDateLocator())
-		plt.gca().xaxis.set_major_formatter(fmt)
-	#plt.xticks(rotation=45)
+	fmt = mdates.DateFormatter('%b-%d')
+	plt.gca().xaxis.set_major_locator(mdates.AutoDateLocator())
+	plt.gca().xaxis.set_major_formatter(fmt)
 
 	# add a colorbar if desired 
 	if cbar is not None:
@@ -553,82 +626,53 @@ def plot_diagnostic_lev_time(E=dart.basic_experiment_dict(),Ediff=None,vertical_
 
 def plot_diagnostic_lat_time(E=dart.basic_experiment_dict(),Ediff=None,daterange = dart.daterange(date_start=datetime.datetime(2009,1,1), periods=81, DT='1D'),clim=None,hostname='taurus',cbar=True,debug=False):
 
-	# loop over the input date range
-	for date, ii in zip(daterange,np.arange(0,len(daterange))):  
-
-
-		# load the data over the desired latitude and longitude range  
-		if (E['diagn'].lower() == 'covariance') or (E['diagn'].lower() == 'correlation') :
-			if ii == 0:
-				lev,lat,lon,Cov,Corr = dart.load_covariance_file(E,date,hostname,debug=debug)
-				nlat = len(lat)
-				refshape = Cov.shape
-			else:
-				dum1,dum2,dum3,Cov,Corr = dart.load_covariance_file(E,date,hostname,debug=debug)
-
-
-			if E['diagn'].lower() == 'covariance':
-				VV = Cov
-			if E['diagn'].lower() == 'correlation':
-				VV = Corr
-		else:
-			if ii == 0:
-				lev,lat,lon,VV,P0,hybm,hyam = dart.load_DART_diagnostic_file(E,date,hostname=hostname,debug=debug)
-				nlat = len(lat)
-				refshape = VV.shape
-			else:
-				dum1,dum2,dum3,VV,P0,hybm,hyam = dart.load_DART_diagnostic_file(E,date,hostname=hostname,debug=debug)
-
-		# if the file was not found, VV will be undefined, so put in empties
-		if VV is None:
-			VV = np.empty(shape=refshape)
-
-		# average over latitude and (for 3d variables) vertical levels 
-		if (E['variable']=='PS'):
-			Mlonlev = np.mean(VV,axis=1)
-		else:
-			Mlon = np.mean(VV,axis=1)
-			Mlonlev = np.mean(Mlon,axis=1)
-		
+	"""
+	plot a given state-space diagnostic as a function of latitude and time, averaging over longitude 
+	and (for 3d variables) vertical levels. 
+	This is compute_diagnostic_lat_time followed by render_diagnostic_lat_time.
+	"""
 
-		M1 = Mlonlev
+	P = compute_diagnostic_lat_time(E,Ediff,daterange,hostname,debug)
+	if P is None:
+		return None,None
+	return render_diagnostic_lat_time(P,E,Ediff,clim,cbar,debug)
 
+def compute_diagnostic_lat_time(E=dart.basic_experiment_dict(),Ediff=None,daterange=None,hostname='taurus',debug=False):
 
-		# repeat for the difference experiment
-		if (Ediff != None):
-			lev2,lat2,lon2,VV,P0,hybm,hyam = dart.load_DART_diagnostic_file(Ediff,date,hostname=hostname,debug=debug)
-			if (E['variable']=='PS'):
-				M2lonlev = np.mean(VV,axis=1)
-			else:
-				M2lon = np.mean(VV,axis=1)
-				M2lonlev = np.mean(M2lon,axis=1)
-			M2 = M2lonlev
-			M = M1-M2
-		else:
-			M = M1
+	"""
+	load the data for plot_diagnostic_lat_time over the dates in daterange (default: E['daterange']), 
+	averaged over longitude and vertical levels as they are read in. 
+	Returns a dictionary holding the latitude x time array ('data'), 'lat', and the dates that 
+	were found ('time'), or None if nothing was found. 
+	"""
+	M,D = reduced_diagnostic_difference(E,Ediff,daterange,['zonal_mean','lev_mean'],hostname,debug)
+	if M is None:
+		return None
 
+	P = dict()
+	P['data'] = M
+	P['lat'] = D['lat']
+	P['time'] = D['daterange']
+	return P
 
-		# append the resulting vector to the larger array (or initialize it)
-		if (ii==0) :
-			MM = np.zeros(shape=(nlat, len(daterange)), dtype=float)
-			names=[]
-		MM[:,ii] = M
+def render_diagnostic_lat_time(P,E,Ediff=None,clim=None,cbar=True,debug=False):
 
-	# make a grid of levels and days
-	t = daterange
+	"""
+	draw the output of compute_diagnostic_lat_time into the current axes -- see plot_diagnostic_lat_time for the inputs.
+	"""
+	MM = P['data']
+	lat = P['lat']
+	t = P['time']
 
         # choose color map based on the variable in question
 	colors,cmap,cmap_type = state_space_HCL_colormap(E,Ediff)
 
-
         # contour data over the map.
 	cs = plt.contourf(t,lat,MM,len(colors)-1,cmap=cmap,extend="both")
-	plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%m-%d'))
-	plt.gca().xaxis.set_major_locator(mdates.AutoDateLocator())
 	plt.axis('tight')
+	if clim is None:
+		clim = np.nanmax(np.absolute(MM))
 	if cmap_type == 'divergent':
-		if clim is None:
-			clim = np.nanmax(np.absolute(MM))
 		plt.clim([-clim,clim])
 	if debug:
 		print(cs.get_clim())
@@ -643,18 +687,44 @@ def plot_diagnostic_lat_time(E=dart.basic_experiment_dict(),Ediff=None,daterange
 	plt.ylabel('Latitude')
 
 	# fix the date exis
-	if len(t)>30:
-		fmt = mdates.DateFormatter('%b-%d')
-		plt.gca().xaxis.set_major_locator(mdates.AutoDateLocator())
-		plt.gca().xaxis.set_major_formatter(fmt)
-	else:
-		fmt = mdates.DateFormatter('%b-%d')
-		plt.gca().xaxis.set_major_locator(mdates.AutoDateLocator())
-		plt.gca().xaxis.set_major_formatter(fmt)
+	fmt = mdates.DateFormatter('%b-%d')
+	plt.gca().xaxis.set_major_locator(mdates.AutoDateLocator())
+	plt.gca().xaxis.set_major_formatter(fmt)
 
 	return cs,CB
 
-def retrieve_state_space_ensemble(E,averaging=True,ensemble_members='all',scaling_factor=1.0,hostname='taurus',debug=False):
+def reduced_diagnostic_difference(E,Ediff=None,daterange=None,reduce=['area_mean'],hostname='taurus',debug=False):
+
+	"""
+	load the diagnostic in E (minus the one in Ediff, if given) over the dates in daterange 
+	(default: E['daterange']) with DART_diagn_to_array, applying the list of reductions `reduce` 
+	as the dates are read in, and squeeze out the copy dimension. 
+	Covariances and correlations are loaded from the covariance files. 
+	Returns the array (dimensions x time) and the output dictionary for E, or None,None if nothing was found. 
+	"""
+	Mlist = []
+	Dlist = []
+	for EE in [E,Ediff]:
+		if EE is None:
+			continue
+		EE = EE.copy()
+		if daterange is not None:
+			EE['daterange'] = daterange
+		if EE['diagn'].lower() in ['covariance','correlation']:
+			EE['file_type'] = 'COVAR'
+		D = DART_diagn_to_array(EE,hostname=hostname,debug=debug,reduce=reduce)
+		if type(D) is not dict:
+			return None,None
+		Mlist.append(np.ma.squeeze(D['data']))
+		Dlist.append(D)
+
+	if len(Mlist) > 1:
+		M = Mlist[0]-Mlist[1]
+	else:
+		M = Mlist[0]
+	return M,Dlist[0]
+
+def retrieve_state_space_ensemble(E,averaging=True,ensemble_members='all',scaling_factor=1.0,single_pass=True,hostname='taurus',debug=False):
 
 	"""
 	retrieve the prior or posterior ensemble averaged over some region of the state,
@@ -665,6 +735,9 @@ def retrieve_state_space_ensemble(E,averaging=True,ensemble_members='all',scalin
 	averaging: set to True to average over the input latitude, longitude, and level ranges (default=True).
 	ensemble_members: set to "all" to request entire ensemble, or specify a list with the numbers of the ensemble members you want to plot  
 	scaling_factor: factor by which to multiply the array to be plotted 
+	single_pass: if True (the default) and we are loading regular DART diagnostic files, all the requested 
+		ensemble members are read from each file in one go, and averaged right away. 
+		Set to False to load the ensemble members one by one with DART_diagn_to_array. 
 	hostname
 	debug
 	"""
@@ -679,6 +752,56 @@ def retrieve_state_space_ensemble(E,averaging=True,ensemble_members='all',scalin
 		N = es.get_ensemble_size_per_run(E['exp_name'])
 		ens_list = np.arange(1,N+1)
 
+	# for regular DART diagnostic files, read all the members for each date at once 
+	if 'file_type' in E:
+		FT = E['file_type']
+	else:
+		FT = 'DART'
+	if single_pass and (FT == 'DART'):
+		Eens = E.copy()
+		Eens['copystring'] = []
+		for iens in ens_list:
+			if iens < 10:
+				spacing = '      '
+			else:
+				spacing = '     '
+			Eens['copystring'].append("ensemble member"+spacing+str(iens))
+
+		VElist = []
+		new_daterange = []
+		for date in daterange:
+			try:
+				DD = dart.load_DART_diagnostic_file(Eens,date,hostname=hostname,debug=debug)
+			except RuntimeError:
+				error_msg_DART_diagn_to_array(FT,Eens)
+				continue
+
+			# the data come out shaped member x lat x lon (x lev) -- 
+			# if averaging, average each member over latitude, longitude, and level in that order 
+			V = DD['data']
+			if averaging:
+				while V.ndim > 1:
+					V = np.nanmean(V,axis=1)
+			VElist.append(scaling_factor*V)
+			new_daterange.append(date)
+
+		if len(VElist) == 0:
+			d1 = daterange[0].strftime("%Y-%m-%d")
+			d2 = daterange[len(daterange)-1].strftime("%Y-%m-%d")
+			print('Could not find any data for experiment '+E['exp_name']+' and variable '+E['variable']+' between dates '+d1+' and '+d2)
+			return None
+
+		# stack up the dates along the last dimension, so that we get member x time 
+		# (or member x 1 x lat x lon x lev x time without averaging -- the same shape as the member-by-member loop below)
+		VE = np.concatenate([V[...,np.newaxis] for V in VElist],axis=VElist[0].ndim)
+		if not averaging:
+			VE = VE[:,np.newaxis,...]
+			if 'FillValue' in DD:
+				VE = np.ma.masked_values(VE,DD['FillValue'])
+		DD['data'] = VE
+		DD['daterange'] = new_daterange
+		return DD
+
 	# loop over the ensemble members and timeseries for each ensemble member, and add to a list
 	Eens = E.copy()
 	VElist = []
@@ -746,70 +869,53 @@ def plot_diagnostic_global_ave(E,Ediff=None,label_for_legend=True,color="#000000
 		to appear when you do plt.legend(). The default is True; set this to False to ignore certain profiles 
 		(e.g. individual ensemble members) in the legend. 
 
+	This is compute_diagnostic_global_ave followed by render_diagnostic_global_ave.
 	"""
 
-	# set up empty dicts to hold the timeseries and x-axes to plot  
-	MM=dict()
-	X=dict()
+	P = compute_diagnostic_global_ave(E,Ediff,x_as_days,hostname,debug)
+	return render_diagnostic_global_ave(P,E,Ediff,label_for_legend,color,linestyle,marker,linewidth,alpha,x_as_days,debug)
 
-	# calculate the number of days from start, if requested  
-	# to do: convert list to array, or change the plotting part of this routine 
-	if x_as_days:
-		x = [dd -E['daterange'][0] for dd in E['daterange']]
-	else:
-		x = E['daterange']
+def compute_diagnostic_global_ave(E,Ediff=None,x_as_days=False,hostname='taurus',debug=False):
 
-	# load the data over the desired latitude and longitude range  
-	DD = DART_diagn_to_array(E,hostname=hostname,debug=debug)
+	"""
+	load the data for plot_diagnostic_global_ave, taking the area-weighted average over latitude and 
+	longitude and the average over vertical levels as each date is read. 
+	Returns the output dictionary of DART_diagn_to_array, with the time series under 'data' (NaN if 
+	nothing was found) and the x-axis (dates, or days since the start if x_as_days is True) under 'x'. 
+	"""
 
-	# load the difference array if desired  
-	if Ediff is not None:
-		DDdiff = DART_diagn_to_array(Ediff,hostname=hostname,debug=debug)
-		Vmatrix = DD['data']-DDdiff['data']
+	M,DD = reduced_diagnostic_difference(E,Ediff,None,['area_mean','lev_mean'],hostname,debug)
+	if M is None:
+		# if no file was found, just make the global average a NAN
+		DD = dict()
+		DD['daterange'] = E['daterange']
+		M = np.NAN
+
+	# calculate the number of days from start, if requested  
+	if x_as_days:
+		x = [dd -DD['daterange'][0] for dd in DD['daterange']]
 	else:
-		Vmatrix = DD['data']
-
-	# compute global average only if the file was found
-	if Vmatrix is not None:
-
-		if 'lat' not in DD: 
-			DD['lat']=None
-		if 'lon' not in DD: 
-			DD['lon']=None
-		if 'lev' not in DD: 
-			DD['lev']=None
-
-		# average over latitude, longitude, and vertical level 
-		if DD['lat'] is not None:
-			Vlat = average_over_named_dimension(Vmatrix,DD['lat'])
-		else:	
-			Vlat=Vmatrix
-		if DD['lon'] is not None:
-			Vlatlon = average_over_named_dimension(Vlat,DD['lon'])
-		else:
-			Vlatlon=Vlat
-		if DD['lev'] is not None:
-			Vlatlonlev = average_over_named_dimension(Vlatlon,DD['lev'])
-		else:
-			Vlatlonlev=Vlatlon
+		x = DD['daterange']
 
-		# squeeze out any remaining length-1 dimensions  
-		M = np.squeeze(Vlatlonlev)
+	DD['data']=M
+	DD['x']=x
+	return DD
 
-	else:
-		# if no file was found, just make the global average a NAN
-		M = np.NAN
+def render_diagnostic_global_ave(P,E,Ediff=None,label_for_legend=True,color="#000000",linestyle='-',marker=None,linewidth=1.0,alpha=1.0,x_as_days=False,debug=False):
 
-	#------plotting----------
+	"""
+	draw the output of compute_diagnostic_global_ave into the current axes -- see plot_diagnostic_global_ave for the inputs.
+	"""
+	x = P['x']
+	y = P['data']
 
-	y = M
 	if E['copystring']=='ensemble' or E['copystring']=='ensemble sample':
 		nC = y.shape[0]
-		if type(color) is 'list':
-			color2 = color[iC]
-		else:
-			color2=color 
 		for iC in range(nC):
+			if type(color) is list:
+				color2 = color[iC]
+			else:
+				color2=color 
 			try:
 				plt.plot(x,y[iC,:],color=color2,linestyle=linestyle,linewidth=linewidth,label=E['title'],alpha=alpha,marker=marker)
 			except ValueError:
@@ -822,7 +928,7 @@ def plot_diagnostic_global_ave(E,Ediff=None,label_for_legend=True,color="#000000
 		except ValueError:
 			print("There's a problem plotting the time and global average array. Here are their shapes:")
 			print(len(x))
-			print(y.shape)
+			print(np.shape(y))
 
 
 	# format the y-axis labels to be exponential if the limits are quite high
@@ -830,22 +936,16 @@ def plot_diagnostic_global_ave(E,Ediff=None,label_for_legend=True,color="#000000
 	if (np.max(ylim) > 1000):
 		ax = plt.gca()
 		ax.ticklabel_format(axis='y', style='sci', scilimits=(-2,2))
-	plt.ylabel(DD['long_name']+' ('+DD['units']+')')
+	if ('long_name' in P) and ('units' in P):
+		plt.ylabel(P['long_name']+' ('+P['units']+')')
 
 	if not x_as_days:
 		# format the x-axis labels to be dates
-		#if len(x) > 30:
 		plt.gca().xaxis.set_major_locator(mdates.AutoDateLocator())
-		#if len(x) < 10:
-		#	plt.gca().xaxis.set_major_locator(mdates.DayLocator(bymonthday=range(len(E['daterange']))))
 		fmt = mdates.DateFormatter('%b-%d')
 		plt.gca().xaxis.set_major_formatter(fmt)
 
-	# prepare output  
-	DD['data']=M
-	DD['x']=x
-
-	return DD
+	return P
 
 
 
@@ -937,7 +1037,7 @@ def state_space_HCL_colormap(E,Ediff=None,reverse=False,ncol=19,debug=False):
 
 
 
-def compute_rank_hist(E=dart.basic_experiment_dict(),daterange=dart.daterange(datetime.datetime(2009,1,1),10,'1D'),space_or_time='both',hostname='taurus'):
+def compute_rank_hist(E=dart.basic_experiment_dict(),daterange=dart.daterange(datetime.datetime(2009,1,1),10,'1D'),space_or_time='both',regions=None,hostname='taurus'):
 
 	# given some experiment E, isolate the ensemble at the desired location  
 	# (given by E's entried latrange, lonrange, and levrange), retrieve 
@@ -946,8 +1046,12 @@ def compute_rank_hist(E=dart.basic_experiment_dict(),daterange=dart.daterange(da
 	# 
 	# the paramter space_or_time determines whether we count our samples over a blog of time, or in space 
 	# if the choice is 'space', the time where we count is the first date of the daterange
+	#
+	# the histogram is collected one date at a time, so only one date of the ensemble is ever in memory. 
+	# regions is an optional integer array that assigns the grid points to regions -- in that case 
+	# a histogram is returned for each region (see DART.rank_hist_accumulator). 
 	if (space_or_time == 'space'):
-		dates = daterange[0]
+		dates = [daterange[0]]
 		averaging = False
 
 	if (space_or_time == 'time'):
@@ -958,14 +1062,40 @@ def compute_rank_hist(E=dart.basic_experiment_dict(),daterange=dart.daterange(da
 		averaging = False
 		dates = daterange
 
+	# experiment dictionaries for the ensemble and the truth 
+	Eens = E.copy()
+	Eens['copystring'] = 'ensemble'
+	ET = E.copy()
+	ET['diagn'] = 'Truth'
+	ET['copystring'] = 'true state'
+
+	# loop over dates, retrieve the ensemble and the truth, and add them to the rank histogram
+	RH = None
+	for date in dates:
+		try:
+			VE = dart.load_DART_diagnostic_file(Eens,date,hostname=hostname)['data']
+			VT = dart.load_DART_diagnostic_file(ET,date,hostname=hostname)['data']
+		except RuntimeError:
+			error_msg_DART_diagn_to_array('DART',E)
+			continue
 
-	# loop over dates and retrieve the ensemble
-	VE,VT,lev,lat,lon = retrieve_state_space_ensemble(E,dates,averaging,hostname)
+		# when counting over time only, average over the region first 
+		if averaging:
+			VE = np.reshape(VE,(VE.shape[0],-1)).mean(axis=1)
+			VT = np.mean(VT)
 
-	# from this compute the rank historgram
-	bins,hist = dart.rank_hist(VE,VT[0,:])
+		if RH is None:
+			RH = dart.rank_hist_accumulator(VE.shape[0],regions)
+		dart.rank_hist_update(RH,VE,np.reshape(VT,VE.shape[1:]))
 
-	return bins,hist,dates
+	if RH is None:
+		return None,None,dates
+	if regions is None:
+		hist = RH['hist'][0].tolist()
+	else:
+		hist = RH['hist']
+
+	return RH['bins'],hist,dates
 
 
 def plot_rank_hist(E=dart.basic_experiment_dict(),daterange=dart.daterange(datetime.datetime(2009,1,1),81,'1D'),space_or_time='space',hostname='taurus'):
@@ -981,70 +1111,111 @@ def plot_rank_hist(E=dart.basic_experiment_dict(),daterange=dart.daterange(datet
 
 	return bins,hist,dates
 
-def compute_state_to_obs_covariance_field(E=dart.basic_experiment_dict(),date=datetime.datetime(2009,1,1),obs_name='ERP_LOD',hostname='taurus'):
+def compute_state_to_obs_covariance_field(E=dart.basic_experiment_dict(),date=datetime.datetime(2009,1,1),obs_name='ERP_LOD',hostname='taurus',chunk_size=None):
 
 	# Given a DART experiment, load the desired state-space diagnostic file and corresponding obs_epoch_XXX.nc file,
 	# and then compute the field of covariances between every point in the field defined by latrange, lonrange, and levrange
 	# (these are entries in the experiment dictionary, E), and the scalar observation.
+	# 
+	# The covariance and correlation come out shaped lat x lon (x lev) x 1 -- or, if obs_name is a list of obs types 
+	# (or there are several obs of the given type), lat x lon (x lev) x nobs, in the order given by 
+	# compute_state_to_obs_covariances 
+
+	CD = compute_state_to_obs_covariances(E,date,obs_name,hostname,chunk_size)
+	if CD is None:
+		return None,None,None,None,None
 
-	# first load the entire ensemble for the desired variable field
-	#lev,lat,lon,VV = dart.load_DART_diagnostic_file(E,date,hostname)
-	VV,VT,lev,lat,lon = retrieve_state_space_ensemble(E,date,False,hostname)
+	return CD['Covariance'],CD['Correlation'],CD['lev'],CD['lat'],CD['lon']
 
-	# now load the obs epoch file corresponding to this date
-	obs,copynames = dart.load_DART_obs_epoch_file(E,date,[obs_name],['ensemble member'],hostname)
+def compute_state_to_obs_covariances(E=dart.basic_experiment_dict(),date=datetime.datetime(2009,1,1),obs_name='ERP_LOD',hostname='taurus',chunk_size=None,debug=False):
 
-	# compute the ensemble mean value for each point in the variable field
-	VM = np.mean(VV,0)
+	"""
+	Given a DART experiment, load the ensemble of the state variable E['variable'] and the prior ensemble 
+	estimates of the observations of one or more types (obs_name can be a string or a list), and compute the 
+	covariance and correlation between every point in the field defined by latrange, lonrange, and levrange
+	and each of the observations, all at once (see DART.ensemble_covariance). 
+
+	chunk_size: if given, the grid points are processed this many at a time (see DART.ensemble_covariance) 
+
+	Returns a dictionary holding:
+	'Covariance', 'Correlation': arrays shaped lat x lon (x lev) x nobs  
+	'obs_name': the type of each of the nobs observations  
+	'ObsIndex': the index of each observation in the obs_epoch file  
+	'lat', 'lon', 'lev' 
+	"""
 
-	# compute the mean and standard deviation of the obs predicted by the ensemble
-	obsM = np.mean(obs)
-	eobs = obs-obsM
-	sobs = np.std(obs)
-	
+	if type(obs_name) is not list:
+		obs_name = [obs_name]
+
+	# first load the entire ensemble for the desired variable field on this date  
+	Eens = E.copy()
+	Eens['copystring'] = 'ensemble'
+	try:
+		DD = dart.load_DART_diagnostic_file(Eens,date,hostname=hostname,debug=debug)
+	except RuntimeError:
+		error_msg_DART_diagn_to_array('DART',E)
+		return None
+	VV = DD['data']
+	N = VV.shape[0]
+
+	# now load the prior ensemble estimates of the obs from the obs epoch file for this date -- 
+	# the dataframe is ordered observation by observation, with the ensemble members varying fastest  
+	Eobs = E.copy()
+	Eobs['diagn'] = 'Prior'
+	DF = dart.load_DART_obs_epoch_file_as_dataframe(Eobs,date,obs_name,['ensemble member'],hostname=hostname,debug=debug)
+	if (DF is None) or (len(DF) == 0):
+		print('compute_state_to_obs_covariances: cannot find any obs of type '+', '.join(obs_name)+' on '+date.strftime('%Y-%m-%d'))
+		return None
+	nc = len(DF['CopyName'].cat.categories)
+	if nc != N:
+		raise RuntimeError('compute_state_to_obs_covariances: the obs_epoch file has '+str(nc)+' ensemble members, but the state has '+str(N))
+	Y = np.reshape(DF['Value'].values,(-1,N)).T
+
+	# covariances and correlations with all the obs at once 
+	C,R = dart.ensemble_covariance(VV,Y,axis=0,chunk_size=chunk_size)
+
+	CD = dict()
+	CD['Covariance'] = C
+	CD['Correlation'] = R
+	CD['obs_name'] = list(DF['ObsType'].values[::N])
+	CD['ObsIndex'] = DF.index.values[::N]
+	CD['lat'] = DD['lat']
+	CD['lon'] = DD['lon']
+	CD['lev'] = DD['lev']
+
+	return CD
 
-	# 3D variables: loop over lev, lat, lon and compute the covariance with the observation
-	if len(VV.shape) == 5:
-		[N,nlev,nlat,nlon,nt] = VV.shape
-		C = np.zeros(shape=(nlat,nlon,nlev,nt))
-		R = C.copy()
-		for ilev in range(nlev):
-			for ilat in range(nlat):
-				for ilon in range(nlon):
-					Ctemp = np.zeros(shape = (1,N))
-					for ii in range(N):
-						dx = VV[ii,ilev,ilat,ilon,:]-VM[ilev,ilat,ilon,:]
-						Ctemp[0,ii] = dx*eobs[0,ii]
-					C[ilat,ilon,ilev,:] = np.mean(Ctemp)/(float(N)-1.)
-					sx = np.std(VV[:,ilev,ilat,ilon,0])
-					R[ilat,ilon,ilev,:] = C[ilat,ilon,ilev,:]/(sx*sobs)
-						
-
-	# 2D variables: loop over  lat and lon and compute the covariance with the observation
-	if len(VV.shape) == 4:
-		lev = np.nan
-		[N,nlat,nlon,nt] = VV.shape
-		C = np.zeros(shape=(nlat,nlon,nt))
-		R = C.copy()
-		for ilat in range(nlat):
-			for ilon in range(nlon):
-				c = 0
-				for ii in range(N):
-					dx = VV[ii,ilat,ilon,:]-VM[ilat,ilon,:]
-					C[ilat,ilon,:] += (1/(N-1))*dx*eobs[0,ii]
-				sx = np.std(VV[:,ilat,ilon,:])
-				R[ilat,ilon,:] = C[ilat,ilon,:]/(sx*sobs)
-
-	return C,R,lev,lat,lon
-
-
-def make_state_to_obs_covariance_file(E,date=datetime.datetime(2009,1,1,0,0,0),obs_name='ERP_LOD',hostname='taurus'):
+def make_state_to_obs_covariance_file(E,date=datetime.datetime(2009,1,1,0,0,0),obs_name='ERP_LOD',hostname='taurus',chunk_size=None):
 
 	# run through a set of DART runs and dates and compute the covariances between the state variables  
 	# and a given observation, then save it as a netcdf file  
+	# obs_name can also be a list of observation types -- then the covariances with all of them 
+	# are computed at once, and one file is written for each. 
 
 	# Compute the covariance and correlation fields
-	C, R, lev0,lat0,lon0 = compute_state_to_obs_covariance_field(E,date,obs_name,hostname)
+	CD = compute_state_to_obs_covariances(E,date,obs_name,hostname,chunk_size)
+	if CD is None:
+		return
+	lev0 = CD['lev']
+	lat0 = CD['lat']
+	lon0 = CD['lon']
+
+	if type(obs_name) is not list:
+		obs_name = [obs_name]
+	for obs in obs_name:
+		iobs = [ii for ii,OT in enumerate(CD['obs_name']) if OT == obs]
+		if len(iobs) == 0:
+			continue
+		if len(iobs) > 1:
+			print('There are '+str(len(iobs))+' observations of type '+obs+' on this date -- writing only the first one to file')
+		C = CD['Covariance'][...,iobs[0]:iobs[0]+1]
+		R = CD['Correlation'][...,iobs[0]:iobs[0]+1]
+		write_state_to_obs_covariance_file(E,date,obs,C,R,lev0,lat0,lon0)
+
+def write_state_to_obs_covariance_file(E,date,obs_name,C,R,lev0,lat0,lon0):
+
+	# save covariance and correlation fields (lat x lon (x lev) x 1) between the state variable E['variable'] 
+	# and the observation obs_name on a given date as a netcdf file  
 
 	# compute the gregorian day number for this date
 	# note: we can also go higher res and return the 12-hourly analysis times, but that requires changing several other routines
@@ -1095,34 +1266,188 @@ def make_state_to_obs_covariance_file(E,date=datetime.datetime(2009,1,1,0,0,0),o
 	ff.close()
 	print('Created file '+fname)
 	
+def make_state_to_obs_covariance_series(E,daterange,obs_names=['ERP_LOD'],variables=['U','V','T','PS'],hostname='taurus',nprocs=1,chunk_size=None,output_dir=None,debug=False):
+
+	"""
+	compute the covariances and correlations between a list of state variables and a list of 
+	observation types for a range of dates, and collect them all in one netcdf file per experiment 
+	(named like the 'covariance_series' files in experiment_settings.find_paths), which 
+	DART.load_covariance_file then reads from.  
+
+	The file has an unlimited time dimension and an obs dimension, and one group per state variable, 
+	which holds that variable's grid and the compressed Covariance and Correlation fields, chunked 
+	so that each date and observation can be read on its own. 
+	If the file already exists, only the dates and variables that aren't in it yet are computed, 
+	so an interrupted run can simply be restarted. 
+
+	INPUTS:
+	E: experiment dictionary 
+	daterange: list of dates to compute 
+	obs_names: list of obs types -- if there are several obs of one type on a given date, the first one is used 
+	variables: list of state variables 
+	nprocs: the number of processes that compute the covariances. Default is 1. 
+	chunk_size: passed on to DART.ensemble_covariance 
+	output_dir: where to write the file -- the default is where find_paths looks for it. 
+	"""
+
+	filename = es.find_paths(E,daterange[0],file_type='covariance_series',hostname=hostname)
+	if output_dir is not None:
+		filename = os.path.join(output_dir,os.path.basename(filename))
+
+	# make sure nobody is reading the file while we write it
+	dart.close_netcdf_files(filename)
+
+	if os.path.exists(filename):
+		ff = Dataset(filename,'a')
+		if list(ff.variables['obs_name'][:]) != list(obs_names):
+			print('make_state_to_obs_covariance_series: '+filename+' already holds the obs '+', '.join(ff.variables['obs_name'][:]))
+			print('use those, or write to a different output_dir')
+			ff.close()
+			return None
+	else:
+		ff = Dataset(filename,'w',format='NETCDF4')
+		ff.createDimension('time',None)
+		ff.createDimension('obs',len(obs_names))
+		times = ff.createVariable('time','f8',('time',))
+		times.units = 'days since 1600-01-01 00:00:00'
+		obs = ff.createVariable('obs_name',str,('obs',))
+		for io,obs_name in enumerate(obs_names):
+			obs[io] = obs_name
+		ff.description = 'Covariance and Correlation between state variables and observations in experiment '+E['exp_name']
+		ff.history = 'Created ' + datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+		ff.source = 'Python module DART_state_space.py'
+
+	# figure out which dates and variables still need to be done 
+	time_list = list(np.ma.filled(ff.variables['time'][:],np.nan))
+	arglist = []
+	for date in daterange:
+		it = covariance_series_index(time_list,date)
+		for variable in variables:
+			if (it is not None) and (variable in ff.groups):
+				if np.ma.filled(ff.groups[variable].variables['written'][it],0) == 1:
+					continue
+			arglist.append((E,date,variable,obs_names,hostname,chunk_size,debug))
+	if debug:
+		print('make_state_to_obs_covariance_series: computing '+str(len(arglist))+' date and variable combinations')
+
+	if nprocs > 1:
+		import multiprocessing
+		pool = multiprocessing.Pool(processes=nprocs)
+		results = pool.imap(make_state_to_obs_covariance_worker,arglist)
+	else:
+		pool = None
+		results = (make_state_to_obs_covariance_worker(args) for args in arglist)
+
+	# write the results to the file as they come in, so that an interrupted run keeps everything done so far 
+	try:
+		for args,CD in zip(arglist,results):
+			date = args[1]
+			variable = args[2]
+			if CD is None:
+				print('make_state_to_obs_covariance_series: skipping '+variable+' on '+date.strftime('%Y-%m-%d'))
+				continue
+
+			if variable not in ff.groups:
+				create_covariance_series_group(ff,variable,CD)
+			G = ff.groups[variable]
+
+			it = covariance_series_index(time_list,date)
+			if it is None:
+				it = len(time_list)
+				time_list.append(dart.covariance_series_time(date))
+				ff.variables['time'][it] = time_list[it]
+
+			# pick out the obs in the order of the obs dimension 
+			C = np.empty((len(obs_names),)+CD['Covariance'].shape[:-1])
+			R = np.empty((len(obs_names),)+CD['Covariance'].shape[:-1])
+			C[:] = np.nan
+			R[:] = np.nan
+			for io,obs_name in enumerate(obs_names):
+				if obs_name in CD['obs_name']:
+					ii = CD['obs_name'].index(obs_name)
+					C[io,...] = CD['Covariance'][...,ii]
+					R[io,...] = CD['Correlation'][...,ii]
+			C = np.ma.masked_invalid(C)
+			R = np.ma.masked_invalid(R)
+			G.variables['Covariance'][it,...] = C
+			G.variables['Correlation'][it,...] = R
+			G.variables['written'][it] = 1
+			ff.sync()
+	finally:
+		ff.close()
+		if pool is not None:
+			pool.close()
+			pool.join()
+
+	return filename
+
+def make_state_to_obs_covariance_worker(args):
+
+	# compute the covariances for one date and variable -- see make_state_to_obs_covariance_series 
+	E,date,variable,obs_names,hostname,chunk_size,debug = args
+	Ev = E.copy()
+	Ev['variable'] = variable
+	try:
+		CD = compute_state_to_obs_covariances(Ev,date,obs_names,hostname,chunk_size,debug)
+	except RuntimeError as err:
+		print(err)
+		CD = None
+	return CD
+
+def covariance_series_index(time_list,date):
+
+	# return the index of a date in the time axis of a covariance file, or None if it isn't there 
+	t = dart.covariance_series_time(date)
+	for it,t0 in enumerate(time_list):
+		if abs(t0-t) < 1E-3:
+			return it
+	return None
+
+def create_covariance_series_group(ff,variable,CD):
+
+	# add a group to a covariance file that holds the grid and covariance fields for a state variable 
+	G = ff.createGroup(variable)
+	G.createDimension('lat',len(CD['lat']))
+	G.createDimension('lon',len(CD['lon']))
+	G.createVariable('lat','f4',('lat',))[:] = CD['lat']
+	G.createVariable('lon','f4',('lon',))[:] = CD['lon']
+	G.variables['lat'].units = 'degrees north'
+	G.variables['lon'].units = 'degrees east'
+	if CD['Covariance'].ndim == 4:
+		G.createDimension('lev',len(CD['lev']))
+		G.createVariable('lev','f4',('lev',))[:] = CD['lev']
+		G.variables['lev'].units = 'hPa'
+		dims = ('time','obs','lat','lon','lev')
+		chunks = (1,1,len(CD['lat']),len(CD['lon']),len(CD['lev']))
+	else:
+		dims = ('time','obs','lat','lon')
+		chunks = (1,1,len(CD['lat']),len(CD['lon']))
+	for name in ['Covariance','Correlation']:
+		G.createVariable(name,'f8',dims,zlib=True,complevel=4,shuffle=True,chunksizes=chunks,fill_value=np.nan)
+	G.createVariable('written','i1',('time',),fill_value=0)
+
 def compute_aefs_as_csv(E = dart.basic_experiment_dict(),date=datetime.datetime(2009,1,1),hostname='taurus',debug=False):
 
 	# given a DART experiment, compute the three AEF excitation functions, and save as a csvfile  
+	# (make_aef_series does the same for a whole range of dates, and collects them in one file) 
 
 	# list of excitation functions to compute
 	AEFlist = ['X1','X2','X3']
 
-	# list of the 3 variables which contribute to AAM excitation
-	variable_list = ['US','VS','PS']
-
 	# figure out which copy strings are in the state space vector
 	copystring_list = es.get_expt_CopyMetaData_state_space(E)
 
-	# initialize lists for the three AEFs
+	# compute all the AEFs for all copies at once 
+	print('+++computing AEFs for experiment '+E['exp_name']+'------')
+	AD = aefs_from_model_fields(E,date,copystring_list,ERP=AEFlist,integral_type='mass',hostname=hostname,debug=debug)
+
+	# the AEF for each component and copy is the sum over the U, V, and PS terms 
 	X = []
 	aef_name_list = []
 	copystring_list_long = []
-
-	# loop over the AEFs and compute each one  
-	for AEF in AEFlist:
-
-		# cycle over all the copies that are available in the state space vector
-		for copystring in copystring_list:
-			print('+++computing AEF '+AEF+' for '+copystring+' for experiment '+E['exp_name']+'------')
-
-			E['copystring'] = copystring
-			dum,Xtemp = aef_from_model_field(E,date,variables=variable_list,ERP=AEF,levels_mistake=False,integral_type='mass',hostname=hostname)
-			X.append(sum(Xtemp))  
+	for iaef,AEF in enumerate(AEFlist):
+		for icopy,copystring in enumerate(copystring_list):
+			X.append(np.sum(AD['AEF'][icopy,iaef,:]))
 			aef_name_list.append(AEF)
 			copystring_list_long.append(copystring)
 
@@ -1147,7 +1472,238 @@ def compute_aefs_as_csv(E = dart.basic_experiment_dict(),date=datetime.datetime(
 	DF.to_csv(file_out_name, sep='\t')
 	print('Created file '+file_out_name)
 
+def aefs_from_model_fields(E,date,copystrings=None,ERP=['X1','X2','X3'],integral_type='mass',hostname='taurus',debug=False):
+
+	"""
+	compute the AAM excitation functions (AEFs) for many copies of the model state (e.g. all ensemble 
+	members) on one date. The U, V, and PS fields of all the copies are each read in one go, and the 
+	integrals are evaluated for all copies at once (see ERP.aef_massintegral_batch and ERP.aef_batch). 
+
+	INPUTS:
+	E: experiment dictionary 
+	date: the date to compute 
+	copystrings: list of copies to compute the AEFs for. The default is every copy in the state space 
+		vector of the experiment (see experiment_settings.get_expt_CopyMetaData_state_space)
+	ERP: list of the excitation function components 
+	integral_type: 'mass' (default) or 'volume' -- see aef_from_model_field 
+
+	Returns a dictionary with the AEF array, shaped copy x component x term, where the terms are the 
+	contributions of U, V, and PS, plus the lists of copystrings, components, and terms that go 
+	with the array. Returns None if the fields can't be found. 
+	"""
+	import ERP as erp
+
+	if copystrings is None:
+		copystrings = es.get_expt_CopyMetaData_state_space(E)
+	terms = ['U','V','PS']
+
+	# load the U, V, and PS fields of all the copies 
+	Ec = E.copy()
+	Ec['copystring'] = list(copystrings)
+	F = dict()
+	for term,variable in zip(terms,['US','VS','PS']):
+		Ec['variable'] = variable
+		try:
+			F[term] = dart.load_DART_diagnostic_file(Ec,date,hostname=hostname,debug=debug)
+		except RuntimeError as err:
+			print(err)
+			return None
+		F[term]['data'] = np.ma.filled(np.ma.asarray(F[term]['data'],dtype=np.float64),np.nan)
+	lev = F['U']['lev']
+
+	AEF = np.zeros(shape=(len(copystrings),len(ERP),len(terms)))
+	if integral_type == 'mass':
+		# the integral needs the 3D pressure field, recreated from hybrid model levels 
+		PS = F['PS']['data']
+		C = hybrid_level_coefficients(E,date,lev,hostname=hostname,debug=debug)
+		P = dart.hybrid_pressure(C['hyam'],C['hybm'],PS,C['P0'],axis=-1)
+		A = erp.aef_massintegral_batch(F['PS']['lat'],F['PS']['lon'],PS,p=np.ma.getdata(P),U=F['U']['data'],V=F['V']['data'],ERP=ERP)
+		for icomp,comp in enumerate(ERP):
+			for iterm,term in enumerate(terms):
+				AEF[:,icomp,iterm] = A[comp][term]
+
+	if integral_type == 'volume':
+		# the volume integral needs the levels in Pascal 
+		lev_Pa = lev*100
+		if np.max(lev_Pa) < 8E4:
+			print('the pressure at the surface is '+str(np.max(lev_Pa))+' which means these levels are probably not in Pascal')
+			return None
+		for iterm,term in enumerate(terms):
+			A = erp.aef_batch(F[term]['data'],lev_Pa,F[term]['lat'],F[term]['lon'],term,ERP=ERP)
+			for icomp,comp in enumerate(ERP):
+				AEF[:,icomp,iterm] = A[comp]
+
+	AD = {'AEF':AEF,
+		'copystring':list(copystrings),
+		'component':list(ERP),
+		'term':terms}
+	return AD
+
+def make_aef_series(E,daterange,copystrings=None,ERP=['X1','X2','X3'],integral_type='mass',hostname='taurus',nprocs=1,output_dir=None,debug=False):
+
+	"""
+	compute the AAM excitation functions (AEFs) of every copy (e.g. ensemble member) of an experiment 
+	for a range of dates, and collect them in one netcdf file per experiment and diagnostic 
+	(the 'aef_series' file in experiment_settings.find_paths), which load_aef_series then reads from. 
+	This replaces the one-csv-file-per-date output of compute_aefs_as_csv. 
+
+	The file holds one array, AEF, with dimensions time x copy x component x term, where the terms 
+	are the U, V, and PS contributions to each component. The time dimension is unlimited, and 
+	if the file already exists, only the dates that aren't in it yet are computed, so the file 
+	can be brought up to date as new analysis dates come in (or after an interrupted run). 
+
+	INPUTS:
+	E: experiment dictionary 
+	daterange: list of dates to compute 
+	copystrings: list of copies -- the default is every copy in the state space vector 
+	ERP: list of excitation function components 
+	integral_type: 'mass' (default) or 'volume' -- see aef_from_model_field 
+	nprocs: the number of processes over which the dates are distributed. Default is 1. 
+	output_dir: where to write the file -- the default is where find_paths looks for it. 
+	"""
+
+	if copystrings is None:
+		copystrings = es.get_expt_CopyMetaData_state_space(E)
+	terms = ['U','V','PS']
+
+	filename = es.find_paths(E,daterange[0],file_type='aef_series',hostname=hostname)
+	if output_dir is not None:
+		filename = os.path.join(output_dir,os.path.basename(filename))
+
+	# make sure nobody is reading the file while we write it
+	dart.close_netcdf_files(filename)
+
+	if os.path.exists(filename):
+		ff = Dataset(filename,'a')
+		# new dates can only be added for the same copies, components, and type of integral 
+		layout = [list(ff.variables[name][:]) for name in ['copystring','component','term']]
+		if (layout != [list(copystrings),list(ERP),terms]) or (ff.integral_type != integral_type):
+			print('make_aef_series: '+filename+' holds '+ff.integral_type+' integrals of components '+', '.join(layout[1]))
+			print('for copies '+', '.join(layout[0]))
+			print('use those, or write to a different output_dir')
+			ff.close()
+			return None
+	else:
+		ff = Dataset(filename,'w',format='NETCDF4')
+		ff.createDimension('time',None)
+		ff.createDimension('copy',len(copystrings))
+		ff.createDimension('component',len(ERP))
+		ff.createDimension('term',len(terms))
+		times = ff.createVariable('time','f8',('time',))
+		times.units = 'days since 1600-01-01 00:00:00'
+		for name,dim,values in [('copystring','copy',copystrings),('component','component',ERP),('term','term',terms)]:
+			V = ff.createVariable(name,str,(dim,))
+			for ii,value in enumerate(values):
+				V[ii] = value
+		AEF = ff.createVariable('AEF','f8',('time','copy','component','term'),chunksizes=(1,len(copystrings),len(ERP),len(terms)),fill_value=np.nan)
+		AEF.long_name = 'AAM excitation function'
+		ff.createVariable('written','i1',('time',),fill_value=0)
+		ff.integral_type = integral_type
+		ff.description = 'AAM excitation functions computed from the model fields of experiment '+E['exp_name']+', diagnostic '+E['diagn']
+		ff.history = 'Created ' + datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+		ff.source = 'Python module DART_state_space.py'
+
+	# figure out which dates still need to be done 
+	time_list = list(np.ma.filled(ff.variables['time'][:],np.nan))
+	arglist = []
+	for date in daterange:
+		it = covariance_series_index(time_list,date)
+		if (it is not None) and (np.ma.filled(ff.variables['written'][it],0) == 1):
+			continue
+		arglist.append((E,date,copystrings,ERP,integral_type,hostname,debug))
+	if debug:
+		print('make_aef_series: computing '+str(len(arglist))+' dates')
+
+	if nprocs > 1:
+		import multiprocessing
+		pool = multiprocessing.Pool(processes=nprocs)
+		results = pool.imap(make_aef_series_worker,arglist)
+	else:
+		pool = None
+		results = (make_aef_series_worker(args) for args in arglist)
+
+	# write the results to the file as they come in, so that an interrupted run keeps everything done so far 
+	try:
+		for args,AD in zip(arglist,results):
+			date = args[1]
+			if AD is None:
+				print('make_aef_series: skipping '+date.strftime('%Y-%m-%d'))
+				continue
+
+			it = covariance_series_index(time_list,date)
+			if it is None:
+				it = len(time_list)
+				time_list.append(dart.covariance_series_time(date))
+				ff.variables['time'][it] = time_list[it]
+
+			ff.variables['AEF'][it,...] = AD['AEF']
+			ff.variables['written'][it] = 1
+			ff.sync()
+	finally:
+		ff.close()
+		if pool is not None:
+			pool.close()
+			pool.join()
+
+	return filename
+
+def make_aef_series_worker(args):
+
+	# compute the AEFs for one date -- see make_aef_series 
+	E,date,copystrings,ERP,integral_type,hostname,debug = args
+	return aefs_from_model_fields(E,date,copystrings,ERP,integral_type,hostname,debug)
 
+def load_aef_series(E,daterange=None,hostname='taurus',output_dir=None,debug=False):
+
+	"""
+	read the AAM excitation functions collected by make_aef_series for an experiment. 
+
+	INPUTS:
+	E: experiment dictionary 
+	daterange: the dates to return -- the default is every date in the file 
+	output_dir: the directory that make_aef_series wrote to, if it wasn't the default one 
+
+	Returns a pandas dataframe with one column, AEF, indexed by date, copystring, component, and term, 
+	or None if the file doesn't exist. Dates in daterange that aren't in the file are left out. 
+	"""
+	if daterange is None:
+		date0 = E['daterange'][0]
+	else:
+		date0 = daterange[0]
+	filename = es.find_paths(E,date0,file_type='aef_series',hostname=hostname)
+	if output_dir is not None:
+		filename = os.path.join(output_dir,os.path.basename(filename))
+	if not os.path.exists(filename):
+		if debug:
+			print('load_aef_series: cannot find file '+filename)
+		return None
+
+	ff = Dataset(filename,'r')
+	time_list = list(np.ma.filled(ff.variables['time'][:],np.nan))
+	written = np.ma.filled(ff.variables['written'][:],0)
+	copystrings = list(ff.variables['copystring'][:])
+	components = list(ff.variables['component'][:])
+	terms = list(ff.variables['term'][:])
+
+	# pick out the time indices we want 
+	if daterange is None:
+		itlist = [it for it in np.argsort(time_list) if written[it] == 1]
+	else:
+		itlist = []
+		for date in daterange:
+			it = covariance_series_index(time_list,date)
+			if (it is not None) and (written[it] == 1):
+				itlist.append(it)
+	AEF = np.ma.filled(ff.variables['AEF'][:],np.nan)[itlist,...]
+	ff.close()
+
+	dates = [datetime.datetime(1600,1,1)+datetime.timedelta(days=time_list[it]) for it in itlist]
+	# round off to the second, since the time axis is stored in days 
+	dates = [datetime.datetime(*d.timetuple()[0:6])+datetime.timedelta(seconds=int(round(d.microsecond*1E-6))) for d in dates]
+	index = pd.MultiIndex.from_product([dates,copystrings,components,terms],names=['time','copystring','component','term'])
+	DF = pd.DataFrame({'AEF':AEF.ravel()},index=index)
+
+	return DF
 
 def aef_from_model_field(E = dart.basic_experiment_dict(),date=datetime.datetime(2009,1,1),variables=['U'],ERP='X3',levels_mistake=False,integral_type='mass',hostname='taurus',debug=False):
 
@@ -1156,6 +1712,8 @@ def aef_from_model_field(E = dart.basic_experiment_dict(),date=datetime.datetime
 	# the keyword levels_mistake is set to true to simulate a possible code mistake where pressure levels were flipped the wrong way 
 	# relative to the wind fields
 
+	import ERP as erp
+
 	# the  output AEFs will be in a list, corresponding to the variables given as input
 	Xout = []
 
@@ -1169,24 +1727,24 @@ def aef_from_model_field(E = dart.basic_experiment_dict(),date=datetime.datetime
 			E['variable'] = 'VS'
 
 		# load the variable field
-		lev,lat,lon,VV,P0,hybm,hyam = dart.load_DART_diagnostic_file(E,date,hostname=hostname,debug=debug)
+		D = dart.load_DART_diagnostic_file(E,date,hostname=hostname,debug=debug)
+		lev = D['lev']
+		lat = D['lat']
+		lon = D['lon']
+		VV = np.squeeze(D['data'])
 
 		# if doing the mass integral, we have to recreate the 3d pressure field from hybrid model levels
-		if (integral_type is 'mass'):
+		if (integral_type == 'mass'):
 
 			# recreate the 3D pressure field
 			E2 = E.copy()
 			E2['variable'] = 'PS'
-			dum1,latps,lonps,PS,dum4,dum5,dum6 = dart.load_DART_diagnostic_file(E2,date,hostname=hostname,debug=debug)
-			nlev = len(lev)
-			nlat = len(latps)
-			nlon = len(lonps)
-			P = np.zeros(shape=(nlat,nlon,nlev))
-			for k in range(nlev):
-				for j in range(nlat):
-					for i in range(nlon):
-						dum = None
-						P[j,i,k] = hyam[k]*P0[0] + hybm[k] * PS[j,i]
+			Dps = dart.load_DART_diagnostic_file(E2,date,hostname=hostname,debug=debug)
+			latps = Dps['lat']
+			lonps = Dps['lon']
+			PS = np.squeeze(Dps['data'])
+			C = hybrid_level_coefficients(E,date,lev,hostname=hostname,debug=debug)
+			P = dart.hybrid_pressure(C['hyam'],C['hybm'],PS,C['P0'],axis=-1)
 					
 			
 			# compute the integral
@@ -1194,7 +1752,7 @@ def aef_from_model_field(E = dart.basic_experiment_dict(),date=datetime.datetime
 			Xtemp = erp.aef_massintegral(VV=VV,PS=PS,p=P,lat=latps,lon=lonps,variable_name=variable,ERP=ERP)
 
 		# if doing a volume integral, we need to make sure the levels array is in Pascal 
-		if (integral_type is 'volume'):
+		if (integral_type == 'volume'):
 			lev_Pa = lev*100
 			# simulate a flipped levels error if desired
 			if levels_mistake:
@@ -1228,11 +1786,12 @@ def plot_compare_AEFintegrals_to_obs(E = dart.basic_experiment_dict(),daterange
 	# and compare these to the AEF observations produced by the obs operator (obs_def_eam.f90) 
 	#
 	# this is mostly to check that the AEF operator was coded correctly.  
+	# the integrals are read from the file written by make_aef_series -- 
+	# any dates that aren't in that file yet are computed and added first. 
+	# for comparison, we also show the volume integral of the winds with the pressure levels flipped 
+	# (a possible coding mistake) -- this isn't stored, so it's computed on the fly. 
 	E['copystring'] = 'ensemble member     29'
-	variables=['U','V','PS']
-	X = np.zeros(shape=(4,len(daterange)))
-	Xbad = np.zeros(shape=(4,len(daterange)))
-	Y = np.zeros(shape=(1,len(daterange)))
+	terms = ['U','V','PS']
 
 	# choose the observation name that goes with the desired ERP
 	if ERP == 'X1':
@@ -1242,23 +1801,41 @@ def plot_compare_AEFintegrals_to_obs(E = dart.basic_experiment_dict(),daterange
 	if ERP == 'X3':
 		obs_name = 'ERP_LOD'
 
-	# loop over the daterange and create timeseries of the AEFs, 
-	# and load the corresponding observations
-	for date,ii in zip(daterange,range(len(daterange))):
-		vars,XX = aef_from_model_field(E,date,variables,ERP,False,hostname)
-		vars,XXbad = aef_from_model_field(E,date,variables,ERP,True,hostname)
-		X[0,ii] = XX[0]
-		X[1,ii] = XX[1]
-		X[2,ii] = XX[2]
-		X[3,ii] = sum(XX)
-		Xbad[0,ii] = XXbad[0]
-		Xbad[1,ii] = XXbad[1]
-		Xbad[2,ii] = XXbad[2]
-		Xbad[3,ii] = sum(XXbad)
-
-		# load the corresponding observation
-		obs,cs = dart.load_DART_obs_epoch_file(E,date,[obs_name],None, hostname)
-		Y[0,ii] = obs
+	# load the timeseries of the AEFs for this copy, and bring the file up to date if necessary 
+	DF = load_aef_series(E,daterange,hostname=hostname)
+	if (DF is None) or (len(DF.index.get_level_values('time').unique()) < len(daterange)):
+		make_aef_series(E,daterange,hostname=hostname)
+		DF = load_aef_series(E,daterange,hostname=hostname)
+	if DF is None:
+		print('plot_compare_AEFintegrals_to_obs: no AEFs available for experiment '+E['exp_name'])
+		return
+	XDF = DF.xs((E['copystring'],ERP),level=('copystring','component'))['AEF'].unstack('term')
+	XDF = XDF.reindex(index=list(daterange),columns=terms)
+	X = np.zeros(shape=(4,len(daterange)))
+	X[0:3,:] = np.transpose(XDF.values)
+	X[3,:] = np.sum(X[0:3,:],axis=0)
+
+	# the integrals with flipped pressure levels -- only the wind terms depend on the levels, 
+	# so the PS term is the one from the file 
+	Xbad = np.zeros(shape=(4,len(daterange)))
+	for ii,date in enumerate(daterange):
+		vars,XXbad = aef_from_model_field(E.copy(),date,['U','V'],ERP,levels_mistake=True,integral_type='volume',hostname=hostname)
+		Xbad[0:2,ii] = XXbad
+	Xbad[2,:] = X[2,:]
+	Xbad[3,:] = np.sum(Xbad[0:3,:],axis=0)
+
+	# load the corresponding observations 
+	Eo = E.copy()
+	Eo['daterange'] = daterange
+	ODF = dart.load_DART_obs_epoch_series_as_dataframe(Eo,[obs_name],['ensemble member'],hostname=hostname)
+	Y = np.zeros(shape=(1,len(daterange)))
+	Y[:] = np.nan
+	if ODF is not None:
+		ODF = ODF[[E['copystring'] in cs for cs in ODF['CopyName']]]
+		obs = ODF.groupby('Date')['Value'].first()
+		for ii,date in enumerate(daterange):
+			if date in obs.index:
+				Y[0,ii] = obs[date]
 
 
 	# plot it and export as pdf
@@ -1269,22 +1846,19 @@ def plot_compare_AEFintegrals_to_obs(E = dart.basic_experiment_dict(),daterange
 	ax1 = plt.subplot(121)
 	t = [d.date() for d in daterange]
 
-	# TODO: replace with call to moduel palettable to get colorbrewer colors back
-	colors,cmap,cmap_type = state_space_HCL_colormap(E,Ediff,reverse=reverse_colors)
-	#bmap = brewer2mpl.get_map('Dark2', 'qualitative', 7)
-	plt.plot(t,Y[0,:],color=_colors[0])
-	plt.hold(True)
-	plt.plot(t,X[3,:],color=colors[1])
-	plt.plot(t,Xbad[3,:],color=bmap.colors[2])
+	bmap = pb.colorbrewer.qualitative.Dark2_7
+	plt.plot(t,Y[0,:],color=bmap.mpl_colors[0])
+	plt.plot(t,X[3,:],color=bmap.mpl_colors[1])
+	plt.plot(t,Xbad[3,:],color=bmap.mpl_colors[2])
 	plt.legend(['EAM Code','My integral','Integral with flipped p levels'],loc='best')
 
 
-	ax2 = plt.subplot(121)
-	plt.plot(t,Y[0,:]-np.mean(Y[0,:]),color=bmap.mpl_colors[0])
-	plt.hold(True)
-	plt.plot(t,X[0,:]-np.mean(X[0,:]),color=bmap.mpl_colors[1])
-	plt.plot(t,Xbad[0,:]-np.mean(Xbad[0,:]),color=bmap.mpl_colors[2])
-	plt.legend(['EAM Code Anomaly','U integral anomaly','U integral anom with error'],loc='best')
+	ax2 = plt.subplot(122)
+	plt.plot(t,Y[0,:]-np.nanmean(Y[0,:]),color=bmap.mpl_colors[0])
+	for iterm,term in enumerate(terms):
+		plt.plot(t,X[iterm,:]-np.nanmean(X[iterm,:]),color=bmap.mpl_colors[iterm+1])
+	plt.plot(t,Xbad[0,:]-np.nanmean(Xbad[0,:]),color=bmap.mpl_colors[4])
+	plt.legend(['EAM Code Anomaly']+[term+' integral anomaly' for term in terms]+['U integral anom with error'],loc='best')
 
 	fig_name = 'EAM_obs_operator_error_check_'+ERP+'.pdf'
 	plt.savefig(fig_name, dpi=96)
@@ -1383,89 +1957,56 @@ def plot_obs_space_ensemble(E = dart.basic_experiment_dict(),daterange = dart.da
 
 def plot_diagnostic_lon_time(E=dart.basic_experiment_dict(),Ediff=None,clim=None,hostname='taurus',cbar=True,debug=False):
 
-	# loop over the input date range
-	daterange=E['daterange']
-	for date, ii in zip(daterange,np.arange(0,len(daterange))):  
-
-
-		# load the data over the desired latitude and longitude range  
-		if (E['diagn'].lower() == 'covariance') or (E['diagn'].lower() == 'correlation') :
-			if ii == 0:
-				lev,lat,lon,Cov,Corr = dart.load_covariance_file(E,date,hostname,debug=debug)
-				nlat = len(lat)
-				refshape = Cov.shape
-			else:
-				dum1,dum2,dum3,Cov,Corr = dart.load_covariance_file(E,date,hostname,debug=debug)
-
-
-			if E['diagn'].lower() == 'covariance':
-				VV = Cov
-			if E['diagn'].lower() == 'correlation':
-				VV = Corr
-		else:
-			if ii == 0:
-				lev,lat,lon,VV,P0,hybm,hyam = dart.load_DART_diagnostic_file(E,date,hostname=hostname,debug=debug)
-				nlon = len(lon)
-				refshape = VV.shape
-			else:
-				dum1,dum2,dum3,VV,P0,hybm,hyam = dart.load_DART_diagnostic_file(E,date,hostname=hostname,debug=debug)
-
-		# if the file was not found, VV will be undefined, so put in empties
-		if VV is None:
-			VV = np.empty(shape=refshape)
-
-		# average over latitude and (for 3d variables) vertical levels 
-		if (E['variable']=='PS'):
-			Mlatlev = np.mean(VV,axis=0)
-		else:
-			Mlat = np.mean(VV,axis=0)
-			Mlatlev = np.mean(Mlat,axis=1)
-		
+	"""
+	plot a given state-space diagnostic as a function of longitude and time, averaging over latitude 
+	and (for 3d variables) vertical levels. 
+	This is compute_diagnostic_lon_time followed by render_diagnostic_lon_time.
+	"""
 
-		M1 = Mlatlev
+	P = compute_diagnostic_lon_time(E,Ediff,hostname,debug)
+	if P is None:
+		return None,None
+	return render_diagnostic_lon_time(P,E,Ediff,clim,cbar,debug)
 
+def compute_diagnostic_lon_time(E=dart.basic_experiment_dict(),Ediff=None,hostname='taurus',debug=False):
 
-		# repeat for the difference experiment
-		if (Ediff != None):
-			lev2,lat2,lon2,VV,P0,hybm,hyam = dart.load_DART_diagnostic_file(Ediff,date,hostname=hostname,debug=debug)
-			if (E['variable']=='PS'):
-				M2latlev = np.mean(VV,axis=0)
-			else:
-				M2lat = np.mean(VV,axis=0)
-				M2latlev = np.mean(M2lat,axis=1)
-			M2 = M2latlev
-			M = M1-M2
-		else:
-			M = M1
+	"""
+	load the data for plot_diagnostic_lon_time, averaged over latitude and vertical levels as they are read in. 
+	Returns a dictionary holding the longitude x time array ('data'), 'lon', and the dates that 
+	were found ('time'), or None if nothing was found. 
+	"""
+	M,D = reduced_diagnostic_difference(E,Ediff,None,['meridional_mean','lev_mean'],hostname,debug)
+	if M is None:
+		return None
 
+	P = dict()
+	P['data'] = M
+	P['lon'] = D['lon']
+	P['time'] = D['daterange']
+	return P
 
-		# append the resulting vector to the larger array (or initialize it)
-		if (ii==0) :
-			MM = np.zeros(shape=(nlon, len(daterange)), dtype=float)
-			names=[]
-		MM[:,ii] = M
+def render_diagnostic_lon_time(P,E,Ediff=None,clim=None,cbar=True,debug=False):
 
-	# make a grid of levels and days
-	#day = daterange.dayofyear
-	#t = [d.date() for d in daterange]
-	t = daterange
+	"""
+	draw the output of compute_diagnostic_lon_time into the current axes -- see plot_diagnostic_lon_time for the inputs.
+	"""
+	MM = P['data']
+	lon = P['lon']
+	t = P['time']
 
         # choose color map based on the variable in question
-	#cmap = state_space_colormap(E,Ediff)
 	colors,cmap,cmap_type = state_space_HCL_colormap(E,Ediff)
 
-
         # contour data over the map.
-        #cs = plt.contourf(t,lat,MM,15,cmap=cmap)
-        #cs = plt.contourf(t,lat,MM,len(colors)-1,colors=colors)
 	MT = np.transpose(MM)
 	cs = plt.contourf(lon,t,MT,len(colors)-1,cmap=cmap,extend="both")
 	plt.axis('tight')
+	if clim is None:
+		clim = np.nanmax(np.absolute(MM))
 	if cmap_type == 'divergent':
-		if clim is None:
-			clim = np.nanmax(np.absolute(MM))
 		plt.clim([-clim,clim])
-	print(cs.get_clim())
+	if debug:
+		print(cs.get_clim())
 	if cbar:
 		if (clim > 1000) or (clim < 0.001):
 			CB = plt.colorbar(cs, shrink=0.8, extend='both',orientation='vertical',format='%.3f')
@@ -1477,24 +2018,26 @@ def plot_diagnostic_lon_time(E=dart.basic_experiment_dict(),Ediff=None,clim=None
 	plt.xlabel('Longitude')
 
 	# fix the date exis
-	if len(t)>30:
-		fmt = mdates.DateFormatter('%b-%d')
-		plt.gca().yaxis.set_major_locator(mdates.AutoDateLocator())
-		#plt.gca().yaxis.set_major_locator(mdates.MonthLocator())
-		#plt.gca().yaxis.set_minor_locator(mdates.DayLocator())
-		plt.gca().yaxis.set_major_formatter(fmt)
-	else:
-		fmt = mdates.DateFormatter('%b-%d')
-		plt.gca().yaxis.set_major_locator(mdates.AutoDateLocator())
-		#plt.gca().yaxis.set_minor_locator(mdates.DayLocator())
-		plt.gca().yaxis.set_major_formatter(fmt)
+	fmt = mdates.DateFormatter('%b-%d')
+	plt.gca().yaxis.set_major_locator(mdates.AutoDateLocator())
+	plt.gca().yaxis.set_major_formatter(fmt)
 
 	return cs,CB
 
 def read_aefs_from_csv_to_dataframe(E=dart.basic_experiment_dict(), hostname='taurus', debug=False):
 
 	#read in pre-computed angular momentum excitation functions (AEFs) for a DART run defined in the dictionary E
-	# the AEFs are stored in csv files computed using the subroutine compute_aefs_as_csv
+	# the AEFs are stored either in the single file written by make_aef_series, or in csv files computed 
+	# using the subroutine compute_aefs_as_csv
+
+	# if the AEFs have been collected in one file, take them from there, summed over the U, V, and PS terms 
+	DF = load_aef_series(E,E['daterange'],hostname=hostname,debug=debug)
+	if DF is not None:
+		DF = DF['AEF'].groupby(level=['time','copystring','component'],sort=False).sum().reset_index()
+		DF = DF.rename(columns={'component':'Parameter_Name'})
+		DF['experiment'] = E['exp_name']
+		DF['diagnostic'] = E['diagn']
+		return(DF)
 
 	# find the file path for the given experiment
 	if E['run_category'] == None:
@@ -1641,7 +2184,7 @@ def compute_DART_diagn_from_model_h_files(E,datetime_in,hostname='taurus',verbos
 
 	# print an error message if none of these worked 
 	if Xout is None:
-		print('compute_DART_diagn_from_model_h_files does not know what to do with copystring '+copystring)
+		print('compute_DART_diagn_from_model_h_files does not know what to do with copystring '+CS)
 		print('Returning None')
 		return None
 	else:
@@ -1678,6 +2221,21 @@ def plot_diagnostic_lev_lon(E=dart.basic_experiment_dict(),Ediff=None,clim=None,
 		'TPbased': in this case, compute the height of each gridbox relative to the local tropopause and 
 			plot everything on a "tropopause-based" grid, i.e. zt = z-ztrop-ztropmean 
 	debug: set to True to get extra ouput
+
+	This is compute_diagnostic_lev_lon followed by render_diagnostic_lev_lon.
+	"""
+
+	P = compute_diagnostic_lev_lon(E,Ediff,vertical_coord,scaling_factor,hostname,debug)
+	if P is None:
+		return
+	return render_diagnostic_lev_lon(P,E,Ediff,clim,L,cbar,cmap_type,reverse_colors,colorbar_label,vertical_coord,debug)
+
+def compute_diagnostic_lev_lon(E=dart.basic_experiment_dict(),Ediff=None,vertical_coord='log_levels',scaling_factor=1.0,hostname='taurus',debug=False):
+
+	"""
+	load the data for plot_diagnostic_lev_lon and average over time and latitude. 
+	Returns a dictionary holding the averaged array ('data'), 'lon', 'lev', and the vertical 
+	coordinate to plot against ('y') with its label ('ylabel'), or None if the variable is two dimensional. 
 	"""
 
 	# throw an error if the desired variable is 2 dimensional 
@@ -1690,32 +2248,58 @@ def plot_diagnostic_lev_lon(E=dart.basic_experiment_dict(),Ediff=None,clim=None,
 	
 	# convert to TP-based coordinates if requested 	
 	if vertical_coord=='TPbased': 
-		Vmain,lev=to_TPbased(E,D['data'],D['lev'],hostname=hostname,debug=debug)
-	else:
-		Vmain=D['data']
-		lev=D['lev']
+		D = to_TPbased(E,D,hostname=hostname,debug=debug)
+	Vmain=D['data']
+	lev=D['lev']
 	if Ediff is not None:
 		Ddiff = DART_diagn_to_array(Ediff,hostname=hostname,debug=debug)
 		# convert to TP-based coordinates if requested 	
 		if vertical_coord=='TPbased': 
-			Vdiff,lev=to_TPbased(E,Ddiff['data'],Ddiff['lev'],hostname=hostname,debug=debug)
-		else:
-			Vdiff=Ddiff['data']
-		Vmatrix=Vmain-Vdiff
+			Ddiff = to_TPbased(E,Ddiff,hostname=hostname,debug=debug)
+		Vmatrix=Vmain-Ddiff['data']
 	else:
 		Vmatrix=Vmain
 
 	# average over time and latitude  
 	lat = D['lat']
-	lon = D['lon']
 	V0 = average_over_named_dimension(Vmatrix,D['daterange'])
 	if lat is not None:
 		V1 = average_over_named_dimension(V0,lat)
 	else:
 		V1 = V0
 
+	# compute vertical coordinate depending on choice of pressure or altitude 
+	if 'levels' in vertical_coord:
+		y=lev
+		ylabel = 'Level (hPa)'
+	if vertical_coord=='z':
+		H=7.0
+		p0=1000.0 
+		y = H*np.log(p0/lev)
+		ylabel = 'log-p height (km)'
+	if vertical_coord=='TPbased':
+		y=lev
+		ylabel='z (TP-based) (km)'
+
 	# squeeze out any leftover length-1 dimensions,and multiply by scaling factor if needed  
-	M = scaling_factor*np.squeeze(V1)
+	P = dict()
+	P['data'] = scaling_factor*np.squeeze(V1)
+	P['lon'] = D['lon']
+	P['lev'] = lev
+	P['y'] = y
+	P['ylabel'] = ylabel
+	return P
+
+def render_diagnostic_lev_lon(P,E,Ediff=None,clim=None,L=None,cbar='vertical',cmap_type='sequential',reverse_colors=False,colorbar_label=None,vertical_coord='log_levels',debug=False):
+
+	"""
+	draw the output of compute_diagnostic_lev_lon into the current axes -- see plot_diagnostic_lev_lon for the inputs.
+	"""
+	M = P['data']
+	lon = P['lon']
+	lev = P['lev']
+	y = P['y']
+	ylabel = P['ylabel']
 
         # choose color map 
 	cc = nice_colormaps(cmap_type,reverse_colors)
@@ -1743,34 +2327,19 @@ def plot_diagnostic_lev_lon(E=dart.basic_experiment_dict(),Ediff=None,clim=None,
 		MT = M
 
 	if len(MT.shape) < 2:
-		print('plot_diagnostic_lev_lat: the derived array is not 2-dimensional. This is its shape:')
+		print('plot_diagnostic_lev_lon: the derived array is not 2-dimensional. This is its shape:')
 		print(MT.shape)
 		print('Returning with nothing plotted...')
 		return None,None
 
 	if (MT.shape[0] != len(lev)) |  (MT.shape[1] != len(lon)):
-		print("plot_diagnostic_lev_lat: the dimensions of the derived array don't match the level and latitude arrays we are plotting against. Here are their shapes:")
+		print("plot_diagnostic_lev_lon: the dimensions of the derived array don't match the level and longitude arrays we are plotting against. Here are their shapes:")
 		print(MT.shape)
 		print(len(lev))
 		print(len(lon))
 		print('Returning with nothing plotted...')
 		return None,None
 
-	# compute vertical coordinate depending on choice of pressure or altitude 
-	if 'levels' in vertical_coord:
-		y=lev
-		ylabel = 'Level (hPa)'
-	if vertical_coord=='z':
-		H=7.0
-		p0=1000.0 
-		y = H*np.log(p0/lev)
-		ylabel = 'log-p height (km)'
-	if vertical_coord=='TPbased':
-		#from matplotlib import rcParams
-		#rcParams['text.usetex'] = True
-		y=lev
-		ylabel='z (TP-based) (km)'
-
 	cs = plt.contourf(lon,y,MT,L,cmap=cmap,extend="both")
 
 	# add a colorbar if desired 
@@ -1824,6 +2393,21 @@ def plot_diagnostic_lev_lat(E=dart.basic_experiment_dict(),Ediff=None,clim=None,
 		'TPbased': in this case, compute the height of each gridbox relative to the local tropopause and 
 			plot everything on a "tropopause-based" grid, i.e. zt = z-ztrop-ztropmean 
 	debug: set to True to get extra ouput
+
+	This is compute_diagnostic_lev_lat followed by render_diagnostic_lev_lat.
+	"""
+
+	P = compute_diagnostic_lev_lat(E,Ediff,vertical_coord,scaling_factor,hostname,debug)
+	if P is None:
+		return
+	return render_diagnostic_lev_lat(P,E,Ediff,clim,L,cbar,cmap_type,reverse_colors,colorbar_label,vertical_coord,debug)
+
+def compute_diagnostic_lev_lat(E=dart.basic_experiment_dict(),Ediff=None,vertical_coord='log_levels',scaling_factor=1.0,hostname='taurus',debug=False):
+
+	"""
+	load the data for plot_diagnostic_lev_lat and average over time and longitude. 
+	Returns a dictionary holding the averaged array ('data'), 'lat', 'lev', and the vertical 
+	coordinate to plot against ('y') with its label ('ylabel'), or None if the variable is two dimensional. 
 	"""
 
 	# throw an error if the desired variable is 2 dimensional 
@@ -1836,17 +2420,13 @@ def plot_diagnostic_lev_lat(E=dart.basic_experiment_dict(),Ediff=None,clim=None,
 
 	# convert to TP-based coordinates if requested 	
 	if vertical_coord=='TPbased': 
-		Vmain,lev=to_TPbased(E,D,hostname=hostname,debug=debug)
-		D['data']=Vmain
-		D['lev']=lev
+		D = to_TPbased(E,D,hostname=hostname,debug=debug)
 
 	if Ediff is not None:
 		D2 = DART_diagn_to_array(Ediff,hostname=hostname,debug=debug)
 		# convert to TP-based coordinates if requested 	
 		if vertical_coord=='TPbased': 
-			Vdiff,lev=to_TPbased(E,D2,hostname=hostname,debug=debug)
-			D2['data']=Vmain
-			D2['lev']=lev
+			D2 = to_TPbased(E,D2,hostname=hostname,debug=debug)
 		# subtract the main datarray 
 		Vmatrix=D['data']-D2['data']
 	else:
@@ -1862,8 +2442,37 @@ def plot_diagnostic_lev_lat(E=dart.basic_experiment_dict(),Ediff=None,clim=None,
 	else:
 		V1 = V0
 
+	# compute vertical coordinate depending on choice of pressure or altitude 
+	if 'levels' in vertical_coord:
+		y=D['lev']
+		ylabel = 'Level (hPa)'
+	if vertical_coord=='z':
+		H=7.0
+		p0=1000.0 
+		y = H*np.log(p0/D['lev'])
+		ylabel = 'log-p height (km)'
+	if vertical_coord=='TPbased':
+		y=D['lev']
+		ylabel='z (TP-based) (km)'
+
 	# squeeze out any leftover length-1 dimensions 
-	M = np.squeeze(V1)
+	P = dict()
+	P['data'] = scaling_factor*np.squeeze(V1)
+	P['lat'] = D['lat']
+	P['lev'] = D['lev']
+	P['y'] = y
+	P['ylabel'] = ylabel
+	return P
+
+def render_diagnostic_lev_lat(P,E,Ediff=None,clim=None,L=None,cbar='vertical',cmap_type='sequential',reverse_colors=False,colorbar_label=None,vertical_coord='log_levels',debug=False):
+
+	"""
+	draw the output of compute_diagnostic_lev_lat into the current axes -- see plot_diagnostic_lev_lat for the inputs.
+	"""
+	M = P['data']
+	x = P['lat']
+	y = P['y']
+	ylabel = P['ylabel']
 
         # choose color map 
 	cc = nice_colormaps(cmap_type,reverse_colors)
@@ -1886,9 +2495,11 @@ def plot_diagnostic_lev_lat(E=dart.basic_experiment_dict(),Ediff=None,clim=None,
 			L  = np.linspace(start=-clim0,stop=clim0,num=ncolors)
 		else:
 			L  = np.linspace(start=clim1,stop=clim2,num=ncolors)
+	else:
+		clim0 = np.max(np.absolute(L))
 
 	# transpose the array if necessary  
-	if M.shape[0]==len(D['lat']):
+	if M.shape[0]==len(x):
 		MT = np.transpose(M)
 	else:
 		MT = M
@@ -1900,29 +2511,15 @@ def plot_diagnostic_lev_lat(E=dart.basic_experiment_dict(),Ediff=None,clim=None,
 		print('Returning with nothing plotted...')
 		return None,None
 
-	if (MT.shape[0] != len(D['lev'])) |  (MT.shape[1] != len(D['lat'])):
+	if (MT.shape[0] != len(P['lev'])) |  (MT.shape[1] != len(x)):
 		print("plot_diagnostic_lev_lat: the dimensions of the derived array don't match the level and latitude arrays we are plotting against. Here are their shapes:")
 		print(MT.shape)
-		print(len(D['lev']))
-		print(len(D['lat']))
+		print(len(P['lev']))
+		print(len(x))
 		print('Returning with nothing plotted...')
 		return None,None
 
-	# compute vertical coordinate depending on choice of pressure or altitude 
-	if 'levels' in vertical_coord:
-		y=D['lev']
-		ylabel = 'Level (hPa)'
-	if vertical_coord=='z':
-		H=7.0
-		p0=1000.0 
-		y = H*np.log(p0/D['lev'])
-		ylabel = 'log-p height (km)'
-	if vertical_coord=='TPbased':
-		y=D['lev']
-		ylabel='z (TP-based) (km)'
-
-	x = D['lat']
-	cs = plt.contourf(x,y,scaling_factor*MT,L,cmap=cmap,extend="both")
+	cs = plt.contourf(x,y,MT,L,cmap=cmap,extend="both")
 
 	# add a colorbar if desired 
 	if cbar is not None:
@@ -1982,6 +2579,21 @@ def plot_diagnostic_lev_lat_quiver(E=dart.basic_experiment_dict(),Ediff=None,alp
 		'log_levels' (default) -- plot whatever the variable 'lev' gives (e.g. pressure in hPa) on a logarithmic scale 
 		'levels' -- plot whatever the variable 'lev' gives (e.g. pressure in hPa) on a linear scale 
 		'z' -- convert lev (assumed to be pressure) into log-pressure height coordinates uzing z=H*exp(p/p0) where p0 = 1000 hPa and H=7km  
+
+	This is compute_diagnostic_lev_lat_quiver followed by render_diagnostic_lev_lat_quiver.
+	"""
+
+	P = compute_diagnostic_lev_lat_quiver(E,Ediff,scale_by_pressure,vertical_coord,hostname,debug)
+	if P is None:
+		return
+	return render_diagnostic_lev_lat_quiver(P,E,Ediff,alpha,narrow,arrowscale,vertical_coord,debug)
+
+def compute_diagnostic_lev_lat_quiver(E=dart.basic_experiment_dict(),Ediff=None,scale_by_pressure=False,vertical_coord='log_levels',hostname='taurus',debug=False):
+
+	"""
+	load the two vector components for plot_diagnostic_lev_lat_quiver and average them over time and longitude. 
+	Returns a dictionary holding the list of the two level x latitude arrays ('data'), 'lat', and 
+	the vertical coordinate ('y') with its label ('ylabel'), or None if the variables can't be plotted. 
 	"""
 	# throw an error if the desired variable is 2 dimensional 
 	if (E['variable'] == 'PS') or (E['variable'] == 'FLUT'):
@@ -2000,13 +2612,13 @@ def plot_diagnostic_lev_lat_quiver(E=dart.basic_experiment_dict(),Ediff=None,alp
 	for vv in E['variable']:
 		Etemp = E.copy()
 		Etemp['variable'] = vv
-		Vmatrix,lat,lon,lev,new_daterange = DART_diagn_to_array(Etemp,hostname=hostname,debug=debug)
+		Vmatrix,lat,lon,lev,new_daterange = DART_diagn_to_array(Etemp,hostname=hostname,debug=debug,return_single_variables=True)
 
 		# if desired, scale the array by pressure (this is useful for EP flux vector)
 		if scale_by_pressure:
 			EP = E.copy()
 			EP['variable'] = 'P'
-			VP,dumlat,lonP,dumlev,dumdaterange = DART_diagn_to_array(EP,hostname=hostname,debug=debug)
+			VP,dumlat,lonP,dumlev,dumdaterange = DART_diagn_to_array(EP,hostname=hostname,debug=debug,return_single_variables=True)
 			shape_tuple = VP.shape
 			for dimlength,ii in zip(shape_tuple,range(len(shape_tuple))):
 				if dimlength == len(lonP):
@@ -2037,18 +2649,18 @@ def plot_diagnostic_lev_lat_quiver(E=dart.basic_experiment_dict(),Ediff=None,alp
 			M1 = np.squeeze(VV)
 
 		# if computing a difference to another field, load that here  
-		if (Ediff != None):
+		if (Ediff is not None):
 			Edtemp = Ediff.copy()
 			Edtemp['variable'] = vv
 
 			# load the desired DART diagnostic for the difference experiment dictionary
-			Vmatrix,lat,lon,lev,new_daterange = DART_diagn_to_array(Edtemp,hostname=hostname,debug=debug)
+			Vmatrix,lat,lon,lev,new_daterange = DART_diagn_to_array(Edtemp,hostname=hostname,debug=debug,return_single_variables=True)
 
 			# if desired, scale the array by pressure (this is useful for EP flux vector)
 			if scale_by_pressure:
 				EdiffP = Ediff.copy()
 				EdiffP['variable'] = 'P'
-				VP,dumlat,lonP,dumlev,dumdaterange = DART_diagn_to_array(EdiffP,hostname=hostname,debug=debug)
+				VP,dumlat,lonP,dumlev,dumdaterange = DART_diagn_to_array(EdiffP,hostname=hostname,debug=debug,return_single_variables=True)
 				shape_tuple = VP.shape
 				for dimlength,ii in zip(shape_tuple,range(len(shape_tuple))):
 					if dimlength == len(lonP):
@@ -2091,11 +2703,26 @@ def plot_diagnostic_lev_lat_quiver(E=dart.basic_experiment_dict(),Ediff=None,alp
 		y = H*np.log(p0/lev)
 		ylabel = 'log-p height (km)'
 	if vertical_coord=='TPbased':
-		#from matplotlib import rcParams
-		#rcParams['text.usetex'] = True
 		y=lev
 		ylabel='z (TP-based) (km)'
 
+	P = dict()
+	P['data'] = Mlist
+	P['lat'] = lat
+	P['y'] = y
+	P['ylabel'] = ylabel
+	return P
+
+def render_diagnostic_lev_lat_quiver(P,E,Ediff=None,alpha=(1,1),narrow=1,arrowscale=1.0,vertical_coord='log_levels',debug=False):
+
+	"""
+	draw the output of compute_diagnostic_lev_lat_quiver into the current axes -- see plot_diagnostic_lev_lat_quiver for the inputs.
+	"""
+	Mlist = P['data']
+	lat = P['lat']
+	y = P['y']
+	ylabel = P['ylabel']
+
 	# create a mesh
 	X,Y = np.meshgrid(lat,y)
 
@@ -2135,6 +2762,8 @@ def Nsq_from_3d(E,date,hostname='taurus',debug=False):
 	T = Temperature 
 	p_ref = reference pressure (here using P0 = 1000.0 in WACCM data) 
 	p = pressure  
+
+	This works for all the copies in E['copystring'] (e.g. the whole ensemble) at once -- see DART.buoyancy_frequency.
 	"""
 
 
@@ -2155,8 +2784,17 @@ def Nsq_from_3d(E,date,hostname='taurus',debug=False):
 			T,lat,lon,lev,time2 = era.load_ERA_file(ET,date,resol=resol,hostname=hostname,verbose=debug)
 		else:
 			# for DART runs, look for P and T in DART diagnostic files: 
-			lev,lat,lon,P,P0,hybm,hyam = dart.load_DART_diagnostic_file(EP,date,debug=debug)
-			lev,lat,lon,T,P0,hybm,hyam = dart.load_DART_diagnostic_file(ET,date,debug=debug)
+			DT = dart.load_DART_diagnostic_file(ET,date,hostname=hostname,debug=debug)
+			T = DT['data']
+			lat = DT['lat']
+			lon = DT['lon']
+			lev = DT['lev']
+			# the loader raises an error if P isn't in the file -- in that case it's recreated below 
+			try:
+				DP = dart.load_DART_diagnostic_file(EP,date,hostname=hostname,debug=debug)
+				P = DP['data']
+			except (KeyError,RuntimeError):
+				P = None
 			# TODO: if P is not in a DART diagnostic file, it could also be in a model history file, 
 			# so need to add a line of code to try looking for that as well 
 		if P is None:
@@ -2196,41 +2834,15 @@ def Nsq_from_3d(E,date,hostname='taurus',debug=False):
 			P = np.repeat(P1[:,:,np.newaxis],nlon,axis=2)
 			T=H['T']
 
-	# choose reference pressure as 1000 hPa, with units based on the max of the P array 
-	if np.max(P) > 2000.0:
-		P0 = 100000.0			# reference pressure 
+	# compute the buoyancy frequency for all the columns (and copies) at once, 
+	# differentiating along the level dimension: ERA fields are [time x] lev x lat x lon, 
+	# DART fields [copy x] lat x lon x lev 
+	if 'ERA' in E['exp_name']:
+		FT = 'ERA'
 	else:
-		P0 = 1000.0			# reference pressure 
-
-	# compute potential temperature  
-	Rd = 286.9968933                # Gas constant for dry air        J/degree/kg
-	g = 9.80616                     # Acceleration due to gravity       m/s^2
-	cp = 1005.0                     # heat capacity at constant pressure    m^2/s^2*K
-	theta = T*(P0/P)**(Rd/cp)
-
-	# turn the 3d pressure array into a geometric height array 
-	z = 7000.0*np.log(P0/P)
-
-	# compute the vertical gradient in potential temperature 
-	# this still has issues when lat or lon have length 1 -- need to fix this.
-	dZ = np.gradient(np.squeeze(z))	# 3D gradient of height (with respect to model level) 
-	try:
-		dthetadZ_3D = np.gradient(np.squeeze(theta,axis=0),dZ[0])
-	except ValueError:
-		print('shape of z and its gradient')
-		print(z.shape)
-		print(dZ[0].shape)
-		print(np.squeeze(theta,axis=0).shape)
-	dthetadZ = dthetadZ_3D[0] # this is the vertical temperature gradient with respect to pressure 
-
-	# compute the buoyancy frequency 
-	try:
-		N2 = (g/theta)*dthetadZ
-	except ValueError: 
-		print('problemo with shaoes that comprise N2') 
-		print(theta.shape)
-		print(dthetadZ.shape)
-		print(z.shape)
+		FT = 'DART'
+	dims = field_dimension_names(T,FT,lat,lon,lev)
+	N2 = dart.buoyancy_frequency(T,P=P,axis='lev',dims=dims)
 
 	return N2,lat,lon,lev
 
@@ -2242,6 +2854,8 @@ def P_from_hybrid_levels(E,date,hostname='taurus',debug=False):
 	recreate the pressure field given the hybrid model level parameters 
 	**note:** this code was crafted for WACCM/CAM data, and returns a pressure array 
 	that fits te latxlonxlev structure of WACCM/CAM history files. 
+	If E['copystring'] is 'ensemble', the pressure comes out for all ensemble members at once, 
+	shaped copy x lat x lon x lev. 
 	"""
 
 	# check whether the requested experiment uses a model with hybrid levels. 
@@ -2252,34 +2866,72 @@ def P_from_hybrid_levels(E,date,hostname='taurus',debug=False):
 		print('ERA data are not on hybrid levels --need to retrieve ERA pressure data instead of calling P_from_hybrid_levels')
 		return None,None,None,None
 
-	# reconstruct the pressure field at each point from hybrid model variables 
-	varlist = ['hyam','hybm','P0','PS','T','Z3']
-	H = dict()
-	for vname in varlist:
-		Ehyb = E.copy()
-		Ehyb['variable'] = vname
-		field,lat,lon,lev = compute_DART_diagn_from_model_h_files(Ehyb,date,verbose=debug)
-		if vname == 'PS':
-			H['lev'] = lev
-			H['lat'] = lat
-			H['lon'] = lon        
-		H[vname]=field
+	# hybrid level coefficients of this model grid (these are only read once per grid) 
+	C = hybrid_level_coefficients(E,date,hostname=hostname,debug=debug)
+	if C is None:
+		return None,None,None,None
 
-	if lev is None:
-		print(Ehyb)
+	# surface pressure (for all the copies in E['copystring']) 
+	EPS = E.copy()
+	EPS['variable'] = 'PS'
+	D = compute_DART_diagn_from_model_h_files(EPS,date,hostname=hostname,verbose=debug)
+	if D is None:
+		return None,None,None,None
+	PS = np.squeeze(D['data'])
 
-	nlev = len(lev)
-	nlat = len(lat)
-	nlon = len(lon)
-	P = np.zeros(shape = (nlat,nlon,nlev))
-	for k in range(nlev):
-		for i in range(nlon):
-			for j in range(nlat):
-				P[j,i,k] = H['hyam'][k]*H['P0'] + H['hybm'][k]* np.squeeze(H['PS'])[j,i]
+	# pressure at every point at once -- levels are the last dimension 
+	P = dart.hybrid_pressure(C['hyam'],C['hybm'],PS,C['P0'],axis=-1)
 
-	return P,lat,lon,lev
+	return P,D['lat'],D['lon'],C['lev']
 
-def bootstrapci_from_anomalies(E,P=95,nsamples=1000,hostname='taurus',debug=False):
+def hybrid_level_coefficients(E,date,lev=None,hostname='taurus',debug=False):
+
+	"""
+	return a dictionary with the hybrid level coefficients 'hyam' and 'hybm', the reference pressure 'P0', 
+	and the levels 'lev' of the model grid of experiment E. 
+	These are read from the DART diagnostic file for the given date, or if that doesn't have them, 
+	from the model history files -- but only the first time they are asked for: after that they are 
+	kept for each experiment and file type. 
+	If an array of levels lev is given, the coefficients of the model levels closest to those are returned. 
+	"""
+	key = (E['exp_name'],E.get('file_type','DART'))
+	if key not in hybrid_coefficient_cache:
+		C = None
+		filename = es.find_paths(E,date,'diag',hostname=hostname,debug=debug)
+		if os.path.exists(filename):
+			with dart.netcdf_file(filename) as f:
+				if all([vname in f.variables for vname in ['hyam','hybm','P0','lev']]):
+					C = dict()
+					for vname in ['hyam','hybm','P0','lev']:
+						C[vname] = np.asarray(f.variables[vname][:])
+		if C is None:
+			# the coefficients are the same for all ensemble members, so read them from the first one 
+			C = dict()
+			for vname in ['hyam','hybm','P0']:
+				Ehyb = E.copy()
+				Ehyb['variable'] = vname
+				Ehyb['copystring'] = 'ensemble member 1'
+				D = compute_DART_diagn_from_model_h_files(Ehyb,date,hostname=hostname,verbose=debug)
+				if D is None:
+					print('hybrid_level_coefficients: cannot find '+vname+' for experiment '+E['exp_name'])
+					return None
+				C[vname] = np.squeeze(D['data'])
+				if vname == 'hyam':
+					C['lev'] = D['lev']
+		hybrid_coefficient_cache[key] = C
+
+	C = hybrid_coefficient_cache[key]
+	if (lev is None) or (C['lev'] is None):
+		return C
+	k = [(np.abs(C['lev']-ll)).argmin() for ll in lev]
+	Csub = dict()
+	Csub['hyam'] = C['hyam'][k]
+	Csub['hybm'] = C['hybm'][k]
+	Csub['P0'] = C['P0']
+	Csub['lev'] = C['lev'][k]
+	return Csub
+
+def bootstrapci_from_anomalies(E,P=95,nsamples=1000,hostname='taurus',debug=False,seed=None,nprocs=1):
 
 	"""
 	Given some DART experiment dictionary, retrieve anomalies with respect 
@@ -2298,9 +2950,14 @@ def bootstrapci_from_anomalies(E,P=95,nsamples=1000,hostname='taurus',debug=Fals
 	INPUTS:  
 	E: a standard DART experiment dictionary 
 	P: the percentage where we want the confidence interval  - default is 95
-	nsamples: the number of samples for the boostrap algorithm - default is 10000
+	nsamples: the number of samples for the boostrap algorithm - default is 1000
+	seed: integer seed for the resampling -- the same seed gives the same result (see DART.bootstrap_mean_ci)
+	nprocs: number of processes for loading the anomalies and for the bootstrap 
 
+	Returns the dictionary of ensemble mean and confidence intervals from DART.bootstrap_mean_ci, and 
+	the significance mask 
 	"""
+	import MJO as mjo
 
 	# look up the ensemble size for this experiment
 	N = es.get_ensemble_size_per_run(E['exp_name'])
@@ -2308,33 +2965,27 @@ def bootstrapci_from_anomalies(E,P=95,nsamples=1000,hostname='taurus',debug=Fals
 	# extract the climatology option for the anomalies from the diagnostic
 	climatology_option = E['diagn'].split('.')[1]
 	
-	# loop over the entire ensemble, compute the anomalies with respect to
-	# the desired climatology, and append to a list  
-	Alist = []
-	for iens in range(N):
-	    E['copystring'] = 'ensemble member '+str(iens+1)
-	    AA,Xclim,lat,lon,lev,new_daterange = mjo.ano(E,climatology_option)
-	    Alist.append(AA)
-
-	# turn the arrays in the list into a matrix
-	Amatrix = np.concatenate([A[np.newaxis,...] for A in Alist], axis=0)
-
-	# now apply bootstrap.
-	# note that this function applies np.mean over the first dimension, which we made the ensemble
-	CI = bs.bootstrap(Amatrix,nsamples,np.mean,P)
+	# compute the anomalies of the entire ensemble with respect to the desired climatology 
+	# in one pass -- this gives a matrix with the ensemble as the first dimension 
+	copystrings = ['ensemble member '+str(iens+1) for iens in range(N)]
+	D = mjo.ano_pipeline(E,climatology_option,copystrings,hostname=hostname,verbose=debug,nprocs=nprocs)
+	if D is None:
+		return None,None
+	E['daterange'] = D['daterange']
+	Amatrix = D['anomalies']
+
+	# now apply bootstrap over the first dimension, which we made the ensemble
+	CI = dart.bootstrap_mean_ci(Amatrix,nsamples,P,axis=0,seed=seed,nprocs=nprocs)
 	
 	# we can also make a mask for statistical significance. 
 	# anomalies where the confidence interval includes zero are not considered statistically significant at the P% level. 
 	# we can tell where the CI crosses zero by there the lower and upper bounds have opposite signs, which means that 
 	# their product will be negative
-	L = CI.lower
-	U = CI.upper
-	LU = L*U
-	sig = LU > 0
+	sig = CI['sig']
 
 	return CI,sig
 
-def DART_diagn_to_array(E,hostname='taurus',debug=False,return_single_variables=False):
+def DART_diagn_to_array(E,hostname='taurus',debug=False,return_single_variables=False,preallocate=False,nprocs=1,memmap_dir=None,cache=True,reduce=None):
 
 	"""
 	This subroutine loops over the dates given in E['daterange'] and load the appropriate DART diagnostic for each date, 
@@ -2356,6 +3007,36 @@ def DART_diagn_to_array(E,hostname='taurus',debug=False,return_single_variables=
 	spacial dimension arrays (e.g. lat, lon, lev), units, and long name. 
 	To get  these as single variables, set the input parameter return_single_variables to True. This will be 
 	deprecated eventually when all other visualization codes are changed to deal with single variables.  
+
+	For long time series of 3d fields, the following inputs help to save memory and time: 
+	preallocate: if True, the first date that can be loaded is used to find the shape and type of the fields, 
+		the output array is allocated once, and each date is written into its time slice. 
+		Dates that can't be loaded are not dropped: their time slices are filled with NaNs, and 
+		they are marked in Dout['missing'], a boolean array with one entry per date. 
+		Default is False, i.e. load all the dates into a list and stack them up at the end 
+		(which briefly needs twice the memory) and drop the missing dates. 
+	nprocs: number of processes that load dates at the same time (this implies preallocate=True). Default is 1. 
+	memmap_dir: if this is a directory (ideally on local scratch disk), the preallocated output array is 
+		a numpy memmap in a temporary file in that directory, rather than held in memory. 
+		The file is unlinked right away, so its disk space is freed when the array is deleted. 
+		(On systems where open files can't be unlinked, the file is left for the caller to delete, and its 
+		name is given in Dout['memmap_file'].) Default is None. 
+
+	cache: if True (the default), results for regular DART diagnostic files are kept in an on-disk cache, 
+		so that plotting the same experiment dictionary again doesn't re-read all the files. 
+		The cache is keyed by the relevant entries of E and the modification times of the files, 
+		so changing either one gives a fresh result. Set to False to bypass the cache. 
+		See diagn_cache_key. 
+
+	reduce: a list of named reductions that are applied to each date as soon as it is read, so that only 
+		the reduced fields pile up in memory (see DART_diagn_to_array_reduced). Default is None (no reductions). 
+		The options are: 
+		'area_mean': the average over latitude and longitude, weighted by cos(latitude)
+		'meridional_mean': the average over latitude, weighted by cos(latitude) 
+		'zonal_mean': the average over longitude 
+		'lev_mean': the average over vertical levels 
+		'time_mean' and 'time_variance': the mean and variance (N-1 in the denominator) over all dates
+		The output dictionary then also has an entry 'dims', which names the dimensions of the output array. 
 	"""
 	import pprint
 
@@ -2396,90 +3077,37 @@ def DART_diagn_to_array(E,hostname='taurus',debug=False,return_single_variables=
 		#TODO: make this return a dict
 
 	# ------data types that loop over date ranges  
-	Vlist = []
 
-	for date in DR:
-
-		# ERA-40 and ERA-Interim data 
-		if FT is 'ERA':
-			if (E['variable'] == 'Nsq'):
-				# ERA buoyancy frequency can be calculated with the Nsq function 
-				V,lat,lon,lev = Nsq_from_3d(E,date,hostname=hostname,debug=debug)
-			if 'V' not in locals():
-				# all other variables are loaded via a function in the ERA module:
-				import ERA as era
-				import re
-				resol = float(re.sub('\ERA', '',E['exp_name']))
-				V,lat,lon,lev,dum = era.load_ERA_file(E,date,resol=resol,hostname=hostname,verbose=debug)
-
-		# regular DART diagnostic files (these usually have names like 'Posterior_diagn_XXXX.nc')	
-		if FT is 'DART':
-			try:
-				DD = dart.load_DART_diagnostic_file(E,date,hostname=hostname,debug=debug)
-				V = DD['data']
-			except RuntimeError:
-				error_msg_DART_diagn_to_array(FT,E)
-				V = None
+	# reduce each date as it comes in 
+	if reduce is not None:
+		return DART_diagn_to_array_reduced(E,DR,FT,reduce,hostname,debug,return_single_variables,nprocs)
+
+	# look for the result in the cache of earlier calls, and if it's not there, compute it and store it 
+	if cache and (memmap_dir is None):
+		cache_key = diagn_cache_key(E,DR,FT,hostname,preallocated=(preallocate or (nprocs > 1)))
+		if cache_key is not None:
+			DD = diagn_cache_load(cache_key,hostname,debug)
+			if DD is None:
+				DD = DART_diagn_to_array(E,hostname,debug,False,preallocate,nprocs,memmap_dir,cache=False)
+				if (type(DD) is not dict) or (DD['data'] is None):
+					# nothing was found 
+					if return_single_variables:
+						return None,None,None,None,None
+					else:
+						return DD
+				diagn_cache_store(cache_key,DD,hostname,debug)
+			if return_single_variables:
+				return DD['data'],DD['lat'],DD['lon'],DD['lev'],DD['daterange']
+			else:
+				return DD
 
-		# Wuke Wang TEM diagnostics  
-		if FT == 'WANG-TEM':
-			try:
-				DD = compute_DART_diagn_from_Wang_TEM_files(E,date,hostname=hostname,debug=debug)
-				lon = None
-				V = DD['data']
-			except RuntimeError:
-				error_msg_DART_diagn_to_array(FT,E)
-				V = None
+	# preallocate the output array and fill it date by date 
+	if preallocate or (nprocs > 1) or (memmap_dir is not None):
+		return DART_diagn_to_array_preallocated(E,DR,FT,hostname,debug,return_single_variables,nprocs,memmap_dir)
 
-		# Covariances and correlations 
-		if FT is 'COVAR':
-			try:
-				lev,lat,lon,Cov,Corr = dart.load_covariance_file(E,date,hostname,debug=debug)
-				if E['diagn'].lower() == 'covariance':
-					V = Cov
-				if E['diagn'].lower() == 'correlation':
-					V = Corr
-			except RuntimeError:
-				error_msg_DART_diagn_to_array(FT,E)
-				V = None
-
-				
-		# other obscure calculations: 	
-		if FT is 'SPECIAL':
-			# buoyancy frequency forcing due to residual circulation 
-			if (E['variable'] == 'Nsq_wstar_forcing') or (E['variable'] == 'Nsq_vstar_forcing'):
-				import TIL as til
-				DD = til.Nsq_forcing_from_RC(E,date,hostname=hostname,debug=debug)
-				lon = None
-				V = DD['data']
-			# similar buoyancy frequency forcing from diabaitcc heating 
-			if 'Nsq_forcing_' in E['variable']: 
-				import TIL as til
-				DD = til.Nsq_forcing_from_Q(E,date,hostname=hostname,debug=debug)
-				lon = None
-				V = DD['data']
-
-			# it might be that pressure needs to be recreated from the hybrid model levels 
-			# Note that it is easier and faster
-			#  to just compute pressure in the format of DART diagnostic files and then read those in. 
-			if E['variable'] == 'P':
-				V,lat,lon,lev = P_from_hybrid_levels(E,date,hostname=hostname,debug=debug)
-
-			# buoyancy frequency 
-			if E['variable'] == 'Nsq':
-				V,lat,lon,lev = Nsq(E,date,hostname=hostname,debug=debug)
-
-
-		if FT is 'WACCM':
-
-				# for WACCM and CAM runs, if we requested US or VS, have to change these to U and V, 
-				# because that's what's in the WACCM output 
-				if E['variable'] is 'US':
-					E['variable'] = 'U'
-				if E['variable'] is 'VS':
-					E['variable'] = 'V'
-				DD = compute_DART_diagn_from_model_h_files(E,date,hostname=hostname,verbose=debug)
-				V = DD['data']
+	Vlist = []
+	for date in DR:
+		V,DD,lat,lon,lev = load_DART_diagn_for_date(E,date,FT,hostname,debug)
 
 		# add the variable field just loaded to the list:
 		Vlist.append(V)
@@ -2517,6 +3145,517 @@ def DART_diagn_to_array(E,hostname='taurus',debug=False,return_single_variables=
 		DD['daterange']=new_daterange
 		return DD
 
+def diagn_cache_key(E,DR,FT='DART',hostname='taurus',preallocated=False):
+
+	"""
+	Compute the key under which the output of DART_diagn_to_array is cached: a hash of 
+	the entries of the experiment dictionary E that determine the output, the dates in DR, and 
+	the modification times of the files that experiment_settings.find_paths finds for these dates 
+	(including the truth files, if E['extras'] is 'MSE'). 
+	The preallocated mode of DART_diagn_to_array keeps missing dates (as NaNs) where the default mode 
+	drops them, so the two modes are cached separately -- set preallocated to True for the former. 
+
+	Only regular DART diagnostic files (FT='DART') are cached. For everything else, and for 
+	random samples of the ensemble, this returns None. 
+	"""
+	import hashlib
+
+	if FT != 'DART':
+		return None
+	if 'ensemble sample' in str(E['copystring']):
+		return None
+
+	relevant_keys = ['exp_name','diagn','copystring','variable','levrange','latrange','lonrange','file_type','extras','extrastring','run_category']
+	items = [(k,repr(E.get(k))) for k in relevant_keys]
+	items.append(('daterange',repr(list(DR))))
+	items.append(('preallocated',repr(bool(preallocated))))
+
+	# modification times of the files for each date -- the mean square error also reads the truth files 
+	file_types = [('diag',E)]
+	if E.get('extras') == 'MSE':
+		Etr = E.copy()
+		Etr['diagn'] = 'Truth'
+		file_types.append(('truth',Etr))
+	for date in DR:
+		for file_type,Ef in file_types:
+			filename = es.find_paths(Ef.copy(),date,file_type,hostname=hostname)
+			if (filename is not None) and os.path.exists(filename):
+				items.append((filename,repr(os.path.getmtime(filename))))
+			else:
+				items.append((repr(date),file_type,'missing'))
+
+	return hashlib.sha1(repr(items).encode('utf-8')).hexdigest()
+
+def diagn_cache_load(key,hostname='taurus',debug=False):
+
+	"""
+	Load a DART_diagn_to_array result from the cache. Returns None if it isn't cached. 
+	"""
+
+	cache_file = os.path.join(es.cache_paths(hostname,'DART_diagn_to_array'),key+'.npz')
+	if not os.path.exists(cache_file):
+		return None
+	if debug:
+		print('loading cached result '+cache_file)
+
+	npz = np.load(cache_file)
+	DD = dict()
+	for k in npz.files:
+		if k.startswith('none__'):
+			DD[k.replace('none__','',1)] = None
+		elif (k != 'mask') and (npz[k].ndim == 0):
+			DD[k] = npz[k].item()
+		elif k != 'mask':
+			DD[k] = npz[k]
+	if 'mask' in npz.files:
+		DD['data'] = np.ma.array(DD['data'],mask=npz['mask'])
+	DD['daterange'] = list(DD['daterange'].astype(datetime.datetime))
+	npz.close()
+
+	# mark the file as recently used 
+	os.utime(cache_file,None)
+
+	return DD
+
+def diagn_cache_store(key,DD,hostname='taurus',debug=False):
+
+	"""
+	Store the dictionary DD returned by DART_diagn_to_array in the cache, as a compressed numpy file. 
+	If the cache is now bigger than diagn_cache_max_bytes, the least recently used files are removed. 
+	"""
+
+	cache_dir = es.cache_paths(hostname,'DART_diagn_to_array')
+	cache_file = os.path.join(cache_dir,key+'.npz')
+
+	arrays = dict()
+	for k,v in DD.items():
+		if v is None:
+			arrays['none__'+k] = np.zeros(0)
+		elif k == 'data':
+			arrays['data'] = np.ma.getdata(v)
+			if isinstance(v,np.ma.MaskedArray):
+				arrays['mask'] = np.ma.getmaskarray(v)
+		elif k == 'daterange':
+			arrays['daterange'] = np.array(v,dtype='datetime64[s]')
+		else:
+			arrays[k] = np.ma.getdata(v)
+
+	# write to a temporary file and rename it, so that nobody reads a half-written file 
+	# (the temporary file doesn't end in .npz, so that other processes don't evict it while it's written) 
+	tmp_file = cache_file+'.tmp'+str(os.getpid())
+	with open(tmp_file,'wb') as fh:
+		np.savez_compressed(fh,**arrays)
+	os.rename(tmp_file,cache_file)
+	if debug:
+		print('cached result in '+cache_file)
+
+	# evict the least recently used files if the cache is too big 
+	files = [os.path.join(cache_dir,ff) for ff in os.listdir(cache_dir) if ff.endswith('.npz')]
+	files.sort(key=os.path.getmtime)
+	total = sum([os.path.getsize(ff) for ff in files])
+	for ff in files:
+		if total <= diagn_cache_max_bytes:
+			break
+		if ff == cache_file:
+			continue
+		total -= os.path.getsize(ff)
+		try:
+			os.remove(ff)
+		except OSError:
+			# another process might have removed it already  
+			pass
+
+def load_DART_diagn_for_date(E,date,FT='DART',hostname='taurus',debug=False):
+
+	"""
+	Load the DART diagnostic (or model output, reanalysis, etc.) given by the experiment dictionary E 
+	for a single date, from the file type FT. This is what DART_diagn_to_array does for each date. 
+
+	Returns the field V (None if it can't be loaded), the dictionary returned by the loader (if any), 
+	and the lat, lon, and lev arrays (if the loader returns them separately).  
+	"""
+
+	V = None
+	DD = dict()
+	lat = None
+	lon = None
+	lev = None
+
+	# ERA-40 and ERA-Interim data 
+	if FT == 'ERA':
+		if (E['variable'] == 'Nsq'):
+			# ERA buoyancy frequency can be calculated with the Nsq function 
+			V,lat,lon,lev = Nsq_from_3d(E,date,hostname=hostname,debug=debug)
+		if V is None:
+			# all other variables are loaded via a function in the ERA module:
+			import ERA as era
+			import re
+			resol = float(re.sub('\ERA', '',E['exp_name']))
+			V,lat,lon,lev,dum = era.load_ERA_file(E,date,resol=resol,hostname=hostname,verbose=debug)
+
+	# regular DART diagnostic files (these usually have names like 'Posterior_diagn_XXXX.nc')	
+	if FT == 'DART':
+		try:
+			DD = dart.load_DART_diagnostic_file(E,date,hostname=hostname,debug=debug)
+			V = DD['data']
+		except RuntimeError:
+			error_msg_DART_diagn_to_array(FT,E)
+			V = None
+
+	# Wuke Wang TEM diagnostics  
+	if FT == 'WANG-TEM':
+		try:
+			DD = compute_DART_diagn_from_Wang_TEM_files(E,date,hostname=hostname,debug=debug)
+			lon = None
+			V = DD['data']
+		except RuntimeError:
+			error_msg_DART_diagn_to_array(FT,E)
+			V = None
+
+	# Covariances and correlations 
+	if FT == 'COVAR':
+		try:
+			lev,lat,lon,Cov,Corr = dart.load_covariance_file(E,date,hostname,debug=debug)
+			if E['diagn'].lower() == 'covariance':
+				V = Cov
+			if E['diagn'].lower() == 'correlation':
+				V = Corr
+		except RuntimeError:
+			error_msg_DART_diagn_to_array(FT,E)
+			V = None
+
+			
+	# other obscure calculations: 	
+	if FT == 'SPECIAL':
+		# buoyancy frequency forcing due to residual circulation 
+		if (E['variable'] == 'Nsq_wstar_forcing') or (E['variable'] == 'Nsq_vstar_forcing'):
+			import TIL as til
+			DD = til.Nsq_forcing_from_RC(E,date,hostname=hostname,debug=debug)
+			lon = None
+			V = DD['data']
+		# similar buoyancy frequency forcing from diabaitcc heating 
+		if 'Nsq_forcing_' in E['variable']: 
+			import TIL as til
+			DD = til.Nsq_forcing_from_Q(E,date,hostname=hostname,debug=debug)
+			lon = None
+			V = DD['data']
+
+		# it might be that pressure needs to be recreated from the hybrid model levels 
+		# Note that it is easier and faster
+		#  to just compute pressure in the format of DART diagnostic files and then read those in. 
+		if E['variable'] == 'P':
+			V,lat,lon,lev = P_from_hybrid_levels(E,date,hostname=hostname,debug=debug)
+
+		# buoyancy frequency 
+		if E['variable'] == 'Nsq':
+			V,lat,lon,lev = Nsq_from_3d(E,date,hostname=hostname,debug=debug)
+
+
+	if FT == 'WACCM':
+
+			# for WACCM and CAM runs, if we requested US or VS, have to change these to U and V, 
+			# because that's what's in the WACCM output 
+			if E['variable'] == 'US':
+				E['variable'] = 'U'
+			if E['variable'] == 'VS':
+				E['variable'] = 'V'
+			DD = compute_DART_diagn_from_model_h_files(E,date,hostname=hostname,verbose=debug)
+			V = DD['data']
+
+	return V,DD,lat,lon,lev
+
+def load_DART_diagn_for_date_worker(args):
+
+	"""
+	unpacks a tuple of arguments, passes them to load_DART_diagn_for_date, and returns only the field -- 
+	this is how the dates are distributed over a pool of processes in DART_diagn_to_array_preallocated. 
+	"""
+	E,date,FT,hostname,debug = args
+	V,DD,lat,lon,lev = load_DART_diagn_for_date(E,date,FT,hostname,debug)
+	if V is not None:
+		V = np.ma.getdata(V)
+	return V
+
+def DART_diagn_to_array_preallocated(E,DR,FT='DART',hostname='taurus',debug=False,return_single_variables=False,nprocs=1,memmap_dir=None):
+
+	"""
+	This does the same as DART_diagn_to_array for the dates in the list DR, but 
+	instead of collecting the fields in a list and stacking them up, it finds the shape of the 
+	fields from the first date that can be loaded, allocates the output array 
+	(in memory, or as a memmap in a temporary file in memmap_dir), and writes each date into its time slice. 
+	The dates can be spread over nprocs processes. 
+
+	Dates that can't be loaded are kept: their slices are filled with NaNs and they are marked as 
+	True in the array Dout['missing']. If no date can be loaded, Dout['data'] is None. 
+	"""
+
+	# load dates until we get one, to find out the shape and type of the fields 
+	T = len(DR)
+	missing = np.zeros(T,dtype=bool)
+	for it,date in enumerate(DR):
+		V0,DD,lat,lon,lev = load_DART_diagn_for_date(E,date,FT,hostname,debug)
+		if V0 is not None:
+			break
+		missing[it] = True
+	if V0 is None:
+		d1 = DR[0].strftime("%Y-%m-%d")
+		d2 = DR[T-1].strftime("%Y-%m-%d")
+		print('Could not find any data for experiment '+E['exp_name']+' and variable '+E['variable']+' between dates '+d1+' and '+d2)
+		if return_single_variables:
+			return None,None,None,None,None
+		else:
+			return {'data':None,'lat':None,'lon':None,'lev':None,'daterange':DR,'missing':missing}
+	it0 = it
+
+	# allocate the output 
+	V0 = np.ma.getdata(V0)
+	shape = V0.shape+(T,)
+	dtype = np.result_type(V0.dtype,np.float32)
+	if memmap_dir is not None:
+		import tempfile
+		fd,mmfile = tempfile.mkstemp(suffix='.dat',prefix='DART_diagn_',dir=memmap_dir)
+		os.close(fd)
+		if debug:
+			print('writing the output array to memmap file '+mmfile)
+		Vmatrix = np.memmap(mmfile,dtype=dtype,mode='w+',shape=shape)
+		# the array stays mapped after the file is unlinked, and the disk space is given 
+		# back when the array goes away -- where that isn't possible, the caller gets the file name 
+		try:
+			os.remove(mmfile)
+			mmfile = None
+		except OSError:
+			pass
+	else:
+		mmfile = None
+		Vmatrix = np.empty(shape,dtype=dtype)
+	Vmatrix[...,:it0] = np.nan
+	Vmatrix[...,it0] = V0
+	del V0
+
+	# now fill in the remaining dates, either one by one or from a pool of processes 
+	arglist = [(E,date,FT,hostname,debug) for date in DR[it0+1:]]
+	if nprocs > 1:
+		import multiprocessing
+		pool = multiprocessing.Pool(processes=nprocs)
+		results = pool.imap(load_DART_diagn_for_date_worker,arglist)
+	else:
+		pool = None
+		results = (load_DART_diagn_for_date_worker(args) for args in arglist)
+	try:
+		for it,V in zip(range(it0+1,T),results):
+			if V is None:
+				Vmatrix[...,it] = np.nan
+				missing[it] = True
+			else:
+				Vmatrix[...,it] = V
+	except:
+		# don't wait for the rest of the dates if something went wrong 
+		if pool is not None:
+			pool.terminate()
+		raise
+	if pool is not None:
+		pool.close()
+		pool.join()
+
+	# make sure we transfer fill values if they exist (without copying the whole array)  
+	if 'FillValue' in DD:
+		Vmatrix = np.ma.masked_values(Vmatrix,DD['FillValue'],copy=False)
+
+	if return_single_variables:
+		return Vmatrix,lat,lon,lev,DR
+	else:
+		DD['data']=Vmatrix
+		DD['daterange']=DR
+		DD['missing']=missing
+		if mmfile is not None:
+			DD['memmap_file']=mmfile
+		return DD
+
+def DART_diagn_to_array_reduced(E,DR,FT='DART',reduce=['area_mean'],hostname='taurus',debug=False,return_single_variables=False,nprocs=1):
+
+	"""
+	This does the same as DART_diagn_to_array for the dates in the list DR, but applies the list of 
+	named reductions in `reduce` (see DART_diagn_to_array) to each date as soon as it is loaded. 
+	The spatial reductions are done in the order given. If 'time_mean' or 'time_variance' is 
+	requested, the reduced fields are folded into running moments (see DART.ensemble_moments), so 
+	that nothing with a time dimension is ever held in memory -- otherwise the reduced fields are 
+	stacked along a last, time, dimension. 
+	The dates can be spread over nprocs processes. 
+
+	The dimensions of each field are identified by name rather than by their lengths 
+	(see field_dimension_names), and the output dictionary holds their names under 'dims'. 
+	The coordinates of dimensions that were averaged out are set to None. 
+	If both 'time_mean' and 'time_variance' are requested, 'data' holds the mean and 
+	'variance' holds the variance. The number of dates that went into each point is under 'n'. 
+	"""
+
+	time_reductions = [r for r in reduce if r in ['time_mean','time_variance']]
+	space_reductions = [r for r in reduce if r not in time_reductions]
+
+	arglist = [(E,date,FT,space_reductions,hostname,debug) for date in DR]
+	if nprocs > 1:
+		import multiprocessing
+		pool = multiprocessing.Pool(processes=nprocs)
+		results = pool.imap(load_reduced_DART_diagn_for_date_worker,arglist)
+	else:
+		pool = None
+		results = (load_reduced_DART_diagn_for_date_worker(args) for args in arglist)
+
+	Vlist = []
+	new_daterange = []
+	M = None
+	Dout = None
+	for date,R in zip(DR,results):
+		if R is None:
+			continue
+		V,DD = R
+		new_daterange.append(date)
+		if Dout is None:
+			Dout = DD
+		if len(time_reductions) > 0:
+			M = dart.ensemble_moments(V[np.newaxis,...],axis=0,M=M)
+		else:
+			Vlist.append(V)
+	if pool is not None:
+		pool.close()
+		pool.join()
+
+	if Dout is None:
+		d1 = DR[0].strftime("%Y-%m-%d")
+		d2 = DR[len(DR)-1].strftime("%Y-%m-%d")
+		print('Could not find any data for experiment '+E['exp_name']+' and variable '+E['variable']+' between dates '+d1+' and '+d2)
+		return None,None,None,None,None
+
+	if len(time_reductions) > 0:
+		missing = (M['n'] == 0)
+		mean = np.ma.array(M['mean'],mask=missing)
+		variance = np.ma.masked_invalid(np.ma.array(M['variance'],mask=missing))
+		if 'time_mean' in time_reductions:
+			Dout['data'] = mean
+			if 'time_variance' in time_reductions:
+				Dout['variance'] = variance
+		else:
+			Dout['data'] = variance
+		Dout['n'] = M['n']
+	else:
+		Dout['data'] = np.ma.concatenate([V[...,np.newaxis] for V in Vlist],axis=Vlist[0].ndim)
+		Dout['dims'] = Dout['dims']+['time']
+	Dout['daterange'] = new_daterange
+
+	if return_single_variables:
+		return Dout['data'],Dout['lat'],Dout['lon'],Dout['lev'],new_daterange
+	else:
+		return Dout
+
+def load_reduced_DART_diagn_for_date_worker(args):
+
+	"""
+	load the field for one date (see load_DART_diagn_for_date), name its dimensions, and apply a list of 
+	spatial reductions to it. Returns the reduced field and a dictionary with its dimension names and 
+	coordinates, or None if the date can't be loaded. 
+	"""
+	E,date,FT,reductions,hostname,debug = args
+	V,DD,lat,lon,lev = load_DART_diagn_for_date(E,date,FT,hostname,debug)
+	if V is None:
+		return None
+
+	# the loaders return the coordinates either separately or in the dictionary 
+	Dout = dict()
+	for k in ['units','long_name']:
+		if k in DD:
+			Dout[k] = DD[k]
+	Dout['lat'] = lat if lat is not None else DD.get('lat')
+	Dout['lon'] = lon if lon is not None else DD.get('lon')
+	Dout['lev'] = lev if lev is not None else DD.get('lev')
+	Dout['dims'] = field_dimension_names(V,FT,Dout['lat'],Dout['lon'],Dout['lev'])
+
+	V = np.ma.masked_invalid(V)
+	for reduction in reductions:
+		V = reduce_named_dimensions(V,Dout,reduction)
+
+	return V,Dout
+
+def field_dimension_names(V,FT,lat,lon,lev):
+
+	"""
+	return a list with the names of the dimensions of a field V loaded for a single date from file type FT: 
+	'lat', 'lon', 'lev', and 'copy' for everything else (ensemble members, or a singleton time dimension). 
+	
+	For file types where the order of the dimensions is known -- DART diagnostic files 
+	and covariances are [copy x] lat x lon [x lev], ERA and WACCM files are [time x] [lev x] lat x lon -- 
+	the dimensions are named by their position. Otherwise the dimensions are found by matching 
+	the lengths of the coordinate arrays, and if that is ambiguous (e.g. as many levels as latitudes), 
+	a RuntimeError is raised. 
+	"""
+
+	coords = {'lat':lat,'lon':lon,'lev':lev}
+	if FT in ['DART','COVAR']:
+		order = ['lat','lon','lev']
+	elif FT in ['ERA','WACCM']:
+		order = ['lev','lat','lon']
+	else:
+		order = []
+	order = [d for d in order if coords[d] is not None]
+
+	names = ['copy']*V.ndim
+	nd = len(order)
+	if (nd > 0) and (V.ndim >= nd) and all([V.shape[V.ndim-nd+ii] == len(coords[d]) for ii,d in enumerate(order)]):
+		names[V.ndim-nd:] = order
+		return names
+
+	# otherwise match the coordinate lengths 
+	for d in ['lat','lon','lev']:
+		if coords[d] is None:
+			continue
+		matches = [ii for ii,n in enumerate(V.shape) if (n == len(coords[d])) and (names[ii] == 'copy')]
+		if len(matches) > 1:
+			raise RuntimeError('field_dimension_names: cannot tell which dimension of an array shaped '+str(V.shape)+' is '+d)
+		if len(matches) == 1:
+			names[matches[0]] = d
+	return names
+
+def reduce_named_dimensions(V,D,reduction):
+
+	"""
+	apply one named reduction (see DART_diagn_to_array) to the array V, whose dimension names and 
+	coordinates are given in the dictionary D (under 'dims', 'lat', 'lon', and 'lev'). 
+	D is updated to describe the reduced array, which is returned. 
+	"""
+	dims = D['dims']
+	if reduction == 'area_mean':
+		reduced = ['lat','lon']
+	elif reduction == 'meridional_mean':
+		reduced = ['lat']
+	elif reduction == 'zonal_mean':
+		reduced = ['lon']
+	elif reduction == 'lev_mean':
+		reduced = ['lev']
+	else:
+		raise ValueError('reduce_named_dimensions: unknown reduction '+str(reduction))
+
+	reduced = [d for d in reduced if d in dims]
+	if len(reduced) == 0:
+		return V
+	axes = tuple([dims.index(d) for d in reduced])
+
+	# weights: cos(latitude) for averages over latitude, otherwise uniform 
+	W = np.ones([1]*V.ndim)
+	if 'lat' in reduced:
+		shape = [1]*V.ndim
+		shape[dims.index('lat')] = len(D['lat'])
+		W = np.reshape(np.cos(np.deg2rad(np.asarray(D['lat'],dtype=np.float64))),shape)
+	valid = ~np.ma.getmaskarray(V)
+	wsum = np.sum(W*valid,axis=axes)
+	with np.errstate(divide='ignore',invalid='ignore'):
+		Vr = np.sum(np.where(valid,np.ma.getdata(V),0.0)*W,axis=axes)/wsum
+	Vr = np.ma.array(Vr,mask=(wsum == 0))
+
+	for d in reduced:
+		D[d] = None
+	D['dims'] = [d for d in dims if d not in reduced]
+
+	return Vr
+
 def error_msg_DART_diagn_to_array(FT,E):
 
 	"""
@@ -2555,9 +3694,22 @@ def plot_diagnostic_profiles(E=dart.basic_experiment_dict(),Ediff=None,color="#0
 		to appear when you do plt.legend(). The default is True; set this to False to ignore certain profiles 
 		(e.g. individual ensemble members) in the legend. 
 	debug: set to True to print out extra output 
+
+	This is compute_diagnostic_profiles followed by render_diagnostic_profiles.
 	"""
-	daterange = E['daterange']
 
+	P = compute_diagnostic_profiles(E,Ediff,scaling_factor,vertical_coord,hostname,debug)
+	if P is None:
+		return
+	return render_diagnostic_profiles(P,E,Ediff,color,linestyle,linewidth,alpha,vertical_coord,label_for_legend,debug)
+
+def compute_diagnostic_profiles(E=dart.basic_experiment_dict(),Ediff=None,scaling_factor=1.0,vertical_coord='log_levels',hostname='taurus',debug=False):
+
+	"""
+	load the data for plot_diagnostic_profiles and average them over time, latitude, and longitude. 
+	Returns a dictionary holding the profile(s) ('data'), the vertical coordinate ('y') and its label ('ylabel'), 
+	and the long name and units of the variable, or None if the variable is two dimensional. 
+	"""
 	# throw an error if the desired variable is 2 dimensional 
 	if (E['variable'] == 'PS') or (E['variable'] == 'FLUT'):
 		print('Attempting to plot a two dimensional variable ('+E['variable']+') over level and latitude - need to pick a different variable!')
@@ -2584,13 +3736,6 @@ def plot_diagnostic_profiles(E=dart.basic_experiment_dict(),Ediff=None,color="#0
 			else:
 				meantrop=vcoord_string[1]
 			D=to_TPbased(E,D,meantrop=meantrop,hostname=hostname,debug=debug)
-		#else:
-		#	Vmain=D['data']
-		#	try:
-		#		lev=D['lev']
-		#	except KeyError:
-		#		print(D.keys())
-		#		return
 
 		if Ediff is not None:
 			Etempdiff=Ediff.copy()
@@ -2643,18 +3788,33 @@ def plot_diagnostic_profiles(E=dart.basic_experiment_dict(),Ediff=None,color="#0
 		y = H*np.log(p0/D['lev'])
 		ylabel = 'log-p height (km)'
 	if 'TPbased' in vertical_coord:
-		#from matplotlib import rcParams
-		#rcParams['text.usetex'] = True
 		y=D['lev']
 		ylabel='z (TP-based) (km)'
 
+	P = dict()
+	P['data'] = M
+	P['y'] = y
+	P['ylabel'] = ylabel
+	P['long_name'] = D.get('long_name','')
+	P['units'] = D.get('units','')
+	return P
+
+def render_diagnostic_profiles(P,E,Ediff=None,color="#000000",linestyle='-',linewidth = 2,alpha=1.0,vertical_coord='log_levels',label_for_legend=True,debug=False):
+
+	"""
+	draw the output of compute_diagnostic_profiles into the current axes -- see plot_diagnostic_profiles for the inputs.
+	"""
+	M = P['data']
+	y = P['y']
+	ylabel = P['ylabel']
+
         # plot the profile  - loop over copies if that dimension is there  
 	# from the way DART_diagn_to_array works, copy is always the 0th dimension  
 
 	if M.ndim == 2:
 		nC = M.shape[0]
 		for iC in range(nC):
-			if type(color) is 'list':
+			if type(color) is list:
 				color2 = color[iC]
 			else:
 				color2=color 
@@ -2669,11 +3829,7 @@ def plot_diagnostic_profiles(E=dart.basic_experiment_dict(),Ediff=None,color="#0
 	ax = plt.gca()
 	xlim = ax.get_xlim()[1]
 	ax.ticklabel_format(axis='x', style='sci', scilimits=(-2,2))
-	if not 'long_name' in D:
-		D['long_name']=''
-	if not 'units' in D:
-		D['units']=''
-	plt.xlabel(D['long_name']+' ('+D['units']+')')
+	plt.xlabel(P['long_name']+' ('+P['units']+')')
 
 	# y axis stuff 
 	plt.ylabel(ylabel)
@@ -2714,40 +3870,38 @@ def plot_diagnostic_lat(E=dart.basic_experiment_dict(),Ediff=None,color="#000000
 	colorbar_label: string with which to label the colorbar  
 	scaling_factor: factor by which to multiply the array to be plotted 
 	debug: set to True to get extra ouput
+
+	This is compute_diagnostic_lat followed by render_diagnostic_lat.
 	"""
 
-	# load the desired DART diagnostic for the desired variable and daterange:
-	VV,lat,lon,lev,new_daterange = DART_diagn_to_array(E,hostname=hostname,debug=debug)
+	P = compute_diagnostic_lat(E,Ediff,scaling_factor,hostname,debug)
+	if P is None:
+		return
+	return render_diagnostic_lat(P,E,Ediff,color,linestyle,linewidth,alpha,invert_yaxis,debug)
 
-	# load the difference array if desired  
-	if Ediff is not None:
-		Vdiff,lat,lon,lev,new_daterange = DART_diagn_to_array(Ediff,hostname=hostname,debug=debug)
-		Vmatrix = VV-Vmatrix
-	else:
-		Vmatrix = VV
-		
-	# average over time, longitude, and vertical levels  
-	V0 = average_over_named_dimension(Vmatrix,new_daterange)
-	if lon is not None:
-		V1 = average_over_named_dimension(V0,lon)
-	else:
-		V1 = V0
-	if lev is not None:
-		V2 = average_over_named_dimension(V1,lev)
-	else:
-		V2 = V1
+def compute_diagnostic_lat(E=dart.basic_experiment_dict(),Ediff=None,scaling_factor=1.0,hostname='taurus',debug=False):
 
-	# squeeze out any remaining length-1 dimensions and scale 
-	M = scaling_factor*np.squeeze(V2)
+	"""
+	load the data for plot_diagnostic_lat, averaging over longitude, vertical levels, and time as each date is read. 
+	Returns a dictionary holding the scaled latitude profile(s) ('data', preceded by the copies if there are several) 
+	and 'lat', or None if nothing was found. 
+	"""
+	M,D = reduced_diagnostic_difference(E,Ediff,None,['zonal_mean','lev_mean','time_mean'],hostname,debug)
+	if M is None:
+		return None
 
-	# transpose the array if necessary  
-	if len(M.shape)>1:
-		if M.shape[0]==len(lat):
-			MT = np.transpose(M)
-		else:
-			MT = M
-	else:
-		MT = M
+	P = dict()
+	P['data'] = scaling_factor*M
+	P['lat'] = D['lat']
+	return P
+
+def render_diagnostic_lat(P,E,Ediff=None,color="#000000",linestyle='-',linewidth = 2,alpha=1.0,invert_yaxis=False,debug=False):
+
+	"""
+	draw the output of compute_diagnostic_lat into the current axes -- see plot_diagnostic_lat for the inputs.
+	"""
+	MT = P['data']
+	lat = P['lat']
 
 	# if we are plotting multiple copies (e.g. the entire ensemble), need to loop over them  
 	# otherwise, the plot is simple
@@ -2786,43 +3940,38 @@ def plot_diagnostic_lon(E=dart.basic_experiment_dict(),Ediff=None,color="#000000
 	colorbar_label: string with which to label the colorbar  
 	scaling_factor: factor by which to multiply the array to be plotted 
 	debug: set to True to get extra ouput
+
+	This is compute_diagnostic_lon followed by render_diagnostic_lon.
 	"""
 
-	# load the desired DART diagnostic for the desired variable and daterange:
-	D = DART_diagn_to_array(E,hostname=hostname,debug=debug)
+	P = compute_diagnostic_lon(E,Ediff,scaling_factor,hostname,debug)
+	if P is None:
+		return
+	return render_diagnostic_lon(P,E,Ediff,color,linestyle,linewidth,alpha,invert_yaxis,debug)
 
-	# load the difference array if desired  
-	if Ediff is not None:
-		Dfiff = DART_diagn_to_array(Ediff,hostname=hostname,debug=debug)
-		Vmatrix = D['data']-Ddiff['data']
-	else:
-		Vmatrix = D['data']
-		
-	# average over time, latitude, and vertical levels  
-	lat = D['lat']
-	lev = D['lev']
-	lon = D['lon']
-	V0 = average_over_named_dimension(Vmatrix,D['daterange'])
-	if lat is not None:
-		V1 = average_over_named_dimension(V0,lat)
-	else:
-		V1 = V0
-	if lev is not None:
-		V2 = average_over_named_dimension(V1,lev)
-	else:
-		V2 = V1
+def compute_diagnostic_lon(E=dart.basic_experiment_dict(),Ediff=None,scaling_factor=1.0,hostname='taurus',debug=False):
 
-	# squeeze out any remaining length-1 dimensions and scale 
-	M = scaling_factor*np.squeeze(V2)
+	"""
+	load the data for plot_diagnostic_lon, averaging over latitude, vertical levels, and time as each date is read. 
+	Returns a dictionary holding the scaled longitude profile(s) ('data', preceded by the copies if there are several) 
+	and 'lon', or None if nothing was found. 
+	"""
+	M,D = reduced_diagnostic_difference(E,Ediff,None,['meridional_mean','lev_mean','time_mean'],hostname,debug)
+	if M is None:
+		return None
 
-	# transpose the array if necessary  
-	if len(M.shape)>1:
-		if M.shape[0]==len(lat):
-			MT = np.transpose(M)
-		else:
-			MT = M
-	else:
-		MT = M
+	P = dict()
+	P['data'] = scaling_factor*M
+	P['lon'] = D['lon']
+	return P
+
+def render_diagnostic_lon(P,E,Ediff=None,color="#000000",linestyle='-',linewidth = 2,alpha=1.0,invert_yaxis=False,debug=False):
+
+	"""
+	draw the output of compute_diagnostic_lon into the current axes -- see plot_diagnostic_lon for the inputs.
+	"""
+	MT = P['data']
+	lon = P['lon']
 
 	# if we are plotting multiple copies (e.g. the entire ensemble), need to loop over them  
 	# otherwise, the plot is simple
@@ -2834,7 +3983,7 @@ def plot_diagnostic_lon(E=dart.basic_experiment_dict(),Ediff=None,color="#000000
 		plt.plot(lon,MT,color=color,linestyle=linestyle,linewidth=linewidth,label=E['title'],alpha=alpha)
 
 	# axis labels 
-	plt.xlabel('Latitude')
+	plt.xlabel('Longitude')
 
 	# vertical axis adjustments if desired (e.g. if plotting tropopause height) 
 	if invert_yaxis:
@@ -2845,7 +3994,177 @@ def plot_diagnostic_lon(E=dart.basic_experiment_dict(),Ediff=None,color="#000000
 
 	return MT,lon
 
-def to_TPbased(E,D,meantrop='DJFmean',hostname='taurus',debug=False):
+def diagnostic_plot_types():
+
+	"""
+	return a dictionary that maps the names of the plot types that render_diagnostic_batch understands 
+	to their (compute, render) pairs of functions. 
+	"""
+	plot_types = dict()
+	plot_types['globe'] = (compute_diagnostic_globe,render_diagnostic_globe)
+	plot_types['hovmoeller'] = (compute_diagnostic_hovmoeller,render_diagnostic_hovmoeller)
+	plot_types['lev_time'] = (compute_diagnostic_lev_time,render_diagnostic_lev_time)
+	plot_types['lat_time'] = (compute_diagnostic_lat_time,render_diagnostic_lat_time)
+	plot_types['lon_time'] = (compute_diagnostic_lon_time,render_diagnostic_lon_time)
+	plot_types['global_ave'] = (compute_diagnostic_global_ave,render_diagnostic_global_ave)
+	plot_types['lev_lon'] = (compute_diagnostic_lev_lon,render_diagnostic_lev_lon)
+	plot_types['lev_lat'] = (compute_diagnostic_lev_lat,render_diagnostic_lev_lat)
+	plot_types['lev_lat_quiver'] = (compute_diagnostic_lev_lat_quiver,render_diagnostic_lev_lat_quiver)
+	plot_types['profiles'] = (compute_diagnostic_profiles,render_diagnostic_profiles)
+	plot_types['lat'] = (compute_diagnostic_lat,render_diagnostic_lat)
+	plot_types['lon'] = (compute_diagnostic_lon,render_diagnostic_lon)
+	return plot_types
+
+def render_diagnostic_batch(jobs,output_dir,nprocs=1,hostname='taurus',debug=False):
+
+	"""
+	Render a whole list of diagnostic figures to image files, without a display. 
+
+	Each job is a tuple (E, plot_type) or (E, plot_type, options), where E is an experiment dictionary, 
+	plot_type is one of the names in diagnostic_plot_types (e.g. 'lev_lat' for plot_diagnostic_lev_lat), 
+	and options is a dictionary that can hold these entries: 
+		'Ediff': the experiment dictionary of the difference experiment (default is None)
+		'compute': dictionary of extra inputs to the compute_diagnostic_XXX function (e.g. {'vertical_coord':'z'})
+		'render': dictionary of extra inputs to the render_diagnostic_XXX function (e.g. {'clim':10,'cbar':None})
+		'filename': name of the image file (default: made from the plot type and the entries of E -- see diagnostic_batch_filename)
+		'figsize': figure size in inches (default is the matplotlib default)
+
+	Jobs that only differ in their 'render' options share one computed product, so e.g. the same 
+	field drawn with several color limits is only loaded once. 
+	The products are computed and drawn in nprocs worker processes (default is 1, i.e. in this process), 
+	with the non-interactive Agg backend -- when drawing in this process, the backend is switched to Agg 
+	for the batch and back afterwards. 
+
+	Returns the list of files that were written, in the order of the jobs 
+	(None for jobs whose data could not be loaded). 
+	"""
+
+	# sort the jobs into groups that share the same computed product 
+	groups = []
+	group_index = dict()
+	filenames = []
+	for ii,job in enumerate(jobs):
+		E = job[0]
+		plot_type = job[1]
+		if len(job) > 2:
+			options = job[2]
+		else:
+			options = dict()
+		if plot_type not in diagnostic_plot_types():
+			raise ValueError('render_diagnostic_batch: unknown plot type '+str(plot_type))
+		Ediff = options.get('Ediff')
+		compute_options = options.get('compute',dict())
+
+		if 'filename' in options:
+			fname = options['filename']
+		else:
+			fname = diagnostic_batch_filename(E,plot_type,filenames)
+		filenames.append(fname)
+
+		key = repr((plot_type,sorted_items(E),sorted_items(Ediff),sorted_items(compute_options)))
+		if key not in group_index:
+			group_index[key] = len(groups)
+			groups.append((plot_type,E,Ediff,compute_options,[],hostname,debug))
+		render_job = (ii,options.get('render',dict()),os.path.join(output_dir,fname),options.get('figsize'))
+		groups[group_index[key]][4].append(render_job)
+
+	if not os.path.exists(output_dir):
+		os.makedirs(output_dir)
+
+	if nprocs > 1:
+		import multiprocessing
+		pool = multiprocessing.Pool(processes=nprocs,initializer=render_diagnostic_batch_init)
+		results = pool.imap_unordered(render_diagnostic_batch_worker,groups)
+		backend = None
+	else:
+		pool = None
+		# draw without a display here as well, and give the caller their backend back afterwards 
+		# (note that matplotlib closes all open figures when it switches backends) 
+		backend = plt.get_backend()
+		if backend.lower() == 'agg':
+			backend = None
+		else:
+			plt.switch_backend('Agg')
+		results = (render_diagnostic_batch_worker(group) for group in groups)
+
+	written = [None]*len(jobs)
+	try:
+		for R in results:
+			for ii,path in R:
+				written[ii] = path
+	finally:
+		if backend is not None:
+			plt.switch_backend(backend)
+	if pool is not None:
+		pool.close()
+		pool.join()
+
+	return written
+
+def render_diagnostic_batch_init():
+
+	"""
+	set up a worker process of render_diagnostic_batch to draw without a display 
+	"""
+	plt.switch_backend('Agg')
+
+def render_diagnostic_batch_worker(args):
+
+	"""
+	compute one product for render_diagnostic_batch and draw it into each of the requested files. 
+	Returns a list of (job index, file path) pairs, where the path is None if the data could not be loaded. 
+	"""
+	plot_type,E,Ediff,compute_options,render_jobs,hostname,debug = args
+	compute,render = diagnostic_plot_types()[plot_type]
+
+	P = compute(E,Ediff=Ediff,hostname=hostname,debug=debug,**compute_options)
+	if P is None:
+		print('render_diagnostic_batch: could not compute the '+plot_type+' plot for experiment '+E['exp_name'])
+		return [(ii,None) for ii,render_options,path,figsize in render_jobs]
+
+	written = []
+	for ii,render_options,path,figsize in render_jobs:
+		fig = plt.figure(figsize=figsize)
+		render(P,E,Ediff=Ediff,debug=debug,**render_options)
+		fig.savefig(path,bbox_inches='tight')
+		plt.close(fig)
+		if debug:
+			print('render_diagnostic_batch: wrote '+path)
+		written.append((ii,path))
+	return written
+
+def diagnostic_batch_filename(E,plot_type,taken=[]):
+
+	"""
+	make a default image file name for a plot of type plot_type for the experiment dictionary E, 
+	of the form plottype_experiment_variable_diagnostic_startdate.png. 
+	If that name is in the list `taken`, a number is added to it. 
+	"""
+	variable = E['variable']
+	if (type(variable) == tuple) or (type(variable) == list):
+		variable = '-'.join(variable)
+	parts = [plot_type,E['exp_name'],variable,E['diagn']]
+	if 'daterange' in E:
+		parts.append(E['daterange'][0].strftime('%Y%m%d'))
+	base = re.sub('[^A-Za-z0-9.+-]','_','_'.join(parts))
+
+	fname = base+'.png'
+	ii = 1
+	while fname in taken:
+		fname = base+'_'+str(ii)+'.png'
+		ii += 1
+	return fname
+
+def sorted_items(D):
+
+	"""
+	return the items of dictionary D (or None) sorted by key, so that the repr of equal dictionaries is the same. 
+	"""
+	if D is None:
+		return None
+	return sorted(D.items(),key=lambda kv: str(kv[0]))
+
+def to_TPbased(E,D,meantrop='DJFmean',hostname='taurus',debug=False,kind='cubic',levdim=None,chunk_axis=None,chunk_size=1):
 
 	"""
 	This routine takes some multi-dimensional variable field and a corresponding array for vertical levels, 
@@ -2853,13 +4172,11 @@ def to_TPbased(E,D,meantrop='DJFmean',hostname='taurus',debug=False):
 	the time-mean tropopause in that location, i.e. zt = z-ztrop-ztropmean 
 	(See [Birner 2006](http://www.agu.org/pubs/crossref/2006/2005JD006301.shtml))
 
-	After computing the TP-based height at each location, we run through all latitudes, 
-	longitudes, times, and copies, and interpolate the tropopause-based heights 
-	to a regular grid so that we can average. 
-	The `interp1d` function creates a functional relationship between the variable in 
-	Vmatrix and the TP-based coordinates, and the grid to which we interpolate has to be 
-	within the bounds of this function (i.e. the min and max values of TP-based altitude 
-	for each column).  -- Might have to play with this for your own data. 
+	After computing the TP-based height at each location, we interpolate all the columns 
+	(i.e. all latitudes, longitudes, times, and copies) at once onto a regular grid of 
+	tropopause-based heights, so that we can average (see DART.interpolate_columns). 
+	Points on the regular grid that are outside the min and max TP-based altitude 
+	of a column are masked.  -- Might have to play with this for your own data. 
  
 	INPUTS:
 	E: a DART experiment dictionary giving the details of the data that we are requesting 
@@ -2868,6 +4185,13 @@ def to_TPbased(E,D,meantrop='DJFmean',hostname='taurus',debug=False):
 	lev: a vector of vertical level pressures. These can be in Pascal or hPa. 
 	meantrop: a string denoting how we compute the mean tropopause. This has to also appear 
 		in the filename that holds mean tropopause height (default is 'DJFmean')
+	kind: 'cubic' (monotone cubic, the default) or 'linear' interpolation 
+	levdim: the dimension of the data matrix that holds the vertical levels -- the default (None) 
+		is to look it up in D['dims'] (see DART_diagn_to_array), and if that isn't there, to take the 
+		dimension that has the same length as the level array (a RuntimeError is raised if 
+		there is more than one) 
+	chunk_axis: if given, the interpolation is done chunk_size slices at a time along this dimension 
+		(e.g. copies or time), which saves memory for big ensembles 
 	"""
 
 	# given the data matrix, we have to retrieve several other things: 
@@ -2879,10 +4203,15 @@ def to_TPbased(E,D,meantrop='DJFmean',hostname='taurus',debug=False):
 	# stick those into a list to loop over 
 	Vmatrix = D['data']
 	lev = D['lev']
-
-	# Vmatrix should be a masked array, and to make sure interp1d doesn't mess with 
-	# the bad values, replace them with NaNs
-	Vmatrix = np.ma.fix_invalid(Vmatrix,fill_value=np.nan)
+	if levdim is None:
+		if ('dims' in D) and ('lev' in D['dims']):
+			levdim = D['dims'].index('lev')
+		else:
+			# as a last resort, find the dimension that has the same length as the level array 
+			matches = [ii for ii,n in enumerate(Vmatrix.shape) if n == len(lev)]
+			if len(matches) != 1:
+				raise RuntimeError('to_TPbased: cannot tell which dimension of an array shaped '+str(Vmatrix.shape)+' holds the levels -- please give levdim')
+			levdim = matches[0]
 
 	# tropopause height of the experiment 
 	Etrop=E.copy()
@@ -2921,7 +4250,7 @@ def to_TPbased(E,D,meantrop='DJFmean',hostname='taurus',debug=False):
 				VT = Dtemp['data']
 				Px = Dtemp['lev']		# these are the pressures at each level 
 				for idim,dimlength in enumerate(VT.shape):
-					if dimlength != len(levT):
+					if dimlength != len(lev):
 						Px = np.expand_dims(Px,axis=idim)
 				V = np.broadcast_to(Px,VT.shape)
 			else:
@@ -2939,9 +4268,6 @@ def to_TPbased(E,D,meantrop='DJFmean',hostname='taurus',debug=False):
 
 			# for tropopause heights, convert 2d to 3d array by adding an additional dimension 
 			if 'ztrop' in Etemp['matrix_name']:
-				# find which is the vertical levels dimension 
-				nlev = len(lev)
-				levdim = list(Vmatrix.shape).index(nlev)  
 				Zx = np.expand_dims(Z, axis=levdim)
 				try:
 					Z3d=np.broadcast_to(Zx,Vmatrix.shape)
@@ -2961,73 +4287,11 @@ def to_TPbased(E,D,meantrop='DJFmean',hostname='taurus',debug=False):
 	# create a regular grid 
 	zTPgrid=np.arange(6.0,26.0, 1.0)
 
-	# empty array to hold interpolated data
-	Snew = list(Vmatrix.shape)
-	Snew[levdim] = len(zTPgrid)
-	Vnew = np.empty(shape=Snew)*np.nan
-
-	# note that so far I've only coded this for two array shapes 
-	# -- add more if needed 
-
-	S=Vmatrix.shape
-
-	from scipy.interpolate import interp1d
-	if levdim==1:
-		# if levels is the 1st dimension, then the jj index is for the third dimension
-		jjindex = 3
-	if levdim==3:
-		# if levels is the 3rd dimension, then the jj index is for the first dimension
-		jjindex = 1
-	for ii in range(S[0]):
-		for jj in range(S[jjindex]):
-			for kk in range(S[2]):
-				for ll in range(S[4]):
-					if levdim == 3:
-						Vcolumn = Vmatrix[ii,jj,kk,:,ll]
-						ZTcolumn = ZT[ii,jj,kk,:,ll]
-					if levdim == 1:
-						Vcolumn = Vmatrix[ii,:,kk,jj,ll]
-						ZTcolumn = ZT[ii,:,kk,jj,ll]
-
-					# here is the interpolation function:
-					try:
-						f = interp1d(ZTcolumn,Vcolumn, kind='cubic')
-					except ValueError:
-						print('these data columns give the interpolation trouble:')
-						print(Vcolumn)
-						print(ZTcolumn)
-						print('these are the shapes of the temp and trop heigh arrays:')
-						print(Vmatrix.shape)
-						print(ZT.shape)
-						print(E)
-
-					# check whether the sampled ZTcolumn covers the grid we interpolate to
-					select = np.where(np.logical_and(zTPgrid>np.min(ZTcolumn), zTPgrid<np.max(ZTcolumn)))
-					zTPnew=zTPgrid[select]
-					if levdim == 1:
-						Vnew[ii,select,kk,jj,ll] = f(zTPnew)
-					if levdim == 3:
-						Vnew[ii,jj,kk,select,ll] = f(zTPnew)
-					
-					# need to check whether the sampled ZTcolumn covers the 
-					# grid to which we want to interpolate
-					#if (np.min(zTPgrid) < np.min(ZTcolumn)) or (np.max(zTPgrid) > np.max(ZTcolumn)):
-					#	Vnew[ii,jj,kk,:,ll] = np.nan
-					#else:
-					#	Vnew[ii,jj,kk,:,ll] = f(zTPgrid)
-
-
-	# applying interp1d fucks up the mask over bad values 
-	# (I guess it comes up wtih values close to the masked value)
-	# to need to reapply it, with some closer values 
-	if 'FillValue' in D:
-		mask = np.isclose(Vnew,D['FillValue'])
-		Vnew2 = np.ma.array(Vnew,mask=mask)
-	else:
-		Vnew2 = Vnew  
+	# interpolate all the columns at once -- missing values and points outside each column come out masked  
+	Vnew = dart.interpolate_columns(Vmatrix,ZT,zTPgrid,axis=levdim,kind=kind,chunk_axis=chunk_axis,chunk_size=chunk_size)
 
 	Dout = D
-	Dout['data']=Vnew2
+	Dout['data']=Vnew
 	Dout['lev']=zTPgrid
 	
 	return D
@@ -3067,7 +4331,7 @@ def nice_colormaps(cmap_type='sequential',reverse_colors=False):
 	cmap = eval('pb.'+cname+rev)
 	return cmap
 
-def average_over_named_dimension(V,dim):
+def average_over_named_dimension(V,dim,dims=None,dimname=None):
 
 	"""
 	This subroutine takes a multi-dimensional data matrix and finds the dimension that matches 
@@ -3076,20 +4340,32 @@ def average_over_named_dimension(V,dim):
 	and you put in that array and an array with the levels, you will get back an average over the 
 	3rd dimension.   
 
+	Note that this goes wrong if two dimensions have the same length -- it's safer to give the 
+	names of the dimensions of V (e.g. the 'dims' entry that DART_diagn_to_array returns when 
+	using reductions) in the list dims, and the name of the dimension to average over in dimname. 
+	Better still, have DART_diagn_to_array do the averaging with its `reduce` input. 
+
 	INPUTS:  
 	V: multi dimensional data array  
 	dim: dimension array (1xN, where N is the length of the dim in question)  
+	dims: list of the names of the dimensions of V (default None)  
+	dimname: name of the dimension to average over, if dims is given  
 	"""
 
+	if (dims is not None) and (dimname is not None):
+		return np.nanmean(V,axis=dims.index(dimname))
+
 	# the input matrix should be a masked array. For some reason, even though values are masked 
 	# the mean performed here is also performed on those values, which screws the mask
 	# so as a temporary solution, convert the masked values to nans. 
 	#V= np.ma.fix_invalid(V,fill_value=np.nan)
 
-	for idim,dimlen in enumerate(V.shape):
-		if dimlen == len(dim):
-			desired_dimension_number = idim
-	if 'desired_dimension_number' not in locals():
+	matches = [idim for idim,dimlen in enumerate(V.shape) if dimlen == len(dim)]
+	if (len(matches) > 1) and (len(dim) > 1):
+		print('average_over_named_dimension: warning -- several dimensions of an array shaped '+str(V.shape)+' have length '+str(len(dim))+'. Averaging over the last one.')
+	if len(matches) > 0:
+		desired_dimension_number = matches[-1]
+	else:
 		print("Looking for dimension of this shape:")
 		print(dim.shape)
 		print("In variable of this shape:")
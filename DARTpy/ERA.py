@@ -43,91 +43,90 @@ def load_ERA_file(E,datetime_in,resol=0.75,hostname='taurus',verbose=False):
 	if os.path.isfile(ff):
 		if verbose:  
 			print('Loading ERA file '+ff)
-		f = Dataset(ff,'r')
+		with dart.netcdf_file(ff) as f:
 		
-		# a list of 2d variables, in which case we don't need to load level  
-		# TODO: add other 2d vars to this list 
-		variables_2d = ['PS','ptrop','LNSP','ztrop']
-
-		# load the grid variables 
-		# check whether lat/lon/lev are named as such, or whether the full 
-		# words are given 
-		if 'latitude' in f.variables:
-			lat = f.variables['latitude'][:]
-		else:
-			lat = f.variables['lat'][:]
-		if 'longitude' in f.variables:
-			lon = f.variables['longitude'][:]
-		else:
-			lon = f.variables['lon'][:]
-		if E['variable'] in variables_2d:
-			lev0 = None
-		else:
-			if 'level' in f.variables:
-				lev0 = f.variables['level']
+			# a list of 2d variables, in which case we don't need to load level  
+			# TODO: add other 2d vars to this list 
+			variables_2d = ['PS','ptrop','LNSP','ztrop']
+
+			# load the grid variables 
+			# check whether lat/lon/lev are named as such, or whether the full 
+			# words are given 
+			if 'latitude' in f.variables:
+				lat = f.variables['latitude'][:]
+			else:
+				lat = f.variables['lat'][:]
+			if 'longitude' in f.variables:
+				lon = f.variables['longitude'][:]
 			else:
-				lev0 = f.variables['lev']
+				lon = f.variables['lon'][:]
+			if E['variable'] in variables_2d:
+				lev0 = None
+			else:
+				if 'level' in f.variables:
+					lev0 = f.variables['level']
+				else:
+					lev0 = f.variables['lev']
 			
-		time = f.variables['time'][:]
+			time = f.variables['time'][:]
 		
-		# if the level is in level numbers (rather than approximate pressures) 
-		# convert this array to midpoint pressures 
-		# (note that these are approximate -- below about 200hPa, the hybrid levels 
-		# really follow topography, so there could be use differences in the approximate
-		# pressure and the actual pressure at that point  
-		if lev0 is not None:
-			if (lev0.long_name == 'model_level_number') or (lev0.standard_name == "hybrid_sigma_pressure"):
-				levlist = [0.1, 0.292, 0.51, 0.796, 1.151, 1.575, 2.077, 2.666, 3.362, 4.193, 5.201, 6.444, 7.984, 9.892, 12.257, 15.186, 18.815, 23.311, 28.882, 35.784, 44.335, 54.624, 66.623, 80.397, 95.978, 113.421, 132.758, 153.995, 177.118, 202.086, 228.839, 257.356, 287.638, 319.631, 353.226, 388.27, 424.571,461.9,500, 538.591, 577.375, 616.042, 654.273, 691.752, 728.163, 763.205, 796.588, 828.047, 857.342, 884.266, 908.651, 930.37, 949.349, 965.567, 979.063, 989.944, 998.385, 1004.644, 1009.056, 1012.049]
-				lev = np.asarray(levlist)
+			# if the level is in level numbers (rather than approximate pressures) 
+			# convert this array to midpoint pressures 
+			# (note that these are approximate -- below about 200hPa, the hybrid levels 
+			# really follow topography, so there could be use differences in the approximate
+			# pressure and the actual pressure at that point  
+			if lev0 is not None:
+				if (lev0.long_name == 'model_level_number') or (lev0.standard_name == "hybrid_sigma_pressure"):
+					levlist = [0.1, 0.292, 0.51, 0.796, 1.151, 1.575, 2.077, 2.666, 3.362, 4.193, 5.201, 6.444, 7.984, 9.892, 12.257, 15.186, 18.815, 23.311, 28.882, 35.784, 44.335, 54.624, 66.623, 80.397, 95.978, 113.421, 132.758, 153.995, 177.118, 202.086, 228.839, 257.356, 287.638, 319.631, 353.226, 388.27, 424.571,461.9,500, 538.591, 577.375, 616.042, 654.273, 691.752, 728.163, 763.205, 796.588, 828.047, 857.342, 884.266, 908.651, 930.37, 949.349, 965.567, 979.063, 989.944, 998.385, 1004.644, 1009.056, 1012.049]
+					lev = np.asarray(levlist)
+				else:
+					lev = lev0[:]
 			else:
-				lev = lev0[:]
-		else:
-			lev = lev0
+				lev = lev0
 
-		# first set a general factor that we can scale the variable array by if needed
-		prefac = 1.0
+			# first set a general factor that we can scale the variable array by if needed
+			prefac = 1.0
 
-		# if the requested variable is available, load it 
-		if E['variable'] in f.variables:
-			V = f.variables[E['variable']]
-		else:
-			# if not available, try other names 
-			possible_varnames_dict={'T':['T','t','var130'],
-						'TS':['T','t','var130'],
-						'U':['U','u','var131'],
-						'US':['U','u','var131'],
-						'V':['V','v','var132'],
-						'VS':['V','v','var132'],
-						'Z':['Z','z','var129'],
-						'geopotential':['Z','z','var129'],
-						'GPH':['Z','z','var129'],
-						'Z3':['Z','z','var129'],
-						'msl':['msl','var151'],
-						'MSLP':['msl','var151'],
-						'ztrop':['ptrop']}
-			possible_varnames=possible_varnames_dict[E['variable']]
-
-			# multiplicative factors for some variables 
-			if (E['variable']=='GPH') or (E['variable']=='Z3'):
-				prefac = 1/9.8    # convert geopotential to geopotential height
-
-			if 'possible_varnames' in locals():
-				# loop over the list of possible variable names and load the first one we find 
-				for varname in possible_varnames:
-					if varname in f.variables:
-						varname_load = varname
-				if 'varname_load' in locals():
-					V = f.variables[varname_load]
+			# if the requested variable is available, load it 
+			if E['variable'] in f.variables:
+				V = f.variables[E['variable']]
+			else:
+				# if not available, try other names 
+				possible_varnames_dict={'T':['T','t','var130'],
+							'TS':['T','t','var130'],
+							'U':['U','u','var131'],
+							'US':['U','u','var131'],
+							'V':['V','v','var132'],
+							'VS':['V','v','var132'],
+							'Z':['Z','z','var129'],
+							'geopotential':['Z','z','var129'],
+							'GPH':['Z','z','var129'],
+							'Z3':['Z','z','var129'],
+							'msl':['msl','var151'],
+							'MSLP':['msl','var151'],
+							'ztrop':['ptrop']}
+				possible_varnames=possible_varnames_dict[E['variable']]
+
+				# multiplicative factors for some variables 
+				if (E['variable']=='GPH') or (E['variable']=='Z3'):
+					prefac = 1/9.8    # convert geopotential to geopotential height
+
+				if 'possible_varnames' in locals():
+					# loop over the list of possible variable names and load the first one we find 
+					for varname in possible_varnames:
+						if varname in f.variables:
+							varname_load = varname
+					if 'varname_load' in locals():
+						V = f.variables[varname_load]
+					else:
+						return None,None,None,None,None
 				else:
 					return None,None,None,None,None
-			else:
-				return None,None,None,None,None
 
-		# replace values with NaNs
-		VV = prefac*V[:]
-		if hasattr(V,'_FillValue'):
-				VV[VV==V._FillValue]=np.nan
-		f.close()
+			# replace values with NaNs
+			VV = prefac*V[:]
+			if hasattr(V,'_FillValue'):
+					VV[VV==V._FillValue]=np.nan
 	
 		# select the vertical and lat/lon ranges specified in E
 		# if only one number is specified, find the lev,lat, or lon closest to it
@@ -354,21 +353,13 @@ def P_from_hybrid_levels_era(E,date,hostname='taurus',debug=False):
 		field,lat,lon,lev,time2 = load_ERA_file(Epo,date,resol=resol,hostname=hostname,verbose=debug)
 		H[vname]=field
 
-	# loop over all grid points and compute the pressure there: 
-	# note that here we squeeze out the time dimension in T, which should be 1. 
-	# further we assume that levels are the first dimension, and lat/lon the other two. 
-	vshape = np.squeeze(H['T']).shape
-	P = np.zeros(shape = vshape)
-
+	# compute the pressure at all grid points: 
+	# note that here we assume that levels are the first dimension, and lat/lon the other two. 
 	# kludge: ERA sirface pressure arrays have a length-1 dimension for vertical level 
 	# --> squeeze it out 
 	LNSP = np.squeeze(H['LNSP'])
 
-
-	for i in range(vshape[1]):
-		for j in range(vshape[2]):
-			ps = np.exp(LNSP[i,j])
-			# hyam+hybm*PS
-			P[:,i,j] = H['hyam'] + H['hybm']*ps
+	# hyam+hybm*PS at all grid points at once (the ERA hyam are already in Pa) 
+	P = dart.hybrid_pressure(np.squeeze(H['hyam']),np.squeeze(H['hybm']),np.exp(LNSP),P0=1.0,axis=0)
 
 	return P,lat,lon,lev
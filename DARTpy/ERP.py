@@ -2,6 +2,8 @@
 ## Lisa Neef, 22 April 2014
 
 import numpy as np
+import os
+import datetime
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 from scipy.io import netcdf
@@ -44,6 +46,12 @@ Am = 7.0999E37      # (1,1) component core tensor of inertia
 g = 9.81E0          # Earth's mean gravity acceleration [m/s^2]
 omega = 7.292115E-5 # Earth's mean angular velocity [s-1]
 
+# grid-dependent weights for the excitation functions, keyed by the lat/lon arrays (see aef_grid)
+aef_grid_cache = dict()
+
+# IERS data tables that have already been read, keyed by hostname and data type (see load_iers_data)
+iers_cache = dict()
+
 
 
 
@@ -54,40 +62,81 @@ omega = 7.292115E-5 # Earth's mean angular velocity [s-1]
 def read_aefs_iers(hostname):
 
 	# read in the AAM excitation function data from the IERS
+	# (see iers_series -- the text files are only parsed once, and then read from a binary cache)
 
-        # file path depends on the host
-        FP = es.iers_file_paths(hostname,'AAM')
-        ff = FP
+	S = iers_series(hostname,'AAM')
 
-	# read in the ERP data
-	data = np.genfromtxt(ff, dtype=float, skip_header=2)
-	mjd   = data[:,0]
-	x     = data[:,1]        
-	y     = data[:,3]        
-	dlod       = data[:,9]
+	return S['mjd'],S['X1'],S['X2'],S['dLOD']
 
-	# define some constants
-	sigc = 2*np.pi/433;      
+def read_erps(hostname):
 
+	# read in the Earth Rotation Parameter data from the IERS
+	# (see iers_series -- the text files are only parsed once, and then read from a binary cache)
 
-	# rotate the polar motion terms to the proper reference frame	
-	# where X(t) = p(t)+(i/sigma)*deriv(p(t))
-	xdot = np.gradient(x)
-	ydot = np.gradient(y)
-	X1 = x+ydot/sigc
-	X2 = -y+xdot/sigc
+	S = iers_series(hostname,'ERP')
 
-	return mjd,X1,X2,dlod
+	return S['mjd'],S['X1'],S['X2'],S['dLOD']
 
-def read_erps(hostname):
+def load_iers_data(hostname,data_type='ERP',debug=False):
 
-	# read in the Earth Rotation Parameter data from the IERS
+	"""
+	return the table of numbers in the IERS text file(s) for a given data type ('ERP' or 'AAM'), 
+	as given by experiment_settings.iers_file_paths. If that path is a directory, all the files 
+	in it are read and stacked up. 
 
-        # file path depends on the host
-        ff = es.iers_file_paths(hostname,'ERP')
+	Parsing the text files is slow, so the first time around the table is stored as a binary (.npz) 
+	file in the 'iers' cache directory (see experiment_settings.cache_paths), and after that it is 
+	read from there -- unless the text files have been modified since. 
+	The table is also kept in memory for the rest of the session. 
+	"""
 
-	# read in the ERP data
-	data = np.genfromtxt(ff, dtype=float, skip_header=2)
+	ff = es.iers_file_paths(hostname,data_type)
+	if os.path.isdir(ff):
+		sources = sorted([os.path.join(ff,fs) for fs in os.listdir(ff) if os.path.isfile(os.path.join(ff,fs))])
+	else:
+		sources = [ff]
+	mtimes = [repr(os.path.getmtime(fs)) for fs in sources]
+
+	# first look in memory, then in the binary cache 
+	key = (hostname,data_type)
+	if key in iers_cache:
+		if (iers_cache[key]['sources'] == sources) and (iers_cache[key]['mtimes'] == mtimes):
+			return iers_cache[key]['data']
+
+	cache_file = os.path.join(es.cache_paths(hostname,'iers'),'IERS_'+data_type+'.npz')
+	data = None
+	if os.path.exists(cache_file):
+		B = np.load(cache_file)
+		if (list(B['sources']) == sources) and (list(B['mtimes']) == mtimes):
+			data = B['data']
+		elif debug:
+			print('IERS '+data_type+' files have changed -- rebuilding '+cache_file)
+		B.close()
+
+	if data is None:
+		if debug:
+			print('converting IERS '+data_type+' files to '+cache_file)
+		data = np.concatenate([np.atleast_2d(np.genfromtxt(fs, dtype=float, skip_header=2)) for fs in sources])
+		# write to a temporary file first, so that other processes never see half a cache file 
+		tmp_file = cache_file+'.'+str(os.getpid())+'.npz'
+		np.savez(tmp_file,data=data,sources=np.array(sources),mtimes=np.array(mtimes))
+		os.rename(tmp_file,cache_file)
+
+	iers_cache[key] = {'sources':sources,'mtimes':mtimes,'data':data}
+
+	return data
+
+def iers_series(hostname,data_type='ERP',debug=False):
+
+	"""
+	return the IERS polar motion excitation and length-of-day series for a given data type 
+	('ERP' for the observed Earth rotation parameters, 'AAM' for the atmospheric excitation functions) 
+	as a dictionary with entries mjd (modified julian day), X1, X2, and dLOD, sorted by mjd. 
+	"""
+
+	# read in the data 
+	data = load_iers_data(hostname,data_type,debug=debug)
+	data = data[np.argsort(data[:,0],kind='mergesort'),:]
 	mjd   = data[:,0]
 	x     = data[:,1]        
 	y     = data[:,3]        
@@ -104,8 +153,51 @@ def read_erps(hostname):
 	X1 = x+ydot/sigc
 	X2 = -y+xdot/sigc
 
+	S = {'mjd':mjd,
+		'X1':X1,
+		'X2':X2,
+		'dLOD':dlod}
+
+	return S
+
+def date_to_mjd(dates):
+
+	# convert a datetime, or a list of datetimes, to modified julian days
+	mjd0 = datetime.datetime(1858,11,17,0,0,0)
+	if isinstance(dates,datetime.datetime):
+		dates = [dates]
+	return np.array([(d-mjd0).days + (d-mjd0).seconds/86400.0 for d in dates])
+
+def iers_at_dates(dates,hostname,data_type='ERP',interpolate=True,debug=False):
 
-	return mjd,X1,X2,dlod
+	"""
+	look up the IERS series (see iers_series) for a list of datetimes, e.g. the daterange of an 
+	experiment, and return a dictionary with entries mjd, X1, X2, and dLOD, each with one value per date. 
+
+	INPUTS:
+	dates: a datetime or a list of datetimes 
+	hostname: computer name 
+	data_type: 'ERP' (default) or 'AAM' 
+	interpolate: if True (default), dates that fall between the IERS epochs are linearly interpolated. 
+		If False, only exact matches are returned. 
+	Dates outside the IERS series (or without an exact match) get NaN. 
+	"""
+
+	S = iers_series(hostname,data_type,debug=debug)
+	mjd = date_to_mjd(dates)
+
+	D = {'mjd':mjd}
+	if interpolate:
+		for name in ['X1','X2','dLOD']:
+			D[name] = np.interp(mjd,S['mjd'],S[name],left=np.nan,right=np.nan)
+	else:
+		ii = np.searchsorted(S['mjd'],mjd)
+		ii = np.minimum(ii,len(S['mjd'])-1)
+		match = np.abs(S['mjd'][ii]-mjd) < 1E-6
+		for name in ['X1','X2','dLOD']:
+			D[name] = np.where(match,S[name][ii],np.nan)
+
+	return D
 
 def iers_file_paths(hostname,data_type):
 
@@ -121,49 +213,22 @@ def iers_file_paths(hostname,data_type):
         return FP[hostname]
 
 
-def eam_weights(lat,lon,comp,variable):
-	# retrieve a lat/lon matrix of the weights needed to compute atmospheric excitation functions 
-	# given input latitude and longitude arrays, a vector component of AAM, and the variable
-	# that we want to apply the weights to
+def aef_grid(lat,lon):
 
+	# precompute everything on a lat/lon grid that the excitation functions need but that does 
+	# not depend on the fields themselves: radian coordinates, the meshgrid, the horizontal 
+	# areas of the gridboxes, and the lat x lon weight tensors that turn a surface pressure field 
+	# into the mass term and a (wind x layer thickness) field into the motion term of X1, X2, and X3. 
+	# the result is cached, since we usually evaluate many members and times on the same grid.  
 
-	# temp inputs
-	#lon = np.arange(0,361.,1.)
-	#lat = np.arange(-90,91.,1.)
-	#comp = 'X1'
-	#variable = 'U'
-
-	# what factor do we want to compute the weights for?
-	cc = comp+variable
-
-	# make radian arrays
-	rlon = lon*np.pi/180.;
-	rlat = lat*np.pi/180.;
-	[LAT,LON] = np.meshgrid(rlat,rlon);
-
-
-	# list the possible conditions we can have
-	condX1 = [cc == 'X1PS',cc == 'X1U',cc == 'X1V']
-	condX2 = [cc == 'X2PS',cc == 'X2U',cc == 'X2V']
-	condX3 = [cc == 'X3PS',cc == 'X3U',cc == 'X3V']
-	condlist = condX1+condX2+condX3
-
-	# list the possible outcomes
-	choiceX1 = [np.sin(LAT)*np.cos(LAT)*np.cos(LAT)*np.cos(LON),np.sin(LAT)*np.cos(LAT)*np.cos(LON),-np.cos(LAT)*np.sin(LON)]
-	choiceX2 = [np.sin(LAT)*np.cos(LAT)*np.cos(LAT)*np.sin(LON),np.sin(LAT)*np.cos(LAT)*np.sin(LON),np.cos(LAT)*np.cos(LON)]
-	choiceX3 = [np.cos(LAT)*np.cos(LAT)*np.cos(LAT),np.cos(LAT)*np.cos(LAT),LAT*0]
-	choicelist = choiceX1+choiceX2+choiceX3
-
-	return np.select(condlist,choicelist)
-
-def aef_massintegral(VV,PS,p,lat,lon,variable_name,ERP='X3'):
-
-	# goven a grid of U,V, or surface pressure, plus a 3D pressure grid, integrate 
-	# the variable field to get the corresponding AAM term.
-
+	lat = np.asarray(lat,dtype=float)
+	lon = np.asarray(lon,dtype=float)
+	key = (lat.tobytes(),lon.tobytes())
+	if key in aef_grid_cache:
+		return aef_grid_cache[key]
 
-	# figure out some stuff concerning the grid
-	nlat,nlon,nlev = p.shape
+	nlat = len(lat)
+	nlon = len(lon)
 
 	# some abbreves
 	radian = np.pi/180.
@@ -179,10 +244,8 @@ def aef_massintegral(VV,PS,p,lat,lon,variable_name,ERP='X3'):
 	area_horiz = np.zeros(shape=lat.shape)
 
 	# interior latitude bands  
-	for j in range(1,nlat-1):
-		dlat = lat*0
-		dlat = radian*abs(lat[j-1] - lat[j+1])/2.0	
-		area_horiz[j] = dlat*dlon*(Re_m**2)*np.cos(lat[j]*radian)
+	dlat = radian*np.abs(lat[0:nlat-2] - lat[2:nlat])/2.0	
+	area_horiz[1:nlat-1] = dlat*dlon*(Re_m**2)*coslat[1:nlat-1]
 
 	# north pole latband
 	if (np.abs(lat[0]) + np.abs(lat[0]-lat[1])/2.0 > 90.0):
@@ -191,7 +254,7 @@ def aef_massintegral(VV,PS,p,lat,lon,variable_name,ERP='X3'):
 	else:
 	# if the pole is the actual boundary, then it's just a square pixel
 		dlat=radian*abs(lat[0]-lat[1])
-		area_horiz[0]=dlat*dlon*(Re_m**2)*np.cos(lat[0]*radian)
+		area_horiz[0]=dlat*dlon*(Re_m**2)*coslat[0]
 
 	# south pole latband
 	if (np.abs(lat[nlat-1]) + np.abs(lat[nlat-1]-lat[nlat-2])/2.0 > 90.0):
@@ -200,7 +263,7 @@ def aef_massintegral(VV,PS,p,lat,lon,variable_name,ERP='X3'):
 		area_horiz[nlat-1] = 2.0*np.pi*(Re_m**2)*(1.-np.cos(alpha))/nlon
 	else:  
 		dlat=radian*abs(lat[nlat-2]-lat[nlat-1])
-		area_horiz[nlat-1]=dlat*dlon*(Re_m**2)*np.cos(lat[nlat-1]*radian)
+		area_horiz[nlat-1]=dlat*dlon*(Re_m**2)*coslat[nlat-1]
 			
 	# prefactors -- this is taken straight from the EAM observation operator
 	alp1 = 1E0 / ( 1E0 - k2/ks)                          # rotational deformation
@@ -208,85 +271,269 @@ def aef_massintegral(VV,PS,p,lat,lon,variable_name,ERP='X3'):
 	alp3 = 1E0 + kl                                      # loading
 	alp4 = (C-A) / (Cm-Am)                               # core decoupling
 	alp5 = C / Cm                                        # core decoupling
-	chifacprs1 = alp1 * alp3 * alp4 / (C-A)
-	chifacprs2 = alp1 * alp3 * alp4 / (C-A)
-	chifacprs3 = alp2 * alp3 * alp5 /  C
-	chifacwin1 = alp1 * alp4 / (C-A) / omega
-	chifacwin2 = alp1 * alp4 / (C-A) / omega
-	chifacwin3 = alp2 * alp5 /  C    / omega
-
-	# start with zero AAM and then add up
-	AAM = 0.0
-
-	if variable_name is 'PS':
-		nlat2,nlon2 = VV.shape
-		dm = np.zeros(shape=(nlat2,nlon2))
-		x = np.zeros(shape=(nlat2,nlon2))
-		# for mass term, loop over lat and lon and add up the mass for each column
-		for ilat in range(nlat2):
-			for ilon in range(nlon2):
-				dm[ilat,ilon] = VV[ilat,ilon] * area_horiz[ilat] / g
-				# mass increment for each column:
-				if ERP is 'X1':
-					x[ilat,ilon] = -(Re_m**2)*coslat[ilat]*sinlat[ilat]*coslon[ilon]*chifacprs1*dm[ilat,ilon]
-				if ERP is 'X2':
-					x[ilat,ilon] = -(Re_m**2)*coslat[ilat]*sinlat[ilat]*sinlon[ilon]*chifacprs2*dm[ilat,ilon]
-				if ERP is 'X3':
-					x[ilat,ilon] = (Re_m**2)*coslat[ilat]*coslat[ilat]*chifacprs3*dm[ilat,ilon]
-				AAM = AAM + x[ilat,ilon]
+	chifacprs = {'X1':alp1 * alp3 * alp4 / (C-A),
+		     'X2':alp1 * alp3 * alp4 / (C-A),
+		     'X3':alp2 * alp3 * alp5 /  C}
+	chifacwin = {'X1':alp1 * alp4 / (C-A) / omega,
+		     'X2':alp1 * alp4 / (C-A) / omega,
+		     'X3':alp2 * alp5 /  C    / omega}
+
+	# geometric part of each term, as lat x lon arrays
+	# mass term: column mass times the lever arm of each component
+	geom_mass = {'X1':-(Re_m**2)*np.outer(coslat*sinlat,coslon),
+		     'X2':-(Re_m**2)*np.outer(coslat*sinlat,sinlon),
+		     'X3':(Re_m**2)*np.outer(coslat*coslat,np.ones(nlon))}
+	# motion terms: relative angular momentum of zonal and meridional wind
+	geom_motion = {('X1','U'):-Re_m*np.outer(sinlat,coslon),
+		       ('X2','U'):-Re_m*np.outer(sinlat,sinlon),
+		       ('X3','U'):Re_m*np.outer(coslat,np.ones(nlon)),
+		       ('X1','V'):Re_m*np.outer(np.ones(nlat),sinlon),
+		       ('X2','V'):-Re_m*np.outer(np.ones(nlat),coslon),
+		       ('X3','V'):np.zeros(shape=(nlat,nlon))}
+
+	# fold the gridbox mass (area/g) and the geophysical prefactors into the weights
+	mass_area = area_horiz[:,None]/g
+	G = dict()
+	G['rlat'] = rlat
+	G['rlon'] = rlon
+	[G['LAT'],G['LON']] = np.meshgrid(rlat,rlon)
+	G['area'] = area_horiz
+	G['mass'] = dict()
+	G['motion'] = dict()
+	G['eam'] = dict()
+	for comp in ['X1','X2','X3']:
+		G['mass'][comp] = geom_mass[comp]*mass_area*chifacprs[comp]
+		for variable in ['U','V']:
+			G['motion'][(comp,variable)] = geom_motion[(comp,variable)]*mass_area*chifacwin[comp]
+
+	if len(aef_grid_cache) >= 8:
+		aef_grid_cache.clear()
+	aef_grid_cache[key] = G
+
+	return G
+
+def trapz_weights(x):
+
+	# return the weights w such that sum(w*y) equals np.trapz(y,x) along an axis with coordinates x
+	x = np.asarray(x,dtype=float)
+	w = np.zeros(shape=x.shape)
+	if len(x) < 2:
+		return w
+	dx = np.diff(x)
+	w[0:-1] = w[0:-1] + 0.5*dx
+	w[1:] = w[1:] + 0.5*dx
+	return w
+
+def layer_thickness(p,PS):
+
+	# given the pressure on model levels (last axis of p, ordered from top to bottom) and 
+	# the surface pressure, return the pressure thickness of each layer, the way 
+	# aef_massintegral has always defined it.  
+	# p and PS can carry any number of leading (e.g. member and time) dimensions, 
+	# as long as they broadcast against each other. 
+	p = np.asarray(p)
+	PS = np.asarray(PS)
+	nlev = p.shape[-1]
+	shape = np.broadcast(p[...,0],PS).shape+(nlev,)
+	dlev = np.zeros(shape=shape)
+	dlev[...,0] = 0.5*(p[...,0] + p[...,1])					# top layer
+	dlev[...,nlev-1] = PS - 0.5*(p[...,nlev-2]+p[...,nlev-1])		# bottom layer
+	dlev[...,1:nlev-1] = 0.5*(p[...,2:nlev] - p[...,0:nlev-2])		# inner layers
+	return dlev
+
+def grid_dims_last(VV,dims,grid_dims):
+
+	# move the named grid dimensions of an array to the end, in the given order, 
+	# so that whatever remains up front (copy, time, ...) can be treated as a batch 
+	if (VV is None) or (dims is None):
+		return VV
+	if len(dims) != np.ndim(VV):
+		raise ValueError('dims '+str(dims)+' does not match an array of shape '+str(np.shape(VV)))
+	source = [list(dims).index(d) for d in grid_dims]
+	destination = range(np.ndim(VV)-len(grid_dims),np.ndim(VV))
+	return np.moveaxis(np.asarray(VV),source,list(destination))
+
+def aef_massintegral_batch(lat,lon,PS,p=None,U=None,V=None,ERP=['X1','X2','X3'],dims=None):
+
+	"""
+	compute the mass and motion terms of the atmospheric excitation functions 
+	as a mass integral, for a whole batch of fields (e.g. every ensemble member at every time) 
+	at once. 
+
+	INPUTS:
+	lat, lon: the grid  
+	PS: surface pressure (Pa), shaped [batch x] lat x lon  
+	p: pressure (Pa) on model levels, shaped [batch x] lat x lon x lev, with levels ordered 
+		from the top down. This is only needed for the motion terms. 
+	U, V: zonal and meridional wind (m/s), shaped like p (or one row short, for the staggered 
+		US and VS grids). Either of them can be left out. 
+	ERP: list of components to compute -- choose from 'X1', 'X2', 'X3'
+	dims: optional list of dimension names for U, V, and p (e.g. ['copy','lat','lon','lev','time'] 
+		as returned by DART_diagn_to_array). PS has the same dimensions minus 'lev'. 
+		If this is given, the grid dimensions can sit anywhere in the arrays. 
+		Otherwise they need to be the last ones. 
+
+	The output is a dictionary with one entry per component, each holding a dictionary 
+	with the mass term ('PS') and the motion terms ('U' and/or 'V'), which are arrays 
+	with the batch dimensions (or scalars if there aren't any).  
+	"""
+
+	G = aef_grid(lat,lon)
+	if dims is not None:
+		dims2 = [d for d in dims if d != 'lev']
+		PS = grid_dims_last(PS,dims2,['lat','lon'])
+		p = grid_dims_last(p,dims,['lat','lon','lev'])
+		U = grid_dims_last(U,dims,['lat','lon','lev'])
+		V = grid_dims_last(V,dims,['lat','lon','lev'])
+
+	AEF = dict()
+	for comp in ERP:
+		AEF[comp] = dict()
+		if PS is not None:
+			# mass term: sum over the columns
+			AEF[comp]['PS'] = np.einsum('...ji,ji->...',np.asarray(PS),G['mass'][comp])
+
+	# motion terms: sum over the boxes of each column, weighted by the layer thickness 
+	if (U is not None) or (V is not None):
+		if (p is None) or (PS is None):
+			raise ValueError('the motion terms need the pressure on model levels (p) and the surface pressure (PS)')
+		dlev = layer_thickness(p,PS)
+		for variable,VV in [('U',U),('V',V)]:
+			if VV is None:
+				continue
+			VV = np.asarray(VV)
+			# staggered winds (US on slat, VS on slon) have one row fewer than the pressure grid -- 
+			# they are summed over the matching rows of the pressure grid, and the last row adds nothing 
+			nlat2,nlon2 = VV.shape[-3:-1]
+			if (nlat2,nlon2) != dlev.shape[-3:-1]:
+				VVpad = np.zeros(shape=VV.shape[:-3]+dlev.shape[-3:])
+				VVpad[...,0:nlat2,0:nlon2,:] = VV
+				VV = VVpad
+			for comp in ERP:
+				AEF[comp][variable] = np.einsum('...jik,...jik,ji->...',VV,dlev,G['motion'][(comp,variable)])
+
+	return AEF
+
+def aef_batch(field,lev,lat,lon,variable_name,ERP=['X1','X2','X3'],dims=None):
+
+	"""
+	compute the atmospheric excitation functions as a volume integral (the way aef does it) 
+	for a whole batch of U, V, or surface pressure fields at once. 
+
+	INPUTS:
+	field: the U, V, or PS field, shaped [batch x] lat x lon [x lev] 
+	lev: the pressure levels (Pa) -- not needed for PS 
+	lat, lon: the grid  
+	variable_name: 'U', 'V', or 'PS'
+	ERP: list of components to compute -- choose from 'X1', 'X2', 'X3'
+	dims: optional list of dimension names of field, in case the grid dimensions 
+		are not the last ones 
+
+	Returns a dictionary of excitation function arrays with the batch dimensions, one 
+	per component.  
+	"""
+
+	G = aef_grid(lat,lon)
+	nlat = len(lat)
+	nlon = len(lon)
+
+	# the integrals have to be multiplied by -1 if the lat or lon arrays are defined in the other direction
+	# the "right" direction is lat -90-90, lon 0-360
+	latfac = 1.0
+	lonfac = 1.0
+	if lat[0] > lat[nlat-1]:
+		latfac = -1.
+	if lon[0] > lon[nlon-1]:
+		lonfac = -1.
+	# no sign flip for the levels -- see the note in aef
+	levfac = 1.0
+	wlat = latfac*trapz_weights(G['rlat'])
+	wlon = lonfac*trapz_weights(G['rlon'])
+	wlatlon = np.outer(wlat,wlon)
 
+	if variable_name == 'PS':
+		grid_dims = ['lat','lon']
 	else:
-		nlat2,nlon2,nlev2 = VV.shape
-		# compute the pressure increments for each layer
-		dlev = p*0
-		for j in range(nlat):
-			for i in range(nlon):
-				dlev[j,i,0] = 0.5*(p[j,i,0] + p[j,i,1])		# top layer
-				dlev[j,i,nlev-1] = PS[j,i] - 0.5*(p[j,i,nlev-2]+p[j,i,nlev-1]  )	# bottom layer
-				for k in range(1,nlev-1):
-					dlev[j,i,k] = 0.5*(p[j,i,k+1] - p[j,i,k-1] )	# inner layers
-
-		# for wind terms, loop over lat, lon, lev, and compute the AM contribution for each box
-		dm = dlev*0
-		x = np.zeros(shape=(nlat2,nlon2))
-		dm = np.zeros(shape=(nlat2,nlon2,nlev))
-		for k in range(nlev):
-			for ilat in range(nlat2):
-				for ilon in range(nlon2):
-					dm[ilat,ilon,k] = dlev[ilat,ilon,k] * area_horiz[ilat] / g
-					if (variable_name is 'US') or (variable_name is 'U'):
-						if ERP is 'X1':
-							x[ilat,ilon] = x[ilat,ilon] - Re_m*VV[ilat,ilon,k]*sinlat[ilat]*coslon[ilon]*dm[ilat,ilon,k]
-						if ERP is 'X2':
-							x[ilat,ilon] = x[ilat,ilon] - Re_m*VV[ilat,ilon,k]*sinlat[ilat]*sinlon[ilon]*dm[ilat,ilon,k]
-						if ERP is 'X3':
-							x[ilat,ilon] = x[ilat,ilon] + Re_m*VV[ilat,ilon,k]*coslat[ilat]*dm[ilat,ilon,k]
-					if (variable_name is 'VS') or (variable_name is 'V'):
-						if ERP is 'X1':
-							x[ilat,ilon] = x[ilat,ilon] + Re_m*VV[ilat,ilon,k]*sinlon[ilon]*dm[ilat,ilon,k]
-						if ERP is 'X2':
-							x[ilat,ilon] = x[ilat,ilon] - Re_m*VV[ilat,ilon,k]*coslon[ilon]*dm[ilat,ilon,k]
-						if ERP is 'X3':
-							x[ilat,ilon] = 0.0
-					#aamu = + Re_m*VV[45,90,k]*coslat[45]*dm[45,90,k]
-
-
-		# now loop over lat and lon and add up AAM:
-		for ilat in range(nlat2):
-			for ilon in range(nlon2):
-				if ERP is 'X1':
-					AAM = AAM + x[ilat,ilon]*chifacwin1
-				if ERP is 'X2':
-					AAM = AAM + x[ilat,ilon]*chifacwin2
-				if ERP is 'X3':
-					AAM = AAM + x[ilat,ilon]*chifacwin3
-		
-	return AAM
+		grid_dims = ['lat','lon','lev']
+		wlev = levfac*trapz_weights(lev)
+	V = np.asarray(grid_dims_last(field,dims,grid_dims))
+
+	AEF = dict()
+	for comp in ERP:
+		W = np.transpose(eam_weights(lat,lon,comp,variable_name))*wlatlon
+		fac = aam_prefactors(comp,variable_name)
+		if variable_name == 'PS':
+			AEF[comp] = fac*np.einsum('...ji,ji->...',V,W)
+		else:
+			AEF[comp] = fac*np.einsum('...jik,ji,k->...',V,W,wlev)
+
+	return AEF
+
+def eam_weights(lat,lon,comp,variable):
+	# retrieve a lat/lon matrix of the weights needed to compute atmospheric excitation functions 
+	# given input latitude and longitude arrays, a vector component of AAM, and the variable
+	# that we want to apply the weights to
+
+
+	# temp inputs
+	#lon = np.arange(0,361.,1.)
+	#lat = np.arange(-90,91.,1.)
+	#comp = 'X1'
+	#variable = 'U'
+
+	# what factor do we want to compute the weights for?
+	cc = comp+variable
+
+	# the radian meshgrid and the weights only depend on the grid, so keep them in the grid cache
+	G = aef_grid(lat,lon)
+	if cc in G['eam']:
+		return G['eam'][cc].copy()
+	LAT = G['LAT']
+	LON = G['LON']
+
+
+	# list the possible conditions we can have
+	condX1 = [cc == 'X1PS',cc == 'X1U',cc == 'X1V']
+	condX2 = [cc == 'X2PS',cc == 'X2U',cc == 'X2V']
+	condX3 = [cc == 'X3PS',cc == 'X3U',cc == 'X3V']
+	condlist = condX1+condX2+condX3
+
+	# list the possible outcomes
+	choiceX1 = [np.sin(LAT)*np.cos(LAT)*np.cos(LAT)*np.cos(LON),np.sin(LAT)*np.cos(LAT)*np.cos(LON),-np.cos(LAT)*np.sin(LON)]
+	choiceX2 = [np.sin(LAT)*np.cos(LAT)*np.cos(LAT)*np.sin(LON),np.sin(LAT)*np.cos(LAT)*np.sin(LON),np.cos(LAT)*np.cos(LON)]
+	choiceX3 = [np.cos(LAT)*np.cos(LAT)*np.cos(LAT),np.cos(LAT)*np.cos(LAT),LAT*0]
+	choicelist = choiceX1+choiceX2+choiceX3
+
+	G['eam'][cc] = np.select(condlist,choicelist)
+
+	return G['eam'][cc].copy()
+
+def aef_massintegral(VV,PS,p,lat,lon,variable_name,ERP='X3'):
+
+	# goven a grid of U,V, or surface pressure, plus a 3D pressure grid, integrate 
+	# the variable field to get the corresponding AAM term.
+	# this is the single-field version of aef_massintegral_batch. 
+
+	if variable_name == 'PS':
+		AEF = aef_massintegral_batch(lat,lon,VV,ERP=[ERP])
+		return AEF[ERP]['PS']
+
+	if (variable_name == 'US') or (variable_name == 'U'):
+		AEF = aef_massintegral_batch(lat,lon,PS,p=p,U=VV,ERP=[ERP])
+		return AEF[ERP]['U']
+
+	if (variable_name == 'VS') or (variable_name == 'V'):
+		AEF = aef_massintegral_batch(lat,lon,PS,p=p,V=VV,ERP=[ERP])
+		return AEF[ERP]['V']
+
+	# for any other variable there is no AAM term 
+	return 0.0
 
 
 def aef(field,lev,lat,lon,variable_name,ERP='X3'):
 
 	# given some variable field (U, V, or surface pressure), compute the AAM excitation function for the desired Earth rotation parameters
+	# this is the single-field version of aef_batch. 
 
 	# check whether pressure levels are in Pascale (not hPa) -- send an alert if this is not the case
 	if np.max(lev) < 8E4:
@@ -294,8 +541,7 @@ def aef(field,lev,lat,lon,variable_name,ERP='X3'):
 		print('returning...')
 		return None
 
-
-	# reshape the variable array to be lev x lat x lon, or lat x lon
+	# reshape the variable array to be lat x lon x lev, or lat x lon
 	ndim = len(field.shape)
 	nlat = len(lat)
 	nlon = len(lon)
@@ -305,65 +551,9 @@ def aef(field,lev,lat,lon,variable_name,ERP='X3'):
 		nlev = len(lev)
 		V = np.reshape(field,(nlat,nlon,nlev))
 
+	AEF = aef_batch(V,lev,lat,lon,variable_name,ERP=[ERP])
 
-	# load the appropriate geographic weighting function for the desired variable and ERP, and 
-	# multiply the field by this
-	W0 = eam_weights(lat,lon,ERP,variable_name)
-	#W = np.reshape(W0,(nlat,nlon))
-	W = np.transpose(W0)
-	if ndim == 2:
-		Vw = V*W
-	else:
-		Vw = V*0
-		for ilev in range(nlev):
-			Vw[:,:,ilev] = V[:,:,ilev]*W	
-
-
-	# convert lat and lon to radians
-	rlon=lon*np.pi/180
-	rlat=lat*np.pi/180
-
-
-
-	# the integrals have to be multiplied by -1 if the lat, lon, or lev arrays are defined in the other direction
-	# the "right" direction is lat -90-90, lon 0-360, and ps to ptop
-	latfac = 1.0
-	lonfac = 1.0
-	levfac = 1.0
-	if lat[0] > lat[nlat-1]:
-		latfac = -1.
-	if lon[0] > lon[nlon-1]:
-		lonfac = -1.
-	if not (variable_name == 'PS'):
-		if lev[0] < lev[nlev-1]:
-			levfac = -1.
-
-	# I have no idea why this needs to be positive for CAM, but that seems to be the only way to rectivy the diff between the vol and mass integral
-	levfac = 1.0
-
-	if variable_name == 'PS':
-		# surface pressure: integrate over lat and lon
-		Vlon = lonfac*np.trapz(Vw,rlon)
-		Vint = latfac*np.trapz(Vlon,rlat)
-
-	else:
-		# meridional and zonal wind: integrate over lat,lon,lev
-		# integral over lon:
-		Vlon = np.zeros(shape=(nlat,nlev))
-		for k in range(nlev):
-			Vlon[:,k] = lonfac*np.trapz(Vw[:,:,k],rlon)
-
-		# integral over lev:
-		Vlevlon = levfac*np.trapz(Vlon,lev)
-
-		# integral over lat:
-		Vint = latfac*np.trapz(Vlevlon,rlat)
-	
-	# multiply by the prefactors that give us AAM:
-	fac = aam_prefactors(ERP,variable_name)
-	AAM = fac*Vint
-
-	return AAM
+	return AEF[ERP]
 
 def aam_prefactors(comp,variable_name):
 
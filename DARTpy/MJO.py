@@ -1,14 +1,11 @@
 # Python module for MJO diagnostics 
 # Lisa Neef, 27 Jan 2015
 
-# to find the Pyclimate package that works for this version of Python, need to append this odd path to the system path.\n",
-import sys
-sys.path.append("/home/lneef/anaconda/pkg/lib/python/") 
-
 # load the required packages  
 import numpy as np
 import datetime
 import time as time
+import os
 import os.path
 import pandas as pd
 import DART as dart
@@ -17,11 +14,17 @@ import experiment_settings as es
 #from netCDF4 import Dataset
 import WACCM as waccm
 import DART_state_space as DSS
-import pyclimate.LanczosFilter as LF
 from mpl_toolkits.basemap import Basemap
 import matplotlib.pyplot as plt
 from scipy.stats import nanmean
 
+# the Wheeler and Hendon (2004) EOF structures, keyed by file -- see load_RMM_EOFs 
+rmm_eof_cache = dict()
+# matrices that interpolate model longitudes onto the EOF grid, keyed by grid -- see RMM_lon_interpolation 
+rmm_interpolation_cache = dict()
+# Lanczos filter weights, keyed by filter order, cutoff frequencies, and filter type -- see lanczos_weights 
+lanczos_weights_cache = dict()
+
 
 def plot_RMM(E,copies_to_plot,climatology_option='NODA',plot_type='polar',hostname='taurus',verbose=False):
 
@@ -201,8 +204,7 @@ def plot_variance_maps(E,cbar=True,hostname="taurus"):
 	VV,lat,lon = variance_maps(E,hostname=hostname)  
 
  	# set up the  map projection
-	map = Basemap(projection='mill',llcrnrlat=-90,urcrnrlat=90,\
-		    #llcrnrlon=-180,urcrnrlon=180,resolution='c')
+	map = dart.cached_basemap(projection='mill',llcrnrlat=-90,urcrnrlat=90,\
 		    llcrnrlon=0,urcrnrlon=360,resolution='c')
 
         # draw coastlines, country boundaries, fill continents.
@@ -214,8 +216,7 @@ def plot_variance_maps(E,cbar=True,hostname="taurus"):
 	map.drawparallels(np.arange(-90,90,30),linewidth=0.25)
 
         # compute native map projection coordinates of lat/lon grid.
-	X,Y = np.meshgrid(lon,lat)
-	x, y = map(X, Y)
+	x, y = dart.projected_grid(map,lon,lat)
 
         # choose color map based on the variable in question
 	E['extras'] = 'MJO variance'
@@ -321,59 +322,123 @@ def correlations_lag_lat_or_lon(E,maxlag,lat_or_lon = 'lon',filter_order=50,clim
 	lat0,lon0,FA0 = aave('IO',FA,lat,lon,season,variable_name,averaging_dimension="all")
 
 	#------ compute field of correlation coefficients   	
-	# empty array size Lag by Lat
-	# plus an array to keep track of sample size
-	Lag_range = range(-maxlag,maxlag+1)
-	nlag = len(Lag_range)
-	n = FAm.shape[0]
-	R = np.zeros(shape=(nlag,n))
-	S = np.zeros(shape=(nlag,n))
-
-	# loop over latitudes
-	T = len(FA0)
-	for ii in range(n):
-		# loop over lags  
-		for ilag,L in zip(range(nlag),Lag_range):
-			# the time points that we can check go from L to T-L
-			# so shorter lags have a larger sample size and are more significant.  
-			if L < 0:
-				Tsel = range(-L,T)
-			if L > 0:
-				Tsel = range(0,T-L)
-			if L == 0:
-				Tsel = range(0,T)
-
-			# loop over the available time points and gather values to compare
-			IO = []
-			X  = []
-			for k in Tsel:
-				IO.append(FA0[k+L])
-				X.append(FAm[ii,k])
-
-			# now compute the correlation from this list of samples and store in the lag vs lat array  
-			rho = np.corrcoef(X,IO)
-			if rho != []:
-				R[ilag,ii] = rho[1,0]
-				S[ilag,ii] = len(IO)
-			else:
-				R[ilag,ii] = np.nan
-				S[ilag,ii] = np.nan
+	# the correlations at all lags and points come out of one call, as arrays of size Lag by Lat (or Lon), 
+	# together with the sample size behind each one -- shorter lags have a larger sample size and are more significant.  
+	R,S,L = lagged_correlation(FAm,FA0,maxlag)
 	if lat_or_lon == 'lon':
 		space_dim = lon1
 	if lat_or_lon == 'lat':
 		space_dim = lat1
 
-	L = np.array(Lag_range)
-
 	return R,S,L,space_dim
 
+def lagged_correlation(X,ref,maxlag,method='auto'):
+
+	"""
+	compute the correlation between a reference time series (e.g. an area-averaged index) and 
+	a set of other time series (e.g. every lat or lon point, for every ensemble member) at 
+	all lags from -maxlag to maxlag at once. 
+
+	At lag L, X at time k is paired with ref at time k+L, and the correlation is computed over 
+	all the times where both exist, i.e. over T-|L| pairs. 
+
+	INPUTS:
+	X: array of time series, shaped [... x] time -- the leading dimensions (e.g. member x lon) 
+		are all computed in one go 
+	ref: the reference time series, either a vector of length time, or an array that 
+		broadcasts against X (e.g. member x 1 x time, for one reference index per member) 
+	maxlag: the largest lag (in time steps) 
+	method: how to compute the lagged cross products: 
+		'direct' does one matrix product per lag, 
+		'fft' computes all lags at once with an FFT cross-correlation, 
+		'auto' (default) picks 'fft' for long series and many lags 
+
+	Returns R, the correlations shaped lag x [...], S, the number of pairs behind each 
+	correlation (same shape), and the array of lags. 
+	Pairs of series where either one has a missing value (NaN) within the overlap get NaN. 
+	"""
+
+	X = np.asarray(X,dtype=float)
+	ref = np.asarray(ref,dtype=float)
+	T = X.shape[-1]
+	lags = np.arange(-maxlag,maxlag+1)
+	if method == 'auto':
+		if (T > 256) and (len(lags) > 16):
+			method = 'fft'
+		else:
+			method = 'direct'
+
+	# the correlation doesn't change if either series is shifted and scaled, so standardize the 
+	# reference index once, and take out the mean of X, which keeps the sums below well-conditioned 
+	def standardize(Y):
+		Ymean = np.nanmean(Y,axis=-1)[...,None]
+		Ystd = np.nanstd(Y,axis=-1)[...,None]
+		Ystd[Ystd == 0] = 1.0
+		return (Y-Ymean)/Ystd
+	Xs = standardize(X)
+	Rs = standardize(ref)
+
+	# missing values count as zero in the sums, but the lags where they fall into the overlap are masked later 
+	Xbad = np.isnan(Xs)
+	Rbad = np.isnan(Rs)
+	Xs[Xbad] = 0.0
+	Rs[Rbad] = 0.0
+
+	# running sums, so that the sums over the overlap of each lag are simple differences  
+	def running_sum(Y):
+		return np.concatenate([np.zeros(shape=Y.shape[:-1]+(1,)),np.cumsum(Y,axis=-1)],axis=-1)
+	cX = running_sum(Xs)
+	cX2 = running_sum(Xs*Xs)
+	cXbad = running_sum(Xbad.astype(float))
+	cR = running_sum(Rs)
+	cR2 = running_sum(Rs*Rs)
+	cRbad = running_sum(Rbad.astype(float))
+
+	# lagged cross products sum_k X[k]*ref[k+L] for all lags 
+	if method == 'fft':
+		nfft = 1
+		while nfft < T+maxlag:
+			nfft = 2*nfft
+		C = np.fft.irfft(np.conj(np.fft.rfft(Xs,nfft,axis=-1))*np.fft.rfft(Rs,nfft,axis=-1),nfft,axis=-1)
+
+	shape = np.broadcast(Xs[...,0],Rs[...,0]).shape
+	R = np.zeros(shape=(len(lags),)+shape)
+	S = np.zeros(shape=(len(lags),)+shape)
+	for ilag,L in enumerate(lags):
+		# X runs over k0..k1-1, ref over k0+L..k1+L-1 
+		k0 = max(0,-L)
+		k1 = min(T,T-L)
+		n = k1-k0
+		if n < 2:
+			R[ilag,...] = np.nan
+			S[ilag,...] = n
+			continue
+		if method == 'fft':
+			Sxy = C[...,L % nfft]
+		else:
+			Sxy = np.einsum('...t,...t->...',Xs[...,k0:k1],Rs[...,k0+L:k1+L])
+		Sx = cX[...,k1]-cX[...,k0]
+		Sxx = cX2[...,k1]-cX2[...,k0]
+		Sy = cR[...,k1+L]-cR[...,k0+L]
+		Syy = cR2[...,k1+L]-cR2[...,k0+L]
+		cov = n*Sxy - Sx*Sy
+		varprod = (n*Sxx - Sx*Sx)*(n*Syy - Sy*Sy)
+		with np.errstate(divide='ignore',invalid='ignore'):
+			rho = cov/np.sqrt(varprod)
+		bad = ((cXbad[...,k1]-cXbad[...,k0]) + (cRbad[...,k1+L]-cRbad[...,k0+L])) > 0
+		bad = bad | (varprod <= 0)
+		R[ilag,...] = np.where(bad,np.nan,rho)
+		S[ilag,...] = n
+
+	return R,S,lags
+
 def RMM(E,climatology_option = 'NODA',hostname='taurus',verbose=False):
 
 	"""
 	this subroutine computes the real-time multivariate MJO (RMM) indices defined by Wheeler and Hendon (2004)
 	this is done by reading in the multivariate EOF of OLR, U850, and U200 (computed from 
 	satellite data and NCEP reanalysis), and then projecting our model's anomaly 
-	fields onto these EOFs.  
+	fields onto these EOFs (see RMM_projection).  
 
 	This code is pretty clunky, because it computes the RMM index over the daterange in E['daterange'], but 
 	it uses all available data in the experiment given by E to compute the standard deviations of anomalies in 
@@ -381,39 +446,11 @@ def RMM(E,climatology_option = 'NODA',hostname='taurus',verbose=False):
 
 	"""
 
-	# read in the multivariate EOFs (eigenvectors)  
-	if hostname == 'taurus':
-		data_dir = '/data/c1/lneef/MJOindex/'
-	fname = 'WH04_EOFstruc.txt'  
-	ff = data_dir+fname  
-
-	EVEC = pd.read_csv(ff,sep=' ',skiprows=9,nrows=432,header=None,engine='python')
-	EVEC.columns=['blank','EV1','EV2']
-	EOF = [EVEC.EV1, EVEC.EV2]
-
-	# read in the normalization factors  
-	NORM = pd.read_csv(ff,skiprows=442,sep='  ',engine='python')
-	NORM.columns = ['normalization_factors']  
-	normfac = NORM.normalization_factors
-	NF_FLUT = normfac[0:144]
-	NF_U850 = normfac[144:288]
-	NF_U200 = normfac[288:432]
-	NF_list = [NF_FLUT,NF_U850,NF_U200]
-
-	# read in the eigenvalues  
-	f = open(ff, "r")
-	lines = f.readlines()
-	eigenvalues = lines[4].split()
-	eigenval1 = float(eigenvalues[0])
-	eigenval2 = float(eigenvalues[1])
-	evalues = [eigenval1,eigenval2]
-	f.close()
-	
 	# load anomalies of the three MJO variable (OLR, U850, U200) for this experiment
 	variable_list = ['FLUT','U','U']
 	levrange_list = [None,[850,850],[200,200]]
 	Anomaly_list = []
-	for variable,levrange,NF in zip(variable_list,levrange_list,NF_list):
+	for variable,levrange in zip(variable_list,levrange_list):
 		Etemp = E.copy()
 		Etemp['variable'] = variable
 		Etemp['levrange'] = levrange
@@ -432,162 +469,167 @@ def RMM(E,climatology_option = 'NODA',hostname='taurus',verbose=False):
 			print('not enough data to compute RMM index -- returning')
 			return None
 
-		# average the normalized anomalies over the 15S-15N latitude band  
+		# average the anomalies over the 15S-15N latitude band  
 		lat1,lon1,ave_anom = aave('WH',anomalies,lat,lon,None,variable_name,averaging_dimension='lat')
 
-		# normalize the anoamlies of each variable field by its standard deviation 
-		#if climatology_option=='NODA':
-			# if we want standard deviations given by the No-DA experiment, do that here 
-			# TODO: subroutine that loads correposnind No-DA experiment for a given experiment 
-		#	Etemp = E.copy()
-		#	Etemp['exp_name'] = 'W0910_NODA'
-		#	S,lat,lon,lev,DR = load_std(Etemp,'ensemble',hostname)
-		#else:
-		#	S,lat,lon,lev,DR = load_std(E,climatology_option,hostname)
-
-		# the compute the "global" std for that variable (it's actually over the vertical and 
-		# horizontal domain given in E)
-		#std = np.nanmean(S)
-
-		# for each time in the array of anomalies, divide out the normalization factor for each MJO variable  
-		# if anomalies were only computed for a single day, it's even simpler
-		anomshape = np.squeeze(ave_anom).shape
-		if len(anomshape) > 2:
-			nT = np.squeeze(ave_anom).shape[1]
-			ave_anom_norm = 0*ave_anom
-			for aa,iT in zip(ave_anom,range(nT)):
-				#ave_anom_norm[:,iT] = np.squeeze(ave_anom[:,iT])/std
-				ave_anom_norm[:,iT] = np.squeeze(ave_anom[:,iT])/NF
-		else:
-			ave_anom_norm = np.squeeze(ave_anom)/NF
-			nT = None
-
 		# put everything into a list
-		Anomaly_list.append(ave_anom_norm)
+		Anomaly_list.append(np.squeeze(ave_anom))
+
+	# normalize the anomalies and project them onto the EOFs, for all times at once 
+	pc = RMM_projection(Anomaly_list,lon1,lon_axis=0,hostname=hostname)
+
+	return pc
 
+def load_RMM_EOFs(hostname='taurus'):
 
-	# concatenate the 3 anomaly fields so that we have a length (144x3) vector for nT points in time  
-	AA = np.concatenate([A for A in Anomaly_list], axis=0)
+	"""
+	read in the multivariate EOFs (eigenvectors) of OLR, U850, and U200 of Wheeler and Hendon (2004), 
+	along with their eigenvalues and the normalization factors of the three variables. 
+	The file is only parsed once per session -- after that, the arrays come from a cache. 
+
+	Returns a dictionary with these entries:
+	EOF: 432 x 2 array of the two leading EOFs (144 longitudes each for OLR, U850, and U200) 
+	eigenvalues: the two corresponding eigenvalues 
+	normalization_factors: the 432 normalization factors 
+	lon: the 144-point longitude grid that the EOFs are defined on 
+	"""
 
-	# compute the principal components  
-	N = EVEC.EV1.shape[0]
-	if nT is None:
-		pc = np.zeros(shape=(2))
-		# loop over eigenvalues and then over 3x longitudes
-		for eof,iev,eigval in zip(EOF,range(2),evalues):	# loop over eigenvectors and eigenvalues
-			for ii in range(N):				# loop over 3xlongitudes  
-				pc[iev] += (AA[ii]*eof[ii])/np.sqrt(eigval)
+	if hostname == 'taurus':
+		data_dir = '/data/c1/lneef/MJOindex/'
 	else:
-		pc = np.zeros(shape=(2,nT))
-		for k in range(nT):	# loop over time  
-			for eof,iev,eigval in zip(EOF,range(2),evalues):	# loop over eigenvectors and eigenvalues
-				for ii in range(N):				# loop over 3xlongitudes  
-					pc[iev,k] += (AA[ii,k]*eof[ii])/np.sqrt(eigval)
+		print('Do not have file paths set for hostname  ',hostname)
+		return None
+	fname = 'WH04_EOFstruc.txt'  
+	ff = data_dir+fname  
+
+	if ff in rmm_eof_cache:
+		return rmm_eof_cache[ff]
+
+	# read in the multivariate EOFs (eigenvectors)  
+	EVEC = pd.read_csv(ff,sep=' ',skiprows=9,nrows=432,header=None,engine='python')
+	EVEC.columns=['blank','EV1','EV2']
+
+	# read in the normalization factors  
+	NORM = pd.read_csv(ff,skiprows=442,sep='  ',engine='python')
+	NORM.columns = ['normalization_factors']  
+
+	# read in the eigenvalues  
+	f = open(ff, "r")
+	lines = f.readlines()
+	eigenvalues = lines[4].split()
+	f.close()
+
+	EOFS = {'EOF':np.column_stack([np.asarray(EVEC.EV1,dtype=float),np.asarray(EVEC.EV2,dtype=float)]),
+		'eigenvalues':np.array([float(eigenvalues[0]),float(eigenvalues[1])]),
+		'normalization_factors':np.asarray(NORM.normalization_factors,dtype=float)[0:432],
+		'lon':np.arange(0,360,2.5)}
+	rmm_eof_cache[ff] = EOFS
+
+	return EOFS
+
+def RMM_lon_interpolation(lon,lon_eof):
+
+	"""
+	return the matrix that linearly interpolates (periodically in longitude) a field on the 
+	longitude grid lon onto the grid of the RMM EOFs, lon_eof. 
+	The matrices are cached per grid, and if the grids are the same, None is returned. 
+	"""
+	lon = np.asarray(lon,dtype=float)
+	if (len(lon) == len(lon_eof)) and np.allclose(lon,lon_eof):
+		return None
+
+	key = (lon.tobytes(),np.asarray(lon_eof,dtype=float).tobytes())
+	if key not in rmm_interpolation_cache:
+		# interpolating each unit vector gives the weights of each model longitude 
+		I = np.eye(len(lon))
+		W = np.column_stack([np.interp(lon_eof,lon,I[:,ii],period=360) for ii in range(len(lon))])
+		rmm_interpolation_cache[key] = W
+
+	return rmm_interpolation_cache[key]
+
+def RMM_projection(Anomaly_list,lon,lon_axis=0,hostname='taurus'):
+
+	"""
+	project meridionally-averaged (15S-15N) anomalies of OLR, U850, and U200 onto the 
+	multivariate EOFs of Wheeler and Hendon (2004) to get the RMM1 and RMM2 indices. 
+
+	INPUTS:
+	Anomaly_list: list of the three anomaly arrays (OLR, U850, U200). Besides longitude, these can 
+		have any other dimensions (e.g. time, or ensemble member x time), which are all computed 
+		in one matrix product. 
+	lon: the longitude grid of the anomalies -- if it isn't the 144-point grid of the EOFs, the 
+		anomalies are interpolated onto that first 
+	lon_axis: the axis of the anomaly arrays that holds longitude. Default is 0. 
+
+	Returns pc, an array with RMM1 and RMM2 along the first axis, followed by the other dimensions 
+	of the anomalies. 
+	"""
+
+	EOFS = load_RMM_EOFs(hostname)
+	if EOFS is None:
+		return None
+	nlon = len(EOFS['lon'])
+	W = RMM_lon_interpolation(lon,EOFS['lon'])
+
+	# stack the normalized anomalies of the 3 variables into a (144x3) x [...] array 
+	AAlist = []
+	for ivar,A in enumerate(Anomaly_list):
+		A = np.moveaxis(np.asarray(A,dtype=float),lon_axis,0)
+		if W is not None:
+			A = np.tensordot(W,A,axes=(1,0))
+		NF = EOFS['normalization_factors'][ivar*nlon:(ivar+1)*nlon]
+		AAlist.append(A/np.reshape(NF,(nlon,)+(1,)*(A.ndim-1)))
+	AA = np.concatenate(AAlist,axis=0)
+
+	# the principal components, for everything at once 
+	P = EOFS['EOF']/np.sqrt(EOFS['eigenvalues'])[None,:]
+	pc = np.tensordot(P,AA,axes=(0,0))
 
 	return pc
 
-def load_climatology(E,climatology_option = 'NODA',hostname='taurus',verbose=False):
+def load_climatology(E,climatology_option = 'NODA',hostname='taurus',verbose=False,nharmonics=None):
 
 	"""
 	Load a climatology option for a given DART experiment. 
 	The choice of climatology is given by 'climatology_option'. Choices are:  
 	'NODA' (default): take the ensemble mean of the corresponding no-DA experiment as a N-year climatology  
+		(averaged over the years it covers for each day of the year -- see experiment_climatology_doy_slice) 
 	'F_W4_L66': CESM-WACCM simulation with observed forcings, 1951-2010 (perfomed by Wuke Wang)  
+
+	nharmonics: for multi-year climatologies like 'F_W4_L66', smooth the day-of-year climatology by 
+		keeping only the annual mean and this many harmonics of the annual cycle (see build_climatology_store). 
+		Default is None, i.e. no smoothing. 
 	"""
 	climatology_option_not_found = True
 
 	if climatology_option == 'NODA' :
 		climatology_option_not_found = False
-		# cycle over the dates in the experiment dictionary 
-		# and load the ensemble mean of the corresponding No-assimilation case 
-		# TODO: a subroutine that returns the corresponding NODA experiment for each case  
-		Xlist = []	
-		ECLIM = E.copy()
-		ECLIM['exp_name'] = 'W0910_NODA'
-		ECLIM['diagn'] = 'Prior'
-		ECLIM['copystring'] = 'ensemble mean'
-		Xclim,lat,lon,lev,DRnew = DSS.DART_diagn_to_array(ECLIM,hostname=hostname,debug=verbose)
-		if len(DRnew) != len(ECLIM['daterange']):
-			print('NOTE: not all requested data were found; returning a revised datarange')
+		# read the day-of-year mean of the ensemble mean of the corresponding No-assimilation case 
+		# (which collects the dates it doesn't have yet -- see update_experiment_climatology_store) 
+		Xclim,lat,lon,lev,DRnew = experiment_climatology_doy_slice(E,climatology_option,'mean',nharmonics,hostname=hostname,verbose=verbose)
 		if Xclim is None:
 			print('Cannot find data for climatology option '+climatology_option+' and experiment '+E['exp_name'])
-			return None, None, None, None
+			return None, None, None, None, None
+		if len(DRnew) != len(E['daterange']):
+			print('NOTE: not all requested data were found; returning a revised datarange')
 
 	if climatology_option == 'F_W4_L66' :
-		from netCDF4 import Dataset
 		climatology_option_not_found = False
-		# in this case, load a single daily climatology calculated from this CESM-WACCM simulation  
-		ff = '/data/c1/lneef/CESM/F_W4_L66/atm/climatology/F_W4_L66.cam.h1.1951-2010.daily_climatology.nc'
-		f = Dataset(ff,'r')
-		lat = f.variables['lat'][:]
-		lon = f.variables['lon'][:]
-		lev = f.variables['lev'][:]
-		time = f.variables['time'][:]
-
-		# load climatology of the desired model variable  
-		variable = E['variable']
-		if E['variable'] == 'US':
-			variable = 'U'
-		if E['variable'] == 'VS':
-			variable = 'V'
-		if E['variable'] == 'OLR':
-			variable = 'FLUT'
-		VV = f.variables[variable][:]
-		f.close()
-
-		# choose the times corresponding to the daterange in E
-		d0 = E['daterange'][0].timetuple().tm_yday	# day in the year where we start  
-		nT = len(E['daterange'])
-		df = E['daterange'][nT-1].timetuple().tm_yday	# day in the year where we start  
-
-		# if df<d0, we have to cycle back to the beginning of the year
-		if df < d0:
-			day_indices = list(range(d0-1,365))+list(range(0,df))
-		else:
-			day_indices = list(range(d0-1,df))
-
-		# also choose the lat, lon, and level ranges corresponding to those in E
-		if E['levrange'] is not None:
-			if E['levrange'][0] == E['levrange'][1]:
-				ll = E['levrange'][0]
-				idx = (np.abs(lev-ll)).argmin()
-				lev2 = lev[idx]
-				k1 = idx
-				k2 = idx
-			else:
-				highest_level_index = (np.abs(lev-E['levrange'][1])).argmin()
-				lowest_level_index = (np.abs(lev-E['levrange'][0])).argmin()
-				# which index is k1 or k2 depends on the direction of lev 
-				if highest_level_index > lowest_level_index:
-					k2 = highest_level_index
-					k1 = lowest_level_index
-				if highest_level_index < lowest_level_index:
-					k1 = highest_level_index
-					k2 = lowest_level_index
-				lev2 = lev[k1:k2+1]
-
-		j2 = (np.abs(lat-E['latrange'][1])).argmin()
-		j1 = (np.abs(lat-E['latrange'][0])).argmin()
-		lat2 = lat[j1:j2+1]
-		i2 = (np.abs(lon-E['lonrange'][1])).argmin()
-		i1 = (np.abs(lon-E['lonrange'][0])).argmin()
-		lon2 = lon[i1:i2+1]
-
-		if len(VV.shape) == 4:
-			Xclim = VV[day_indices,k1:k2+1,j1:j2+1,i1:i2+1]
-		else:
-			Xclim = VV[day_indices,j1:j2+1,i1:i2+1]
+		# in this case, read the days we need from the day-of-year climatology of this CESM-WACCM simulation  
+		# (which is collected from the daily climatology file the first time it is needed -- see build_climatology_store) 
+		day_indices = climatology_day_indices(E['daterange'])
+		Xclim,lat,lon,lev = climatology_doy_slice(E,climatology_option,day_indices,'mean',nharmonics,hostname=hostname,verbose=verbose)
 
 		# in this case, we don't need to change the daterange  
 		DRnew = E['daterange']
 
 	if climatology_option_not_found:
 		print('Climatology option '+climatology_option+' has not been coded yet. Returning None for climatology.')
-		return None, None, None, None
+		return None, None, None, None, None
 
 	return Xclim,lat,lon,lev,DRnew
 
-def load_std(E,std_mode = 'NODA',hostname='taurus',verbose=False):
+def load_std(E,std_mode = 'NODA',hostname='taurus',verbose=False,nharmonics=None):
 
 	"""
 	This subroutine returns the standard deviation of whatever variable is given in E['variable'], 
@@ -596,99 +638,521 @@ def load_std(E,std_mode = 'NODA',hostname='taurus',verbose=False):
 	'std_mode':
 		std_mode='ensemble' simply computes the standard deviation of the DART ensemble  
 			at each time 
+		std_mode='NODA' (default) computes, for each day of the year, the standard deviation of the 
+			ensemble mean of the corresponding no-DA experiment over the years it covers 
+			(see experiment_climatology_doy_slice) 
 		if you set std_mode to any other string, it looks up the multi-year experiment corresponding 
 			to that string using the subroutine 'std_runs' in the user 
 			module experiment_settings. 
 			In this case, the standard deviation  
 			is computed for each time over several years, rather than an ensemble 
+			(nharmonics then optionally smooths it over the year, as in load_climatology)
 
 	"""
 	if std_mode == 'ensemble' :
-		# cycle over the dates in the experiment dictionary 
-		# and load the ensemble mean of the corresponding No-assimilation case 
-		# TODO: a subroutine that returns the corresponding NODA experiment for each case  
-		Xlist = []	
+		# this is the spread of the experiment itself on each date, so it's read straight from its diagnostic files 
 		ECLIM = E.copy()
 		ECLIM['copystring'] = 'ensemble std'
-		Xclim,lat,lon,lev,DRnew = DSS.DART_diagn_to_array(ECLIM,hostname=hostname,debug=verbose)
+		Xclim,lat,lon,lev,DRnew = DSS.DART_diagn_to_array(ECLIM,hostname=hostname,debug=verbose,return_single_variables=True)
+		if Xclim is None:
+			print('Cannot find data for experiment '+E['exp_name'])
+			return None, None, None, None, None
 		if len(DRnew) != len(ECLIM['daterange']):
 			print('NOTE: not all requested data were found; returning a revised datarange')
+
+	if std_mode == 'NODA' :
+		# the day-of-year standard deviation over the years of the corresponding No-assimilation case 
+		Xclim,lat,lon,lev,DRnew = experiment_climatology_doy_slice(E,std_mode,'std',nharmonics,hostname=hostname,verbose=verbose)
 		if Xclim is None:
-			print('Cannot find data for experiment '+E['exp_name'])
-			return None, None, None, None
+			print('Cannot find data for std mode '+std_mode+' and experiment '+E['exp_name'])
+			return None, None, None, None, None
+		if len(DRnew) != len(E['daterange']):
+			print('NOTE: not all requested data were found; returning a revised datarange')
 
 	if std_mode == 'F_W4_L66' :
 
-		# find the corresponding dataset  
-		ff = es.std_runs(std_mode,hostname=hostname,debug=verbose)
+		# read the days we need from the day-of-year standard deviation of the multi-year run 
+		day_indices = climatology_day_indices(E['daterange'])
+		Xclim,lat,lon,lev = climatology_doy_slice(E,std_mode,day_indices,'std',nharmonics,hostname=hostname,verbose=verbose)
 
-		# load the desired variables 
-		from netCDF4 import Dataset
-		f = Dataset(ff,'r')
-		lat = f.variables['lat'][:]
-		lon = f.variables['lon'][:]
-		lev = f.variables['lev'][:]
-		time = f.variables['time'][:]
-
-		variable = E['variable']
-		if E['variable'] == 'US':
-			variable = 'U'
-		if E['variable'] == 'VS':
-			variable = 'V'
-		if E['variable'] == 'OLR':
-			variable = 'FLUT'
-		VV = f.variables[variable][:]
-		f.close()
+		# in this case, we don't need to change the daterange  
+		DRnew = E['daterange']
+
+	return Xclim,lat,lon,lev,DRnew
+
+def climatology_day_indices(daterange):
+
+	# return the indices into a 365-day climatology that cover the days from the 
+	# first to the last date of a daterange 
+	d0 = daterange[0].timetuple().tm_yday	# day in the year where we start  
+	nT = len(daterange)
+	df = daterange[nT-1].timetuple().tm_yday	# day in the year where we end  
+
+	# the 31 Dec of leap years gets the climatology of a regular 31 Dec 
+	d0 = min(d0,365)
+	df = min(df,365)
+
+	# if df<d0, we have to cycle back to the beginning of the year
+	if df < d0:
+		day_indices = list(range(d0-1,365))+list(range(0,df))
+	else:
+		day_indices = list(range(d0-1,df))
 
-		# choose the times corresponding to the daterange in E
-		d0 = E['daterange'][0].timetuple().tm_yday	# day in the year where we start  
-		nT = len(E['daterange'])
-		df = E['daterange'][nT-1].timetuple().tm_yday	# day in the year where we start  
+	return day_indices
 
-		# if df<d0, we have to cycle back to the beginning of the year
-		if df < d0:
-			day_indices = list(range(d0-1,365))+list(range(0,df))
+def climatology_level_range(lev,levrange):
+
+	# return the first and last index of the vertical levels that correspond to a level range 
+	if levrange[0] == levrange[1]:
+		ll = levrange[0]
+		idx = (np.abs(lev-ll)).argmin()
+		k1 = idx
+		k2 = idx
+	else:
+		highest_level_index = (np.abs(lev-levrange[1])).argmin()
+		lowest_level_index = (np.abs(lev-levrange[0])).argmin()
+		# which index is k1 or k2 depends on the direction of lev 
+		if highest_level_index >= lowest_level_index:
+			k2 = highest_level_index
+			k1 = lowest_level_index
 		else:
-			day_indices = list(range(d0-1,df))
-
-		# also choose the lat, lon, and level ranges corresponding to those in E
-		if E['levrange'] is not None:
-			if E['levrange'][0] == E['levrange'][1]:
-				ll = E['levrange'][0]
-				idx = (np.abs(lev-ll)).argmin()
-				lev2 = lev[idx]
-				k1 = idx
-				k2 = idx
+			k1 = highest_level_index
+			k2 = lowest_level_index
+	return k1,k2
+
+def harmonic_basis(ndays,nharmonics):
+
+	# return an ndays x (2*nharmonics+1) matrix of the mean and the first nharmonics harmonics 
+	# of the annual cycle, normalized such that B.T B is the identity 
+	t = 2*np.pi*np.arange(ndays)/float(ndays)
+	columns = [np.ones(shape=(ndays,))]
+	for h in range(1,nharmonics+1):
+		columns.append(np.cos(h*t))
+		columns.append(np.sin(h*t))
+	B = np.column_stack(columns)
+	return B/np.sqrt(np.sum(B*B,axis=0))[None,:]
+
+def climatology_store_file(climatology_option,variable,levrange,statistic='mean',nharmonics=None,hostname='taurus'):
+
+	# the file that holds the day-of-year climatology ('mean') or standard deviation ('std') for a given 
+	# climatology option, variable, and level range 
+	if levrange is None:
+		levstring = 'Lall'
+	else:
+		levstring = 'L'+str(levrange[0])+'-'+str(levrange[1])
+	if nharmonics is None:
+		smoothstring = ''
+	else:
+		smoothstring = '_H'+str(nharmonics)
+	fname = climatology_option+'_'+variable+'_'+statistic+'_'+levstring+smoothstring+'.nc'
+	return os.path.join(es.cache_paths(hostname,'climatology'),fname)
+
+def build_climatology_store(E,climatology_option='F_W4_L66',statistic='mean',nharmonics=None,hostname='taurus',verbose=False,rebuild=False,block_size=31):
+
+	"""
+	Collect the day-of-year climatology ('mean') or standard deviation ('std') of the variable in E['variable'], 
+	on the levels in E['levrange'], for a given climatology option, in a netcdf file in the 
+	'climatology' cache directory. The file is only made once per climatology option, statistic, variable, 
+	and level range (and again if the source file changes), and load_climatology and load_std then read 
+	the days they need from it, rather than reading the whole year every time. 
+
+	The means come from the daily climatology file of a multi-year run, as given by 
+	experiment_settings.climatology_runs, and the standard deviations from the file given by 
+	experiment_settings.std_runs (so far there is 'F_W4_L66'). Each statistic only needs its own source file. 
+
+	INPUTS:
+	E: experiment dictionary -- only the variable and level range are used 
+	climatology_option: which climatology to use 
+	statistic: 'mean' (the default) or 'std' 
+	nharmonics: if this is a number, the climatology or standard deviation is smoothed by keeping only 
+		its annual mean plus the first nharmonics harmonics of the annual cycle. Grid points that are 
+		missing on any day of the year stay missing (NaN) on all days of the smoothed version. 
+		Default is None, i.e. no smoothing. Smoothed and unsmoothed versions are stored in different files. 
+	rebuild: set to True to make the file again, even if it looks up to date 
+	block_size: how many days of the source file to read at once. Default is 31. 
+
+	Returns the name of the file. 
+	"""
+
+	from netCDF4 import Dataset
+
+	# the name of the variable in the model files 
+	variable = E['variable']
+	if E['variable'] == 'US':
+		variable = 'U'
+	if E['variable'] == 'VS':
+		variable = 'V'
+	if E['variable'] == 'OLR':
+		variable = 'FLUT'
+
+	fname = climatology_store_file(climatology_option,variable,E['levrange'],statistic,nharmonics,hostname)
+	if statistic == 'mean':
+		source = es.climatology_runs(climatology_option,hostname=hostname,debug=verbose)
+	else:
+		source = es.std_runs(climatology_option,hostname=hostname,debug=verbose)
+	mtime = repr(os.path.getmtime(source))
+
+	# check whether the file is already there, and made from the current source file 
+	if os.path.exists(fname) and not rebuild:
+		f = Dataset(fname,'r')
+		up_to_date = (f.source_mtime == mtime)
+		f.close()
+		if up_to_date:
+			return fname
+		if verbose:
+			print('source file of climatology '+fname+' has changed -- rebuilding it')
+
+	if verbose:
+		print('building climatology file '+fname)
+
+	# write to a temporary file first, so that other processes never read half a file 
+	tmp_name = fname+'.'+str(os.getpid())+'.tmp'
+	fout = Dataset(tmp_name,'w',format='NETCDF4')
+	fin = Dataset(source,'r')
+	try:
+		V = fin.variables[variable]
+		ndays = V.shape[0]
+		lat = fin.variables['lat'][:]
+		lon = fin.variables['lon'][:]
+		fout.createDimension('doy',ndays)
+		fout.createDimension('lat',len(lat))
+		fout.createDimension('lon',len(lon))
+		fout.createVariable('lat','f4',('lat',))[:] = lat
+		fout.createVariable('lon','f4',('lon',))[:] = lon
+		if len(V.shape) == 4:
+			lev = fin.variables['lev'][:]
+			if E['levrange'] is None:
+				k1 = 0
+				k2 = len(lev)-1
 			else:
-				highest_level_index = (np.abs(lev-E['levrange'][1])).argmin()
-				lowest_level_index = (np.abs(lev-E['levrange'][0])).argmin()
-				# which index is k1 or k2 depends on the direction of lev 
-				if highest_level_index > lowest_level_index:
-					k2 = highest_level_index
-					k1 = lowest_level_index
-				if highest_level_index < lowest_level_index:
-					k1 = highest_level_index
-					k2 = lowest_level_index
-				lev2 = lev[k1:k2+1]
-
-		j2 = (np.abs(lat-E['latrange'][1])).argmin()
-		j1 = (np.abs(lat-E['latrange'][0])).argmin()
-		lat2 = lat[j1:j2+1]
-		i2 = (np.abs(lon-E['lonrange'][1])).argmin()
-		i1 = (np.abs(lon-E['lonrange'][0])).argmin()
-		lon2 = lon[i1:i2+1]
-
-		if len(VV.shape) == 4:
-			Xclim = VV[day_indices,k1:k2+1,j1:j2+1,i1:i2+1]
+				k1,k2 = climatology_level_range(lev,E['levrange'])
+			fout.createDimension('lev',k2-k1+1)
+			fout.createVariable('lev','f4',('lev',))[:] = lev[k1:k2+1]
+			dims = ('doy','lev','lat','lon')
+			chunks = (1,k2-k1+1,len(lat),len(lon))
+			def read_block(d1,d2):
+				return np.ma.filled(np.ma.asarray(V[d1:d2,k1:k2+1,:,:],dtype=float),np.nan)
 		else:
-			Xclim = VV[day_indices,j1:j2+1,i1:i2+1]
+			dims = ('doy','lat','lon')
+			chunks = (1,len(lat),len(lon))
+			def read_block(d1,d2):
+				return np.ma.filled(np.ma.asarray(V[d1:d2,:,:],dtype=float),np.nan)
+		Vout = fout.createVariable(statistic,'f4',dims,zlib=True,complevel=4,shuffle=True,chunksizes=chunks,fill_value=np.nan)
+
+		# if smoothing, first project the whole year onto the harmonics, one block of days at a time, 
+		# and keep track of the grid points that are missing on any day 
+		if nharmonics is not None:
+			B = harmonic_basis(ndays,nharmonics)
+			coefs = None
+			bad = None
+			for d1 in range(0,ndays,block_size):
+				d2 = min(d1+block_size,ndays)
+				X = read_block(d1,d2)
+				isbad = np.isnan(X)
+				c = np.tensordot(B[d1:d2,:],np.where(isbad,0.0,X),axes=(0,0))
+				if coefs is None:
+					coefs = c
+					bad = isbad.any(axis=0)
+				else:
+					coefs = coefs + c
+					bad = bad | isbad.any(axis=0)
+
+		# now write the (smoothed) days block by block 
+		for d1 in range(0,ndays,block_size):
+			d2 = min(d1+block_size,ndays)
+			if nharmonics is None:
+				Vout[d1:d2,...] = read_block(d1,d2)
+			else:
+				Xs = np.tensordot(B[d1:d2,:],coefs,axes=(1,0))
+				Xs[:,bad] = np.nan
+				Vout[d1:d2,...] = Xs
+
+		fout.variable = variable
+		fout.statistic = statistic
+		fout.climatology_option = climatology_option
+		fout.source_file = source
+		fout.source_mtime = mtime
+		if nharmonics is not None:
+			fout.nharmonics = nharmonics
+		fout.history = 'Created ' + datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+		fout.source = 'Python module MJO.py'
+	except:
+		# don't leave half-written files behind 
+		fin.close()
+		fout.close()
+		os.remove(tmp_name)
+		raise
+	fin.close()
+	fout.close()
+	os.rename(tmp_name,fname)
+
+	return fname
+
+def climatology_doy_slice(E,climatology_option='F_W4_L66',day_indices=None,statistic='mean',nharmonics=None,hostname='taurus',verbose=False):
 
-		# in this case, we don't need to change the daterange  
-		DRnew = E['daterange']
+	"""
+	return the day-of-year climatology ('mean') or standard deviation ('std') for some days of the year, 
+	for the variable, level range, and lat/lon ranges in E, from the file made by build_climatology_store 
+	(which is built first if it doesn't exist yet). 
 
-	return Xclim,lat,lon,lev,DRnew
+	INPUTS:
+	day_indices: list of indices of the days (0 is 1 Jan). Default is the days of E['daterange'] 
+		(see climatology_day_indices). 
+
+	Returns the climatology array, shaped days x [lev x] lat x lon, and the lat, lon, and lev arrays 
+	that go with it. 
+	"""
+	from netCDF4 import Dataset
+
+	if day_indices is None:
+		day_indices = climatology_day_indices(E['daterange'])
+	fname = build_climatology_store(E,climatology_option,statistic,nharmonics,hostname=hostname,verbose=verbose)
+
+	f = Dataset(fname,'r')
+	lat = f.variables['lat'][:]
+	lon = f.variables['lon'][:]
+	if 'lev' in f.variables:
+		lev = f.variables['lev'][:]
+	else:
+		lev = None
+
+	# also choose the lat and lon ranges corresponding to those in E
+	j2 = (np.abs(lat-E['latrange'][1])).argmin()
+	j1 = (np.abs(lat-E['latrange'][0])).argmin()
+	i2 = (np.abs(lon-E['lonrange'][1])).argmin()
+	i1 = (np.abs(lon-E['lonrange'][0])).argmin()
+
+	# only the requested days are read -- in increasing order, and then put into the requested order 
+	days = sorted(set(day_indices))
+	V = f.variables[statistic]
+	if lev is None:
+		X = V[days,j1:j2+1,i1:i2+1]
+	else:
+		X = V[days,:,j1:j2+1,i1:i2+1]
+	f.close()
+	X = np.ma.filled(np.ma.asarray(X,dtype=float),np.nan)
+	X = X[[days.index(d) for d in day_indices],...]
+
+	return X,lat[j1:j2+1],lon[i1:i2+1],lev
+
+def climatology_experiment(E,climatology_option='NODA'):
+
+	# return the experiment dictionary of the run that serves as the climatology for E under a given 
+	# climatology option, or None if the option isn't a run that we read ourselves 
+	# TODO: a subroutine that returns the corresponding NODA experiment for each case  
+	if climatology_option == 'NODA':
+		ECLIM = E.copy()
+		ECLIM['exp_name'] = 'W0910_NODA'
+		ECLIM['diagn'] = 'Prior'
+		ECLIM['copystring'] = 'ensemble mean'
+		return ECLIM
+	return None
+
+def update_experiment_climatology_store(E,climatology_option='NODA',daterange=None,hostname='taurus',verbose=False,nprocs=1,rebuild=False,block_size=31):
+
+	"""
+	Collect the day-of-year statistics of the run that serves as the climatology of an experiment 
+	(see climatology_experiment -- so far this is the ensemble mean of the no-DA run for 'NODA'), 
+	for the variable in E['variable'] and the levels in E['levrange'], in a netcdf file in the 
+	'climatology' cache directory -- one file per climatology run, variable, and level range. 
+
+	Rather than the fields themselves, the file holds, for every day of the year and every grid point, 
+	the sum, the sum of squares, and the number of the values that have been added so far, so that 
+	the means and standard deviations of any day of the year can be read from it 
+	(see experiment_climatology_doy_slice). 
+	The dates that have been added are recorded along an unlimited time dimension, so only dates 
+	that aren't in the file yet are read from the climatology run (in blocks of block_size dates, 
+	spread over nprocs processes -- see DSS.DART_diagn_to_array), and the file can be extended later. 
+	Dates that can't be loaded are tried again the next time. 
+
+	INPUTS:
+	E: experiment dictionary 
+	climatology_option: see load_climatology 
+	daterange: dates to add -- default is E['daterange'] 
+	rebuild: set to True to start the file over 
+
+	Returns the name of the file, or None if the climatology option isn't a run. 
+	"""
+
+	from netCDF4 import Dataset
+
+	ECLIM = climatology_experiment(E,climatology_option)
+	if ECLIM is None:
+		print('Climatology option '+str(climatology_option)+' is not a climatology run. Returning None.')
+		return None
+	# the whole horizontal grid goes into the file -- the lat and lon ranges are chosen when reading it 
+	ECLIM['latrange'] = [-90,90]
+	ECLIM['lonrange'] = [0,360]
+	if daterange is None:
+		daterange = E['daterange']
+
+	fname = climatology_store_file(ECLIM['exp_name']+'_'+ECLIM['diagn'],E['variable'],E['levrange'],'moments',None,hostname)
+	if rebuild and os.path.exists(fname):
+		os.remove(fname)
+
+	# find the dates that still need to be added 
+	if os.path.exists(fname):
+		ff = Dataset(fname,'a')
+		time_list = list(np.ma.filled(ff.variables['time'][:],np.nan))
+		written = list(np.ma.filled(ff.variables['written'][:],0))
+	else:
+		ff = None
+		time_list = []
+		written = []
+	new_dates = []
+	for date in daterange:
+		it = DSS.covariance_series_index(time_list,date)
+		if (it is None) or (written[it] != 1):
+			new_dates.append(date)
+	if verbose:
+		print('adding '+str(len(new_dates))+' dates to climatology file '+fname)
+
+	try:
+		for b1 in range(0,len(new_dates),block_size):
+			block = new_dates[b1:b1+block_size]
+			Eload = ECLIM.copy()
+			Eload['daterange'] = block
+			D = DSS.DART_diagn_to_array(Eload,hostname=hostname,debug=verbose,preallocate=True,nprocs=nprocs,cache=False)
+			if (type(D) is not dict) or (D['data'] is None):
+				continue
+			V = np.ma.filled(np.ma.asarray(D['data'],dtype=float),np.nan)
+
+			# order the dimensions as [lev x] lat x lon x time, dropping the (single) copy 
+			names = DSS.field_dimension_names(V[...,0],'DART',D['lat'],D['lon'],D['lev'])
+			field_dims = [d for d in ['lev','lat','lon'] if d in names]
+			copy_axes = [ii for ii,d in enumerate(names) if d == 'copy']
+			if any([V.shape[ii] != 1 for ii in copy_axes]):
+				raise RuntimeError('update_experiment_climatology_store: the climatology run has to be a single copy')
+			V = np.transpose(V,[names.index(d) for d in field_dims]+copy_axes+[V.ndim-1])
+			V = V.reshape(V.shape[:len(field_dims)]+(len(block),))
+
+			if ff is None:
+				ff = Dataset(fname,'w',format='NETCDF4')
+				ff.createDimension('time',None)
+				ff.createDimension('doy',365)
+				times = ff.createVariable('time','f8',('time',))
+				times.units = 'days since 1600-01-01 00:00:00'
+				ff.createVariable('written','i1',('time',),fill_value=0)
+				for d in field_dims:
+					ff.createDimension(d,len(D[d]))
+					ff.createVariable(d,'f4',(d,))[:] = D[d]
+				dims = tuple(['doy']+field_dims)
+				chunks = tuple([1]+[len(D[d]) for d in field_dims])
+				for name,dtype in [('sum','f8'),('sumsq','f8'),('count','i4')]:
+					ff.createVariable(name,dtype,dims,zlib=True,complevel=4,chunksizes=chunks,fill_value=0)
+				ff.variable = E['variable']
+				ff.climatology_option = climatology_option
+				ff.description = 'day-of-year sums, sums of squares, and counts of experiment '+ECLIM['exp_name']+', diagnostic '+ECLIM['diagn']+', copy '+ECLIM['copystring']
+				ff.history = 'Created ' + datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+				ff.source = 'Python module MJO.py'
+
+			# fold each date into its day of the year 
+			for it,date in enumerate(block):
+				if D['missing'][it]:
+					continue
+				d = min(date.timetuple().tm_yday,365)-1
+				X = V[...,it]
+				ok = np.isfinite(X)
+				X = np.where(ok,X,0.0)
+				ff.variables['sum'][d,...] = np.ma.filled(ff.variables['sum'][d,...],0)+X
+				ff.variables['sumsq'][d,...] = np.ma.filled(ff.variables['sumsq'][d,...],0)+X*X
+				ff.variables['count'][d,...] = np.ma.filled(ff.variables['count'][d,...],0)+ok
+				jt = DSS.covariance_series_index(time_list,date)
+				if jt is None:
+					jt = len(time_list)
+					time_list.append(dart.covariance_series_time(date))
+					written.append(0)
+					ff.variables['time'][jt] = time_list[jt]
+				ff.variables['written'][jt] = 1
+				written[jt] = 1
+			ff.sync()
+	finally:
+		if ff is not None:
+			ff.close()
+
+	if not os.path.exists(fname):
+		return None
+	return fname
+
+def experiment_climatology_doy_slice(E,climatology_option='NODA',statistic='mean',nharmonics=None,hostname='taurus',verbose=False,nprocs=1,block_size=31):
+
+	"""
+	return the day-of-year mean ('mean') or standard deviation ('std') of the climatology run of an experiment 
+	(see climatology_experiment) for each date in E['daterange'], for the variable, level range, 
+	and lat/lon ranges in E. The statistics are read from the file made by 
+	update_experiment_climatology_store, after adding any dates of E['daterange'] that aren't in it yet. 
+
+	The standard deviation is over all the years that were added for that day of the year 
+	(N-1 in the denominator), so it's NaN where there is only one year. 
+	nharmonics: if this is a number, the statistic is smoothed by keeping only its annual mean plus 
+		the first nharmonics harmonics of the annual cycle. This needs every day of the year -- if some 
+		are missing, the statistic isn't smoothed. Default is None (no smoothing). 
+
+	Returns the statistic, shaped days x [lev x] lat x lon, lat, lon, lev, and the dates of E['daterange'] 
+	for which there are data for that day of the year (like DSS.DART_diagn_to_array, dates without 
+	data are dropped). 
+	"""
+	from netCDF4 import Dataset
+
+	fname = update_experiment_climatology_store(E,climatology_option,E['daterange'],hostname=hostname,verbose=verbose,nprocs=nprocs)
+	if fname is None:
+		return None,None,None,None,None
+
+	f = Dataset(fname,'r')
+	lat = f.variables['lat'][:]
+	lon = f.variables['lon'][:]
+	if 'lev' in f.variables:
+		lev = f.variables['lev'][:]
+	else:
+		lev = None
+	j2 = (np.abs(lat-E['latrange'][1])).argmin()
+	j1 = (np.abs(lat-E['latrange'][0])).argmin()
+	i2 = (np.abs(lon-E['lonrange'][1])).argmin()
+	i1 = (np.abs(lon-E['lonrange'][0])).argmin()
+
+	def read_statistic(days):
+		S = np.ma.filled(f.variables['sum'][days,...,j1:j2+1,i1:i2+1],0)
+		SS = np.ma.filled(f.variables['sumsq'][days,...,j1:j2+1,i1:i2+1],0)
+		N = np.ma.filled(f.variables['count'][days,...,j1:j2+1,i1:i2+1],0).astype(float)
+		with np.errstate(invalid='ignore',divide='ignore'):
+			mean = np.where(N > 0,S/N,np.nan)
+			if statistic == 'mean':
+				return mean,N
+			var = np.where(N > 1,(SS-N*mean*mean)/(N-1),np.nan)
+		return np.sqrt(np.maximum(var,0.0)),N
+
+	# the days of the year that have data 
+	day_of_date = [min(d.timetuple().tm_yday,365)-1 for d in E['daterange']]
+	days = sorted(set(day_of_date))
+	X,N = read_statistic(days)
+	has_data = [N[ii,...].max() > 0 for ii in range(len(days))]
+	DRnew = [date for date,d in zip(E['daterange'],day_of_date) if has_data[days.index(d)]]
+	day_indices = [d for d in day_of_date if has_data[days.index(d)]]
+
+	if nharmonics is not None:
+		# project the whole year onto the harmonics, one block of days at a time 
+		B = harmonic_basis(365,nharmonics)
+		coefs = 0.0
+		complete = True
+		for d1 in range(0,365,block_size):
+			d2 = min(d1+block_size,365)
+			Xb,Nb = read_statistic(slice(d1,d2))
+			if np.isnan(Xb).any():
+				complete = False
+				break
+			coefs = coefs + np.tensordot(B[d1:d2,:],Xb,axes=(0,0))
+		if complete:
+			X = np.tensordot(B[day_indices,:],coefs,axes=(1,0))
+		else:
+			print('Not every day of the year is in '+fname+' -- returning the climatology without smoothing')
+			nharmonics = None
+	if nharmonics is None:
+		X = X[[days.index(d) for d in day_indices],...]
+	f.close()
+
+	return X,lat[j1:j2+1],lon[i1:i2+1],lev,DRnew
 
-def ano(E,climatology_option = 'NODA',hostname='taurus',verbose=False):
+def ano(E,climatology_option = 'NODA',hostname='taurus',verbose=False,nprocs=1,read_ahead=None,nharmonics=None):
 
 	"""
 	Compute anomaly fields relative to some climatology
@@ -697,80 +1161,227 @@ def ano(E,climatology_option = 'NODA',hostname='taurus',verbose=False):
 	'NODA': take the ensemble mean of the corresponding no-DA experiment as a 40-year climatology  
 	'F_W4_L66': daily climatology of a CESM+WACCM simulation with realistic forcings, 1951-2010
 	None: don't subtract out anything -- just return the regular fields in the same shape as other "anomalies"  
+
+	The days are loaded, and the climatology subtracted, by ano_pipeline -- see there for nprocs, 
+	read_ahead, and nharmonics. 
+	Note that E['daterange'] is changed to the dates that the anomalies were computed for. 
+
+	Returns the anomalies and the climatology (both with time as the last dimension), lat, lon, lev, and the daterange 
 	"""
+	D = ano_pipeline(E,climatology_option,hostname=hostname,verbose=verbose,nprocs=nprocs,read_ahead=read_ahead,nharmonics=nharmonics)
+	if D is None:
+		return None,None,None,None,None,None
+	if len(D['daterange']) != len(E['daterange']):
+		d1 = D['daterange'][0].strftime("%Y-%m-%d")
+		d2 = D['daterange'][len(D['daterange'])-1].strftime("%Y-%m-%d")
+		print('Changing the experiment daterange to '+d1+' to '+d2)
+	E['daterange'] = D['daterange']
+
+	# if only retrieving a single date, squeeze out the length-one time dimension 
+	AA = D['anomalies']
+	XclimR = D['climatology']
+	if len(D['daterange']) == 1:
+		AA = np.squeeze(AA)
+		if XclimR is not None:
+			XclimR = np.squeeze(XclimR)
+
+	return AA,XclimR,D['lat'],D['lon'],D['lev'],D['daterange']
+
+def ano_pipeline(E,climatology_option='NODA',copystrings=None,hostname='taurus',verbose=False,nprocs=1,read_ahead=None,pool_type='process',nharmonics=None,memmap_dir=None):
 
-	# load climatology 
-	Xclim,lat,lon,lev,DR = load_climatology(E,climatology_option,hostname)
+	"""
+	Compute the daily anomalies of the model fields in an experiment with respect to a climatology, 
+	for one or several ensemble members (or other copies) at once. 
 
-	# change the daterange in the anomalies to suit what was found for climatology  
-	if len(DR) != len(E['daterange']):
-		print('Changing the experiment daterange to the dates found for the requested climatology')
-		E['daterange'] = DR
-		d1 = DR[0].strftime("%Y-%m-%d")
-		d2 = DR[len(E['daterange'])-1].strftime("%Y-%m-%d")
-		print('new daterange goes from '+d1+' to '+d2)
+	The climatology is loaded once, for all dates. Each (copy, date) pair is then read from the model history 
+	files by ano_worker, which also subtracts the climatology of that date, and the result is written 
+	straight into its slice of an output array that is allocated once. 
+	With nprocs > 1, the days are read by a pool of workers that always has the next read_ahead days 
+	on the way, but never more, so that finished days don't pile up in memory while an earlier 
+	day is still being read. 
 
-	# some climatologies are only available at daily resolution, so 
-	# in that case we have to change the daterange in E to be daily  
-	if (climatology_option == 'F_W4_L66'):
+	INPUTS:
+	E: experiment dictionary 
+	climatology_option: see ano. For climatologies from multi-year runs (so far 'F_W4_L66'), 
+		the anomalies are computed for every day between the first and last dates in E['daterange']. 
+	copystrings: list of copystrings to compute anomalies for, e.g. all the ensemble members. 
+		Default is None, which just uses E['copystring']
+	nprocs: number of workers that read days at the same time. Default is 1. 
+	read_ahead: how many days can be on the way at any time. Default is 2*nprocs. 
+	pool_type: 'process' (the default) for a multiprocessing pool, or 'thread' for a pool of threads, which 
+		avoids copying the climatology and the results between processes. 
+	nharmonics: smoothing of multi-year climatologies -- see load_climatology 
+	memmap_dir: if this is a directory, the output array is a numpy memmap in a temporary file in that 
+		directory (see DSS.DART_diagn_to_array). The file is unlinked right away, or, where that isn't 
+		possible, left to the caller as D['memmap_file']. Default is None. 
+
+	Returns a dictionary with: 
+	'anomalies': array of shape [copy x] [lev x] lat x lon x time -- the copy dimension is only 
+		there if a list of copystrings was given. 
+	'climatology': the climatology, [lev x] lat x lon x time (None if climatology_option is None) 
+	'lat','lon','lev','daterange','copystrings'
+	'missing': boolean array, [copy x] time, which marks the (copy, date) pairs that could not be loaded -- 
+		their anomalies are NaN. 
+	"""
+
+	# load the climatology for all dates at once  
+	ECLIM = E.copy()
+	if climatology_option == 'F_W4_L66':
+		# these climatologies are daily, so we compute daily anomalies 
 		d0 = E['daterange'][0]
 		df = E['daterange'][len(E['daterange'])-1]
-		days = df-d0
-		DRnew =  dart.daterange(date_start=d0, periods=days.days+1, DT='1D')
-		E['daterange'] = DRnew
-
-	# load the desired model fields for the experiment
-	Xlist = []	# empty list to hold the fields we retrieve for every day  
-	for date in E['daterange']:
-		X,lat0,lon0,lev0 = DSS.compute_DART_diagn_from_model_h_files(E,date,hostname=hostname,verbose=verbose)
-		if X is not None:
-			Xs = np.squeeze(X)
-			Xlist.append(Xs)
-			lat = lat0
-			lon = lon0
-			lev = lev0
+		DR = dart.daterange(date_start=d0, periods=(df-d0).days+1, DT='1D')
+		ECLIM['daterange'] = DR
+		day_indices = [min(d.timetuple().tm_yday,365)-1 for d in DR]
+		Xclim,lat,lon,lev = climatology_doy_slice(ECLIM,climatology_option,day_indices,'mean',nharmonics,hostname=hostname,verbose=verbose)
+	elif climatology_option is None:
+		DR = E['daterange']
+		Xclim = None
+	else:
+		Xclim,lat,lon,lev,DR = load_climatology(ECLIM,climatology_option,hostname,verbose,nharmonics=nharmonics)
+		if Xclim is None:
+			return None
+	T = len(DR)
+
+	# bring the climatology into the shape of the anomalies: [lev x] lat x lon x time 
+	if Xclim is not None:
+		Xclim = np.ma.filled(np.ma.asarray(Xclim,dtype=float),np.nan)
+		# all the climatology options return time first -- drop any other singleton dimensions, 
+		# since the model fields are squeezed too (see ano_worker) 
+		Xclim = np.moveaxis(Xclim,0,-1)
+		Xclim = Xclim.reshape([n for n in Xclim.shape[:-1] if n != 1]+[T])
+
+	if copystrings is None:
+		CS = [E['copystring']]
+	else:
+		CS = list(copystrings)
+	M = len(CS)
+
+	# the list of everything that has to be read -- dates vary fastest, so that the read-ahead 
+	# window covers a few days of one copy at a time 
+	arglist = []
+	for cs in CS:
+		Ecopy = E.copy()
+		Ecopy['copystring'] = cs
+		for it,date in enumerate(DR):
+			if Xclim is None:
+				arglist.append((Ecopy,date,None,hostname,verbose))
+			else:
+				arglist.append((Ecopy,date,Xclim[...,it],hostname,verbose))
+
+	if read_ahead is None:
+		read_ahead = 2*nprocs
+	read_ahead = max(read_ahead,nprocs,1)
+
+	if nprocs > 1:
+		if pool_type == 'thread':
+			from multiprocessing.pool import ThreadPool
+			pool = ThreadPool(processes=nprocs)
+		else:
+			import multiprocessing
+			pool = multiprocessing.Pool(processes=nprocs)
+	else:
+		pool = None
+
+	missing = np.zeros(shape=(M,T),dtype=bool)
+	AA = None
+	mmfile = None
+	lat = None
+	lon = None
+	lev = None
+	try:
+		# keep at most read_ahead days on the way  
+		from collections import deque
+		pending = deque()
+		next_task = 0
+		for itask in range(len(arglist)):
+			while (pool is not None) and (next_task < len(arglist)) and (len(pending) < read_ahead):
+				pending.append(pool.apply_async(ano_worker,(arglist[next_task],)))
+				next_task = next_task + 1
+			if pool is None:
+				result = ano_worker(arglist[itask])
+			else:
+				result = pending.popleft().get()
+			im,it = divmod(itask,T)
+			if result is None:
+				missing[im,it] = True
+				if verbose:
+					print('no data for '+CS[im]+' on '+DR[it].strftime("%Y-%m-%d"))
+				continue
+			A,lat,lon,lev = result
+
+			# allocate the output when we see the first field  
+			if AA is None:
+				shape = (M,)+A.shape+(T,)
+				if memmap_dir is not None:
+					import tempfile
+					fd,mmfile = tempfile.mkstemp(suffix='.dat',prefix='MJO_ano_',dir=memmap_dir)
+					os.close(fd)
+					if verbose:
+						print('writing the anomalies to memmap file '+mmfile)
+					AA = np.memmap(mmfile,dtype=float,mode='w+',shape=shape)
+					# unlink the file right away -- see DSS.DART_diagn_to_array_preallocated 
+					try:
+						os.remove(mmfile)
+						mmfile = None
+					except OSError:
+						pass
+				else:
+					AA = np.empty(shape,dtype=float)
+				AA[...] = np.nan
+			AA[im,...,it] = A
+	except:
+		# drop the reads that are still on the way if something went wrong 
+		if pool is not None:
+			pool.terminate()
+		raise
+	if pool is not None:
+		pool.close()
+		pool.join()
+
+	if AA is None:
+		print('Could not load any model fields for experiment '+E['exp_name']+' and variable '+E['variable'])
+		return None
 
 	# check that the right vertical levels were loaded
 	if verbose:
-		print('------computing daily anomalies for the following vertical levels and variable:-------')
+		print('------computed daily anomalies for the following vertical levels and variable:-------')
 		print(lev)
 		print(E['variable'])
 
-	# compute anomalies:
-	# for this we turn the model fields into a matrix and subtract from the climatology
-	XX = np.concatenate([X[..., np.newaxis] for X in Xlist], axis=len(Xs.shape))
-	if climatology_option == None:
-		AA = XX
+	D = dict()
+	if copystrings is None:
+		D['anomalies'] = AA[0,...]
+		D['missing'] = missing[0,:]
 	else:
-		# if the climatology does not have shape lat x lon x lev x time, 
-		# run swapaxes 2x to get it as such  
-		# NOTE: this is still a kludge and probably wont work with all datasets - check this carefully 
-		# with your own data 
-		XclimS = np.squeeze(Xclim)
-		nT = len(DRnew)
-		lastdim = len(XclimS.shape)-1
-		for s,ii in zip(XclimS.shape,range(len(XclimS.shape))):
-			if s == nT:
-				time_dim = ii
-
-		# if only retrieveing a single date, don't need to do any reshaping
-		# but might need to squeeze out a length-one time dimension
-		if nT == 1:
-			XclimR = XclimS
-			XX = np.squeeze(XX)
-		else:
-			# if time is the last dimension, don't need to reshape Xclim 
-			if time_dim == lastdim: 
-				XclimR = XclimS
-			# if time is the first dimension, need to reshape Xclim
-			if time_dim == 0:	
-				Xclim2 = XclimS.swapaxes(0,lastdim)
-				XclimR = Xclim2.swapaxes(0,1)
-
-
-		AA = XX-XclimR
+		D['anomalies'] = AA
+		D['missing'] = missing
+	D['climatology'] = Xclim
+	D['lat'] = lat
+	D['lon'] = lon
+	D['lev'] = lev
+	D['daterange'] = DR
+	D['copystrings'] = CS
+	if mmfile is not None:
+		D['memmap_file'] = mmfile
+	return D
+
+def ano_worker(args):
 
-	return AA,XclimR,lat,lon,lev,DR
+	"""
+	Read the model fields for one copy and one date, and subtract the climatology of that date. 
+	This is the unit of work of ano_pipeline. 
+	"""
+	E,date,Xclim,hostname,verbose = args
+	D = DSS.compute_DART_diagn_from_model_h_files(E,date,hostname=hostname,verbose=verbose)
+	if D is None:
+		return None
+	if D['data'] is None:
+		return None
+	A = np.ma.filled(np.ma.asarray(np.squeeze(D['data']),dtype=float),np.nan)
+	if Xclim is not None:
+		A = A-Xclim
+	return A,D['lat'],D['lon'],D['lev']
 
 def filter(daily_anomalies,filter_order = 50, return_as_vector = True):
 
@@ -780,7 +1391,9 @@ def filter(daily_anomalies,filter_order = 50, return_as_vector = True):
 
 	note that here the input data have to have DAILY resolution  
 
-	input filter_order gives the order of the Lanczos Filter - it's defaults is 50 , for a 201-point filter (not sure about this yet-- need to check)  
+	input filter_order gives the order of the Lanczos Filter - it's defaults is 50, for a 101-point filter 
+	(see lanczos_weights). The whole field is filtered along its last (time) axis in one go by lanczos_filter, 
+	which also handles missing days and the ends of the time series.  
 	"""
 
 	# turn the anomaly field into a vectors in time 
@@ -797,11 +1410,7 @@ def filter(daily_anomalies,filter_order = 50, return_as_vector = True):
 	f_high = 0.05		# 20 days 
 	n = filter_order  
 
-	fil = LF.LanczosFilter("bp",f_low,f_high,n)
-
-	FA = A*0
-	for ii in range(len(A)):
-		FA[ii] = fil.getfiltered(A[ii,:])
+	FA = lanczos_filter(A,n,f_low,f_high,axis=-1)
     
 	# if return_as_vector is false, reshape the filtered fields to 3D
 	if return_as_vector:
@@ -815,6 +1424,126 @@ def filter(daily_anomalies,filter_order = 50, return_as_vector = True):
 
 	return daily_anomalies,filtered_anomalies
 
+def lanczos_weights(filter_order=50,f_low=0.01,f_high=0.05,filter_type='bp'):
+
+	"""
+	return the 2*filter_order+1 weights of a Lanczos filter (Duchon, 1979), 
+	for the frequencies given in cycles per time step. 
+	filter_type can be 'lp' (low pass, cutoff f_high), 'hp' (high pass, cutoff f_low), 
+	or 'bp' (band pass, between f_low and f_high -- the default). 
+	The weights are cached, since they only depend on these inputs.  
+	"""
+
+	key = (filter_order,f_low,f_high,filter_type)
+	if key in lanczos_weights_cache:
+		return lanczos_weights_cache[key]
+
+	n = filter_order
+	k = np.arange(1,n+1)
+	# the Lanczos sigma factors, which damp the Gibbs ripples of the truncated ideal filter  
+	sigma = np.sin(np.pi*k/n)/(np.pi*k/n)
+
+	# one half of the response of an ideal low-pass filter, times the sigma factors 
+	def lowpass(fc):
+		wl = np.zeros(shape=(n+1,))
+		wl[0] = 2*fc
+		wl[1:] = sigma*np.sin(2*np.pi*fc*k)/(np.pi*k)
+		return wl
+
+	if filter_type == 'lp':
+		w = lowpass(f_high)
+	if filter_type == 'hp':
+		w = -lowpass(f_low)
+		w[0] = w[0] + 1.0
+	if filter_type == 'bp':
+		w = lowpass(f_high)-lowpass(f_low)
+
+	# the filter is symmetric, so mirror the weights 
+	W = np.concatenate([w[:0:-1],w])
+	lanczos_weights_cache[key] = W
+
+	return W
+
+def lanczos_filter(X,filter_order=50,f_low=0.01,f_high=0.05,filter_type='bp',axis=-1,edges='taper',max_missing=0.1,method='auto'):
+
+	"""
+	apply a Lanczos filter (see lanczos_weights) along one axis (usually time) of an array of any shape, 
+	in one go. 
+
+	INPUTS:
+	X: the data array, e.g. lat x lon x time anomalies. Missing days should be NaN (or masked). 
+	filter_order, f_low, f_high, filter_type: define the filter -- see lanczos_weights. The defaults 
+		give the 20-100 day band pass filter used for MJO diagnostics with daily data. 
+	axis: the axis to filter along. Default is the last one. 
+	edges: what to do at the start and end of the series, where the filter window sticks out: 
+		'taper' (default): taper the first and last filter_order points of the series to zero with a 
+			cosine, and treat everything beyond as zero 
+		'nan': return NaN wherever the filter window sticks out 
+	max_missing: missing days are treated as zeros, but if they make up more than this fraction of 
+		the (absolute) filter weight at some time, the output there is NaN. Default is 0.1. 
+	method: 'direct' adds up shifted copies of the data, 'fft' convolves with FFTs, which is faster 
+		for long windows. 'auto' (default) chooses between them based on the window length. 
+
+	Returns the filtered array, with the same shape as X. 
+	"""
+
+	W = lanczos_weights(filter_order,f_low,f_high,filter_type)
+	n = filter_order
+	nw = len(W)
+	if method == 'auto':
+		if nw > 64:
+			method = 'fft'
+		else:
+			method = 'direct'
+
+	X = np.moveaxis(np.ma.filled(np.ma.asarray(X,dtype=float),np.nan),axis,-1)
+	T = X.shape[-1]
+	missing = np.isnan(X)
+	X0 = np.where(missing,0.0,X)
+
+	if edges == 'taper':
+		m = min(n,T//2)
+		if m > 0:
+			taper = np.ones(shape=(T,))
+			ramp = 0.5*(1.0-np.cos(np.pi*(np.arange(m)+0.5)/m))
+			taper[0:m] = ramp
+			taper[T-m:T] = ramp[::-1]
+			X0 = X0*taper
+
+	# convolve with the weights (the filter is symmetric, so this is the same as a running weighted sum) 
+	def convolve(Y,w):
+		if method == 'fft':
+			nfft = 1
+			while nfft < T+len(w)-1:
+				nfft = 2*nfft
+			C = np.fft.irfft(np.fft.rfft(Y,nfft,axis=-1)*np.fft.rfft(w,nfft),nfft,axis=-1)
+			return C[...,(len(w)-1)//2:(len(w)-1)//2+T]
+		else:
+			C = np.zeros(shape=Y.shape)
+			h = (len(w)-1)//2
+			for ik in range(len(w)):
+				shift = ik-h
+				if abs(shift) >= T:
+					continue
+				if shift >= 0:
+					C[...,0:T-shift] += w[ik]*Y[...,shift:T]
+				else:
+					C[...,-shift:T] += w[ik]*Y[...,0:T+shift]
+			return C
+	FX = convolve(X0,W)
+
+	# the fraction of the filter weight that falls on missing days 
+	if np.any(missing):
+		absW = np.abs(W)
+		missing_weight = convolve(missing.astype(float),absW)/np.sum(absW)
+		FX[missing_weight > max_missing+1E-12] = np.nan
+
+	if edges == 'nan':
+		FX[...,0:min(n,T)] = np.nan
+		FX[...,max(T-n,0):T] = np.nan
+
+	return np.moveaxis(FX,-1,axis)
+
 def var(filtered_anomalies,variable_dimensions,return_as_vector=False):
 
 	# compute the variance of 3Dxtime or 2Dxtime anomaly fields that have been 
@@ -7,6 +7,7 @@ import numpy as np
 import os.path
 from netCDF4 import Dataset
 import DART_state_space as DSS
+import DART as dart
 
 
 #-------- constants 
@@ -73,14 +74,13 @@ def load_Wang_TEM_file(E,datetime_in,hostname='taurus',verbose=False):
 		VV = None
 		if verbose:  
 			print('Loading TEM diagnostics file file '+ff+' and variable '+variable_name)
-		f = Dataset(ff,'r')
-		lat = f.variables['lat'][:]
-		lev = f.variables['lev'][:]
-		time = f.variables['time'][:]
-		VV = f.variables[variable_name][:]
-		if VV is None:
-			print('Unable to find variable '+E['variable']+' in file '+ff)
-		f.close()
+		with dart.netcdf_file(ff) as f:
+			lat = f.variables['lat'][:]
+			lev = f.variables['lev'][:]
+			time = f.variables['time'][:]
+			VV = f.variables[variable_name][:]
+			if VV is None:
+				print('Unable to find variable '+E['variable']+' in file '+ff)
 
 		# bad flag is -999 -- turn it into np.nan
 		# actually there seem to be other large negative numbers in here that aren't physical - 
@@ -340,34 +340,20 @@ def ztrop(z,T,hostname='taurus',debug=False):
 
 	return(ztrop)
 
-def Nsq(T,z,p=None):
+def Nsq(T,z,p=None,axis=0,dims=None):
 
 	"""
-	This is a simple subroutine that computes the buoyancy frequency from 1D arrays of temperature and altitude. 
+	This is a simple subroutine that computes the buoyancy frequency from arrays of temperature and altitude. 
 	INPUTS:
 	T: a temperature profile in Kelvin 
 	z: a vector of altitudes in km
 	p: a vector of pressures in hPa 
 	If pressure is also giveni (must be in hPa), that makes the calculation slightly easier, but it's optional. 
+	axis: T, z, and p can also be arrays of many profiles (e.g. copy x lat x lon x lev), as long as they 
+		broadcast against each other. In that case axis gives the vertical dimension, either as a position 
+		or as a name in the list of dimension names dims. Default is 0. 
+	This calls DART.buoyancy_frequency, which computes all the profiles at once. 
 	"""
 	P0=1000.0
-	Rd = 286.9968933                # Gas constant for dry air        J/degree/kg
-	g = 9.80616                     # Acceleration due to gravity       m/s^2
-	cp = 1005.0                     # heat capacity at constant pressure    m^2/s^2*K
-	H = 7.0				# scale height - 7.0km
-
-	# is a pressure profile given?  
-	if p is None:
-		p = P0*np.exp(-z/H)
-
-	# compute potential temperature 
-	theta = T*(P0/p)**(Rd/cp)
-
-	# compute vertical gradient of pot. temp. 
-	# note that this includes a conversion of altitude from km to meters
-	dZ = np.gradient(z*1.0E3) 
-	dthetadZ = np.gradient(theta,dZ)
-	N2=(g/theta)*dthetadZ
-
-	return(N2)
+	return(dart.buoyancy_frequency(T,P=p,z=z,axis=axis,dims=dims,P0=P0))
 
@@ -99,7 +99,7 @@ def compute_climate_indices(E,index_name,climatology_option = 'NODA',hostname='t
 	# for all indices defined so far, compute the anomaly
 	# with respect to climatology  
 	# this uses an anomaly subroutine from the MJO module  
-	A,C,lat,lon,lev = mjo.ano(E,climatology_option = climatology_option,verbose=verbose)
+	A,C,lat,lon,lev,DR = mjo.ano(E,climatology_option = climatology_option,hostname=hostname,verbose=verbose)
 
 	# Aleutian Low and East European high indices are single points, so just return the anomaly
 	if (index_name == 'Aleutian Low') or (index_name == 'East European High'):
@@ -110,18 +110,17 @@ def load_WACCM_multi_instance_h_file(E,datetime_in,instance,hostname='taurus',ve
 	if os.path.isfile(ff):
 		if verbose:  
 			print('Loading WACCM file '+ff)
-		f = Dataset(ff,'r')
-		lat = f.variables['lat'][:]
-		lon = f.variables['lon'][:]
-		lev = f.variables['lev'][:]
-		time = f.variables['time'][:]
-		variable=E['variable']
-		if E['variable']=='OLR':
-			variable='FLUT'
-		VV = f.variables[variable][:]
-		if VV is None:
-			print('Unable to find variable '+E['variable']+' in file '+ff)
-		f.close()
+		with dart.netcdf_file(ff) as f:
+			lat = f.variables['lat'][:]
+			lon = f.variables['lon'][:]
+			lev = f.variables['lev'][:]
+			time = f.variables['time'][:]
+			variable=E['variable']
+			if E['variable']=='OLR':
+				variable='FLUT'
+			VV = f.variables[variable][:]
+			if VV is None:
+				print('Unable to find variable '+E['variable']+' in file '+ff)
 
 
 		# select the vertical and lat/lon ranges specified in E
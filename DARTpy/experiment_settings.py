@@ -59,6 +59,8 @@ def find_paths(E,date,file_type='diag',hostname='taurus',debug=False):
 
 	The optional input, `file_type`, can have one of these values:  
 	+ 'covariance' -- then we load pre-computed data of covariances between state variables and a given obs  
+	+ 'covariance_series' -- the file where all the covariances for an experiment are collected (see DART_state_space.make_state_to_obs_covariance_series)
+	+ 'aef_series' -- the file where the AAM excitation functions of an experiment are collected (see DART_state_space.make_aef_series)
 	+ 'obs_epoch' -- load obs_epoch_XXXX.nc files  
 	+ 'diag' -- load standard  DART Posterior_Diag or Prior_Diag files 
 	+ 'truth' -- load true state files from a perfect-model simulation
@@ -83,6 +85,12 @@ def find_paths(E,date,file_type='diag',hostname='taurus',debug=False):
 	#------------COVARIANCE FILES  
 	if file_type == 'covariance':
 		fname = E['exp_name']+'_'+'covariance_'+E['obs_name']+'_'+E['variable']+'_'+date.strftime('%Y-%m-%d')+'.nc'
+	if file_type == 'covariance_series':
+		fname = E['exp_name']+'_'+'covariances.nc'
+
+	#------------AAM EXCITATION FUNCTION FILES  
+	if file_type == 'aef_series':
+		fname = E['exp_name']+'_'+'AEFs_'+E['diagn']+'.nc'
 
 
 	#------------OBS EPOCH FILES
@@ -575,6 +583,29 @@ def iers_file_paths(hostname,data_type):
 		}
 	return FP[hostname]
 
+def cache_paths(hostname='taurus',cache_type='obs_epoch'):
+
+	"""
+	Return the directory where pre-processed versions of the input data (e.g. obs_epoch files 
+	converted to dataframes) are cached, for a given computer and type of cache. 
+	The directory is created if it doesn't exist yet. 
+	"""
+	if (hostname=='taurus'):
+		branch='/data/c1/lneef/DARTpy_cache/'
+	else:
+		branch=os.path.join(os.path.expanduser('~'),'.DARTpy_cache/')
+
+	path = branch+cache_type+'/'
+	if not os.path.exists(path):
+		# several processes might try to do this at once, so don't worry if the directory appears in the meantime
+		try:
+			os.makedirs(path)
+		except OSError:
+			if not os.path.isdir(path):
+				raise
+
+	return path
+
 def exp_paths_NCAR(hostname='taurus',experiment='NCAR_FULL'):
 
 	branch = None
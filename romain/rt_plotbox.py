@@ -12,6 +12,9 @@ import matplotlib.cm as cm
 from mpl_toolkits.basemap import Basemap
 import math
 
+# Basemap instances and projected grids, keyed by projection, extent and resolution (see rt_basemap)
+basemap_cache = {}
+
 
 
 def rt_plot_2D( lon,lat,var,\
@@ -36,10 +39,10 @@ def rt_plot_2D( lon,lat,var,\
        ax  = fig.add_subplot(subpltid[0],subpltid[1],subpltid[2])
     else:
        ax  = fig.add_subplot(subpltid)
-    # Create projection
-    m = Basemap(projection='cyl',llcrnrlon=geo[0],urcrnrlon=geo[1],\
-                llcrnrlat=geo[2],urcrnrlat=geo[3],\
-                resolution='l')
+    # Create projection (or reuse the one from a previous map of the same region)
+    m = rt_basemap(projection='cyl',llcrnrlon=geo[0],urcrnrlon=geo[1],\
+                   llcrnrlat=geo[2],urcrnrlat=geo[3],\
+                   resolution='l')
     # Draw coast
     m.drawcoastlines(color=coastlinecolor)
     m.fillcontinents(color=coastcolor,lake_color=lakecolor)
@@ -52,7 +55,8 @@ def rt_plot_2D( lon,lat,var,\
     if is_plot:
         norm = matplotlib.colors.Normalize(vmin=clim[0], vmax=clim[1])
         contours = np.arange(clim[0],clim[1]+cstep,cstep)
-        C = m.contourf(lon,lat,var,contours,cmap=pal,norm=norm,extend='both')
+        x,y = rt_projected_grid(m,lon,lat)
+        C = m.contourf(x,y,var,contours,cmap=pal,norm=norm,extend='both')
         # colorbar
         if colorbar:
             cbar = plt.colorbar(C,orientation='horizontal',shrink=0.8)
@@ -62,6 +66,43 @@ def rt_plot_2D( lon,lat,var,\
 
     return m
 
+def rt_basemap(resolution='l',**kwargs):
+    """
+    Return a Basemap for the given arguments, creating it only once per
+    (projection, extent, resolution): setting up the coastlines takes seconds,
+    and the same instance can draw on any number of axes.
+    """
+    key = (kwargs.get('projection','cyl'),
+           tuple(sorted((k,repr(v)) for k,v in kwargs.items() if k != 'projection')),
+           resolution)
+    if key not in basemap_cache:
+        basemap_cache[key] = {'map':Basemap(resolution=resolution,**kwargs),'grids':{}}
+    return basemap_cache[key]['map']
+
+def rt_projected_grid(m,lon,lat,max_grids=16):
+    """
+    Return the map coordinates x,y of the grid lon,lat (1D axes or 2D arrays)
+    on the Basemap m, keeping them with m if it comes from rt_basemap.
+    """
+    lon = np.asarray(lon)
+    lat = np.asarray(lat)
+    grids = None
+    for entry in basemap_cache.values():
+        if entry['map'] is m:
+            grids = entry['grids']
+            break
+    key = (lon.shape,lat.shape,lon.dtype.str,lat.dtype.str,lon.tobytes(),lat.tobytes())
+    if grids is not None and key in grids:
+        return grids[key]
+    if lon.ndim == 1 and lat.ndim == 1:
+        lon,lat = np.meshgrid(lon,lat)
+    x,y = m(lon,lat)
+    if grids is not None:
+        if len(grids) >= max_grids:
+            grids.clear()
+        grids[key] = (x,y)
+    return x,y
+
 def xaxis_date(fds,step=1,ax=0,date_format='%Y/%m/%d'):
      """
      Put dates on X-axis